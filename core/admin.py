@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import CallbackInbox
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('received_at', 'processed_at')
@@ -0,0 +1,61 @@
+"""
+Shared async HTTP transport
+Pooled httpx.AsyncClient per provider host, for the ASGI request path
+"""
+import asyncio
+import time
+import weakref
+
+import httpx
+
+from . import metrics
+from .transport import TransportSettings, _host_key
+
+# AsyncClient connections belong to the event loop that opened them, so clients
+# are kept per loop (one per ASGI worker in practice) and per host.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def _build_client(transport_settings: TransportSettings) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=transport_settings.pool_maxsize,
+        max_keepalive_connections=transport_settings.pool_maxsize,
+    )
+    timeout = httpx.Timeout(
+        transport_settings.read_timeout,
+        connect=transport_settings.connect_timeout,
+    )
+    # httpx transport retries only cover connection failures, so POSTs are never replayed
+    transport = httpx.AsyncHTTPTransport(retries=transport_settings.max_retries, limits=limits)
+    return httpx.AsyncClient(transport=transport, limits=limits, timeout=timeout,
+                             event_hooks={'request': [_mark_start], 'response': [_record_upstream]})
+
+
+async def _mark_start(request: httpx.Request) -> None:
+    request.extensions['metrics_start'] = time.perf_counter()
+
+
+async def _record_upstream(response: httpx.Response) -> None:
+    # Runs once the response headers are in, which is when the client call returns
+    start = response.request.extensions.get('metrics_start')
+    if start is not None:
+        metrics.record_upstream(str(response.request.url), time.perf_counter() - start)
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """Return the pooled AsyncClient for the host of ``url`` on the running event loop."""
+    loop = asyncio.get_running_loop()
+    per_loop = _clients.setdefault(loop, {})
+    key = _host_key(url)
+    client = per_loop.get(key)
+    if client is None or client.is_closed:
+        client = _build_client(TransportSettings.load())
+        per_loop[key] = client
+    return client
+
+
+async def aclose_all() -> None:
+    """Close the clients opened on the running event loop."""
+    loop = asyncio.get_running_loop()
+    for client in _clients.pop(loop, {}).values():
+        await client.aclose()
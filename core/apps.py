@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import metrics
+
+        connection_created.connect(metrics.install_query_recorder, dispatch_uid='core.metrics.query_recorder')
@@ -0,0 +1,78 @@
+"""
+Async DRF-compatible function views
+DRF's APIView is sync-only, so this wraps a coroutine view with DRF request
+parsing, authentication and permission checks, and renders DRF Responses.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .renderers import TimedJSONRenderer
+
+
+def _authorize(request, permissions):
+    """Authenticate, check permissions and parse the body (sync: touches the DB)."""
+    request.user  # noqa: B018 - forces authentication
+    for permission in permissions:
+        if not permission.has_permission(request, None):
+            if request.authenticators and not request.successful_authenticator:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+    request.data  # noqa: B018 - parse while still off the event loop
+
+
+def _error_response(request, exc):
+    status_code = exc.status_code
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # Same rule as APIView: without a WWW-Authenticate scheme a 401 becomes 403
+        authenticator = request.authenticators[0] if request.authenticators else None
+        auth_header = authenticator.authenticate_header(request) if authenticator else None
+        if not auth_header:
+            status_code = status.HTTP_403_FORBIDDEN
+    return JsonResponse({'detail': exc.detail}, status=status_code)
+
+
+def _render(response):
+    if isinstance(response, Response):
+        response.accepted_renderer = TimedJSONRenderer()
+        response.accepted_media_type = TimedJSONRenderer.media_type
+        response.renderer_context = {}
+        response.render()
+    return response
+
+
+def async_api_view(http_method_names=('POST',), permission_classes=None):
+    """Decorator for ``async def view(request)`` receiving a DRF Request."""
+    allowed = {m.upper() for m in http_method_names}
+    permission_classes = permission_classes or api_settings.DEFAULT_PERMISSION_CLASSES
+
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                return JsonResponse(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED,
+                )
+            drf_request = Request(
+                request,
+                parsers=[JSONParser(), FormParser(), MultiPartParser()],
+                authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+            )
+            try:
+                await sync_to_async(_authorize)(drf_request, [perm() for perm in permission_classes])
+            except exceptions.APIException as exc:
+                return _error_response(drf_request, exc)
+            return _render(await view(drf_request, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,18 @@
+"""
+Helpers shared by the bench_* management commands
+"""
+import time
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a non-empty sample list."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def timed_ms(call, *args, **kwargs):
+    """Run ``call`` and return (result, elapsed milliseconds)."""
+    start = time.perf_counter()
+    result = call(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
@@ -0,0 +1,94 @@
+"""
+Idempotent callback processing
+
+claim(scope, key) must be called inside the transaction that applies a
+provider delivery. The first delivery inserts (scope, key) into
+ProcessedCallback and proceeds; replays hit the unique constraint (or the
+in-process LRU in front of it) and are rejected without reading the
+transaction tables. If the applying transaction rolls back, so does the
+claim, and the next delivery is processed normally.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import ProcessedCallback
+
+
+class RecentKeys:
+    """Thread-safe LRU of keys known to be committed to ProcessedCallback."""
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, item):
+        with self._lock:
+            if item not in self._keys:
+                return False
+            self._keys.move_to_end(item)
+            return True
+
+    def add(self, item):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._keys[item] = None
+            self._keys.move_to_end(item)
+            while len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+recent = RecentKeys(getattr(settings, 'IDEMPOTENCY_CACHE_SIZE', 50_000))
+
+
+def claim(scope, key):
+    """True for the first delivery of (scope, key); False for a replay. Empty keys always pass."""
+    if not key:
+        return True
+    item = (scope, str(key))
+    if item in recent:
+        return False
+    try:
+        with transaction.atomic():
+            ProcessedCallback.objects.create(scope=scope, key=item[1])
+    except IntegrityError:
+        recent.add(item)
+        return False
+    # Only remember the key once it is durable; a rolled-back claim must not block the retry
+    transaction.on_commit(lambda: recent.add(item))
+    return True
+
+
+def unseen(scope, keys):
+    """Keys with no committed claim yet (one query); a cheap pre-filter before loading rows for a batch."""
+    keys = {str(k) for k in keys if k}
+    fresh = {k for k in keys if (scope, k) not in recent}
+    if fresh:
+        seen = set(ProcessedCallback.objects.filter(scope=scope, key__in=fresh).values_list('key', flat=True))
+        for k in seen:
+            recent.add((scope, k))
+        fresh -= seen
+    return fresh
+
+
+def claim_many(scope, keys):
+    """Batch form of claim with one INSERT; returns the keys this caller won."""
+    keys = {str(k) for k in keys if k}
+    if not keys:
+        return set()
+    try:
+        with transaction.atomic():
+            ProcessedCallback.objects.bulk_create([ProcessedCallback(scope=scope, key=k) for k in keys])
+    except IntegrityError:
+        # Someone claimed part of the batch concurrently; settle those key by key
+        return {k for k in keys if claim(scope, k)}
+    transaction.on_commit(lambda: [recent.add((scope, k)) for k in keys])
+    return keys
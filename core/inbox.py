@@ -0,0 +1,167 @@
+"""
+Durable callback inbox
+
+Webhook views call enqueue() to store the raw payload in one INSERT and reply
+to the provider straight away. CallbackInboxConsumer drains the table in
+batches, claiming rows with SELECT ... FOR UPDATE SKIP LOCKED where the
+database supports it so several consumers can run side by side, and hands
+each payload to the handler its app registered for that kind.
+
+Handlers take the payload and return the usual service result dict. A result
+with status 'error' (or an exception) is retried with exponential backoff
+until max_attempts, after which the row is left FAILED for inspection.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import CallbackInbox
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_batch_handlers = {}
+
+
+def register(kind, handler, batch_handler=None):
+    """
+    Route inbox rows of this kind to handler(payload); called from AppConfig.ready().
+
+    batch_handler(payloads), if given, applies many rows of the kind in one go
+    and returns one result per payload. If it raises, the rows fall back to
+    handler one by one.
+    """
+    _handlers[kind] = handler
+    if batch_handler:
+        _batch_handlers[kind] = batch_handler
+
+
+def enabled():
+    return getattr(settings, 'CALLBACK_INBOX_ENABLED', True)
+
+
+def enqueue(kind, payload):
+    return CallbackInbox.objects.create(kind=kind, payload=payload)
+
+
+def dispatch(kind, payload):
+    """Apply one payload now, bypassing the inbox."""
+    return _handlers[kind](payload)
+
+
+def stats():
+    """Queue depth, age of the oldest pending row (lag) and dead-lettered rows, in one query."""
+    now = timezone.now()
+    row = CallbackInbox.objects.aggregate(
+        depth=Count('id', filter=Q(status=CallbackInbox.PENDING)),
+        oldest=Min('received_at', filter=Q(status=CallbackInbox.PENDING)),
+        failed=Count('id', filter=Q(status=CallbackInbox.FAILED)),
+    )
+    return {
+        'depth': row['depth'],
+        'lag_seconds': round((now - row['oldest']).total_seconds(), 3) if row['oldest'] else 0.0,
+        'failed': row['failed'],
+    }
+
+
+class CallbackInboxConsumer:
+    """Applies pending inbox rows in batches.
+
+    The claimed rows stay locked for the whole batch and are written back with
+    one bulk_update. Kinds with a batch handler are applied together in one
+    savepoint; everything else (and any batch that raises) runs row by row,
+    each in its own savepoint so one bad payload cannot roll back the others.
+    """
+
+    UPDATE_FIELDS = ['status', 'attempts', 'available_at', 'last_error', 'processed_at']
+
+    def __init__(self, batch_size=100, max_attempts=8, base_delay=5, max_delay=900):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempts):
+        return timedelta(seconds=min(self.base_delay * (2 ** attempts), self.max_delay))
+
+    def run_once(self):
+        """Process one batch; returns the number of rows claimed."""
+        with transaction.atomic():
+            due = CallbackInbox.objects.filter(status=CallbackInbox.PENDING, available_at__lte=timezone.now())
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            rows = list(due.order_by('available_at', 'id')[:self.batch_size])
+            by_kind = defaultdict(list)
+            for row in rows:
+                by_kind[row.kind].append(row)
+            for kind, group in by_kind.items():
+                if not (kind in _batch_handlers and len(group) > 1 and self._process_batch(kind, group)):
+                    for row in group:
+                        self._process(row)
+            CallbackInbox.objects.bulk_update(rows, self.UPDATE_FIELDS)
+        return len(rows)
+
+    def _process_batch(self, kind, group):
+        try:
+            with transaction.atomic():
+                results = _batch_handlers[kind]([row.payload for row in group])
+        except Exception as e:
+            logger.warning(f"Batch apply of {len(group)} {kind} callback(s) failed, retrying one by one: {e}")
+            return False
+        for row, result in zip(group, results):
+            self._record(row, result)
+        return True
+
+    def _process(self, row):
+        handler = _handlers.get(row.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for {row.kind}')
+            with transaction.atomic():
+                result = handler(row.payload)
+        except Exception as e:
+            result = e
+        self._record(row, result)
+
+    def _record(self, row, result):
+        """Mark the row done, or schedule a retry / dead-letter it for an exception or error result."""
+        now = timezone.now()
+        row.attempts += 1
+        if isinstance(result, Exception):
+            error = str(result)
+        elif isinstance(result, dict) and result.get('status') == 'error':
+            error = result.get('message') or 'Handler reported an error'
+        else:
+            row.status = CallbackInbox.DONE
+            row.last_error = ''
+            row.processed_at = now
+            return
+
+        row.last_error = error
+        if row.attempts >= self.max_attempts:
+            logger.error(f"Callback {row.kind} #{row.pk} failed after {row.attempts} attempts: {error}")
+            row.status = CallbackInbox.FAILED
+            row.processed_at = now
+        else:
+            row.available_at = now + self.backoff(row.attempts)
+
+    def run_forever(self, interval=1, stop_event=None):
+        """Daemon loop: drain due rows, then sleep until the next tick."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.error(f"Error draining callback inbox: {e}")
+                processed = 0
+            if processed:
+                logger.info(f"Callback inbox: applied {processed} row(s), {stats()}")
+            if processed < self.batch_size:
+                stop_event.wait(interval)
@@ -0,0 +1,221 @@
+"""
+Benchmark: end-to-end throughput of the payment endpoints against the provider simulator
+
+Starts core.simulator in-process, points the Daraja and MoMo clients at it
+and drives the real views (URL routing, DRF, services, ORM) with
+--concurrency threads:
+
+    stk_push      POST /mpesa/stk-push/
+    b2c_send      POST /mpesa/send-money/
+    mtn_collect   POST /mtnmo/collect/
+    mtn_disburse  POST /mtnmo/disburse/
+    stk_callback  POST /mpesa/stk-callback/ (a callback storm for seeded rows)
+
+For each scenario it prints requests/sec, p50/p95/p99 latency and database
+queries per request. The simulator's own callbacks are delivered back into
+the app while the initiation scenarios run, as they would be in production.
+
+    python manage.py bench_e2e --requests 500 --concurrency 8 --latency-ms 150 --json main.json
+    python manage.py bench_e2e --requests 500 --concurrency 8 --latency-ms 150 --baseline main.json
+
+--baseline prints the change against an earlier --json run (e.g. from
+another branch). Requests are authenticated with force_authenticate, so
+session/token lookups are not counted. Rows written by the run are removed
+afterwards, but the daily rollups are not: run it against a scratch database.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.benchmarks import percentile
+from core.models import CallbackInbox, ProcessedCallback
+from core.simulator import ProviderSimulator, SimulatorConfig, make_server
+from mpesa.models import MpesaB2CTransaction, MpesaTransaction
+from mtnmo import clients as momo_clients
+from mtnmo.models import CollectionCallback, CollectionTransaction, DisbursementCallback, DisbursementTransaction
+from reporting.models import LedgerEntry
+
+PREFIX = 'bench-'
+SCENARIOS = ('stk_push', 'b2c_send', 'mtn_collect', 'mtn_disburse', 'stk_callback')
+
+# Credentials the services insist on; any value works against the simulator
+PLACEHOLDER_ENV = {
+    'CONSUMER_KEY': 'bench', 'CONSUMER_SECRET': 'bench', 'PASSKEY': 'bench', 'BUSINESS_SHORTCODE': '174379',
+    'SECURITY_CREDENTIAL': 'bench', 'CALLBACK_URL': 'http://testserver/mpesa/stk-callback/',
+    'B2C_RESULT_URL': 'http://testserver/mpesa/b2c-result/', 'B2C_QUEUE_TIMEOUT_URL': 'http://testserver/mpesa/b2c-timeout/',
+}
+
+
+def _phone(i):
+    return f'2547{i % 100_000_000:08d}'
+
+
+def _stk_callback(i):
+    # ResultCode 1032 (cancelled by user) keeps subscription side effects out of the measurement
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'{PREFIX}mr-{i}', 'CheckoutRequestID': f'{PREFIX}ws-{i}',
+        'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user',
+    }}}
+
+
+REQUESTS = {
+    'stk_push': lambda i: ('/mpesa/stk-push/', {'phone': _phone(i), 'amount': 10,
+                                                'account_reference': f'{PREFIX}{i}'}),
+    'b2c_send': lambda i: ('/mpesa/send-money/', {'phone': _phone(i), 'amount': 10, 'reference': f'{PREFIX}{i}'}),
+    'mtn_collect': lambda i: ('/mtnmo/collect/', {'amount': '10', 'phone': '231770000000',
+                                                  'external_id': f'{PREFIX}col-{i}', 'currency': 'LRD'}),
+    'mtn_disburse': lambda i: ('/mtnmo/disburse/', {'amount': '10', 'phone': '231770000000',
+                                                    'external_id': f'{PREFIX}dis-{i}', 'currency': 'LRD'}),
+    'stk_callback': lambda i: ('/mpesa/stk-callback/', _stk_callback(i)),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure rps, latency percentiles and queries per request of the payment endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help='Measured requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Repeat to pick several')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated provider latency')
+        parser.add_argument('--jitter-ms', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--json', help='Write the results here')
+        parser.add_argument('--baseline', help='Compare against results written by an earlier --json run')
+
+    def handle(self, *args, **options):
+        self._local = threading.local()
+        self.started = timezone.now()
+        simulator = ProviderSimulator(SimulatorConfig(
+            latency_ms=options['latency_ms'], jitter_ms=options['jitter_ms'], error_rate=options['error_rate'],
+            callback_delay_ms=0,
+        ), deliver=self._deliver)
+        server = make_server(simulator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        saved_env = {key: os.environ.get(key) for key in [*PLACEHOLDER_ENV, 'DARAJA_BASE_URL', 'MTN_MOMO_BASE_URL']}
+        for key, value in PLACEHOLDER_ENV.items():
+            os.environ.setdefault(key, value)
+        os.environ['DARAJA_BASE_URL'] = os.environ['MTN_MOMO_BASE_URL'] = base
+        momo_clients.reset()
+        self.user, _ = get_user_model().objects.get_or_create(username=f'{PREFIX}loadtest')
+
+        results = {}
+        count, warmup = options['requests'], options['warmup']
+        try:
+            for name in options['scenario'] or SCENARIOS:
+                if name == 'stk_callback':
+                    self._seed_stk(warmup + count)
+                self._run(name, range(warmup), options['concurrency'])
+                results[name] = self._summarise(self._run(name, range(warmup, warmup + count), options['concurrency']))
+        finally:
+            server.shutdown()
+            server.server_close()
+            simulator.shutdown()
+            momo_clients.reset()
+            for key, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            self._cleanup()
+
+        self._report(results, options['baseline'])
+        self.stdout.write(f"simulator: {', '.join(f'{k}={v}' for k, v in simulator.stats.items())}")
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = APIClient()
+            client.force_authenticate(self.user)
+        return client
+
+    def _deliver(self, url, payload):
+        # Simulator callbacks go straight into the app instead of over the network
+        self._client().post(urlsplit(url).path, payload, format='json')
+
+    def _request(self, name, i):
+        path, body = REQUESTS[name](i)
+        queries = [0]
+
+        def count_query(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            start = time.perf_counter()
+            response = self._client().post(path, body, format='json')
+            elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, queries[0], response.status_code < 400
+
+    def _run(self, name, indexes, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(lambda i: self._request(name, i), indexes))
+        return samples, time.perf_counter() - start
+
+    def _summarise(self, run):
+        samples, wall = run
+        latencies = [ms for ms, _, _ in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for _, _, ok in samples if not ok),
+            'rps': round(len(samples) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries_per_request': round(sum(q for _, q, _ in samples) / len(samples), 2),
+        }
+
+    def _report(self, results, baseline_path):
+        baseline = {}
+        if baseline_path:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        self.stdout.write(f"{'scenario':<14}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                          f"{'queries/req':>13}{'errors':>8}")
+        for name, r in results.items():
+            self.stdout.write(f"{name:<14}{r['rps']:>9.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                              f"{r['queries_per_request']:>13.2f}{r['errors']:>8}")
+            before = baseline.get(name)
+            if before:
+                change = '  '.join(
+                    f"{key} {(r[key] - before[key]) / before[key] * 100:+.1f}%"
+                    for key in ('rps', 'p95_ms', 'queries_per_request') if before[key]
+                )
+                self.stdout.write(f"{'':<14}vs baseline: {change}")
+
+    def _seed_stk(self, count):
+        with transaction.atomic():
+            MpesaTransaction.objects.bulk_create([
+                MpesaTransaction(merchant_request_id=f'{PREFIX}mr-{i}', checkout_request_id=f'{PREFIX}ws-{i}',
+                                 result_desc='Payment request initiated', amount=10, user_id=self.user.pk)
+                for i in range(count)
+            ], batch_size=5000)
+
+    def _cleanup(self):
+        started = self.started
+        MpesaTransaction.objects.filter(user_id=self.user.pk).delete()
+        MpesaB2CTransaction.objects.filter(user_id=self.user.pk).delete()
+        CollectionTransaction.objects.filter(external_id__startswith=PREFIX).delete()
+        CollectionCallback.objects.filter(external_id__startswith=PREFIX).delete()
+        DisbursementTransaction.objects.filter(external_id__startswith=PREFIX).delete()
+        DisbursementCallback.objects.filter(external_id__startswith=PREFIX).delete()
+        CallbackInbox.objects.filter(received_at__gte=started).delete()
+        ProcessedCallback.objects.filter(created_at__gte=started).delete()
+        LedgerEntry.objects.filter(Q(user_id=self.user.pk) | Q(reference__startswith=PREFIX)).purge()
+        self.user.delete()
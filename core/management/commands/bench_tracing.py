@@ -0,0 +1,99 @@
+"""
+Benchmark: per-request cost of each Sentry tracing mode
+
+Runs the same mix of requests (a list read and a provider callback) through
+the real WSGI handler, with Sentry's Django integration active, once per mode:
+
+    off    errors only
+    head   core.tracing defaults: per-endpoint sampling decided up front
+    tail   every request recorded, most dropped before sending
+    full   the old configuration: every request traced and profiled
+
+Events go to a null transport, so no network time is included and nothing
+reaches Sentry.
+
+    python manage.py bench_tracing --requests 2000
+"""
+import io
+import json
+from wsgiref.util import setup_testing_defaults
+
+import sentry_sdk
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from sentry_sdk.transport import Transport
+
+from core import tracing
+from core.benchmarks import percentile, timed_ms
+from core.models import CallbackInbox
+
+MODES = {
+    'off': lambda: tracing.sentry_options(tracing.TracingSettings(mode=tracing.OFF)),
+    'head': lambda: tracing.sentry_options(tracing.TracingSettings(mode=tracing.HEAD)),
+    'tail': lambda: tracing.sentry_options(tracing.TracingSettings(mode=tracing.TAIL)),
+    'full': lambda: {'dsn': tracing.DEFAULT_DSN, 'traces_sample_rate': 1.0, 'profiles_sample_rate': 1.0},
+}
+
+CALLBACK = json.dumps({'Body': {'stkCallback': {
+    'MerchantRequestID': 'bench-mr', 'CheckoutRequestID': 'bench-tracing', 'ResultCode': 1032,
+    'ResultDesc': 'Request cancelled by user',
+}}}).encode()
+
+
+class _NullTransport(Transport):
+    def __init__(self, options=None):
+        super().__init__(options)
+        self.envelopes = 0
+
+    def capture_envelope(self, envelope):
+        self.envelopes += 1
+
+
+def _environ(method, path, body=b''):
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    return environ
+
+
+class Command(BaseCommand):
+    help = 'Measure per-request overhead of the Sentry tracing modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode')
+        parser.add_argument('--mode', action='append', choices=MODES, help='Repeat to pick several')
+
+    def handle(self, *args, **options):
+        app = get_wsgi_application()
+        requests = [('GET', '/mtnmo/collection/transactions/', b''), ('POST', '/mpesa/stk-callback/', CALLBACK)]
+
+        def call(method, path, body):
+            response = app(_environ(method, path, body), lambda status, headers, exc_info=None: None)
+            for _ in response:
+                pass
+            response.close()
+
+        results = {}
+        try:
+            for mode in options['mode'] or MODES:
+                transport = _NullTransport()
+                sentry_sdk.init(**MODES[mode](), transport=transport)
+                for i in range(50):  # warm-up
+                    call(*requests[i % len(requests)])
+                transport.envelopes = 0
+                samples = [timed_ms(call, *requests[i % len(requests)])[1] for i in range(options['requests'])]
+                sentry_sdk.flush()
+                results[mode] = (samples, transport.envelopes)
+        finally:
+            CallbackInbox.objects.filter(payload__Body__stkCallback__CheckoutRequestID='bench-tracing').delete()
+            tracing.init_sentry()
+
+        base = sum(results['off'][0]) / len(results['off'][0]) if 'off' in results else None
+        self.stdout.write(f"{'mode':<8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'overhead':>10}{'envelopes':>11}")
+        for mode, (samples, envelopes) in results.items():
+            mean = sum(samples) / len(samples)
+            overhead = f'{(mean - base) / base * 100:+.1f}%' if base else '-'
+            self.stdout.write(f"{mode:<8}{mean:>10.3f}{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}"
+                              f"{overhead:>10}{envelopes:>11}")
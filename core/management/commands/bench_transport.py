@@ -0,0 +1,85 @@
+"""
+Benchmark: fresh connections vs the pooled transport against a local stub server
+
+    python manage.py bench_transport --requests 500 --handshake-ms 20
+"""
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import percentile
+from core.transport import PooledSession, TransportSettings
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+    handshake_delay = 0.0
+
+    def setup(self):
+        # Runs once per TCP connection; stands in for the TLS handshake cost
+        if self.handshake_delay:
+            time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        body = json.dumps({'ResponseCode': '0', 'ResponseDescription': 'Success'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compare p50/p95 latency of fresh connections vs pooled keep-alive sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--handshake-ms', type=float, default=0.0,
+                            help='Simulated per-connection setup cost (e.g. TLS) on the stub server')
+
+    def handle(self, *args, **options):
+        _StubHandler.handshake_delay = options['handshake_ms'] / 1000
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/mpesa/stkpush/v1/processrequest"
+        payload = {'Amount': 1, 'PhoneNumber': '254700000000'}
+
+        try:
+            fresh = self._run(lambda: requests.post(url, json=payload, timeout=10), options['requests'])
+            session = PooledSession(TransportSettings.load())
+            pooled = self._run(lambda: session.post(url, json=payload), options['requests'])
+            session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.stdout.write(f"{'mode':<8}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+        for name, samples in (('fresh', fresh), ('pooled', pooled)):
+            self.stdout.write(
+                f"{name:<8}{percentile(samples, 50):>10.2f}{percentile(samples, 95):>10.2f}"
+                f"{statistics.mean(samples):>10.2f}"
+            )
+        speedup = percentile(fresh, 50) / max(percentile(pooled, 50), 1e-9)
+        self.stdout.write(self.style.SUCCESS(f"p50 speedup with connection reuse: {speedup:.1f}x"))
+
+    def _run(self, call, count):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = call()
+            response.raise_for_status()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
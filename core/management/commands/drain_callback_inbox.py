@@ -0,0 +1,52 @@
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core import inbox
+
+
+class Command(BaseCommand):
+    help = 'Apply provider callbacks stored in the callback inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds to sleep when no rows are due')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent consumers (needs SKIP LOCKED)')
+        parser.add_argument('--max-attempts', type=int, default=8)
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and lag, then exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            s = inbox.stats()
+            self.stdout.write(f"depth={s['depth']} lag_seconds={s['lag_seconds']} failed={s['failed']}")
+            return
+
+        consumer = inbox.CallbackInboxConsumer(batch_size=options['batch_size'],
+                                               max_attempts=options['max_attempts'])
+        if not options['daemon']:
+            processed = consumer.run_once()
+            self.stdout.write(self.style.SUCCESS(f'Applied {processed} callback(s)'))
+            return
+
+        workers = options['workers']
+        if workers > 1 and not connection.features.has_select_for_update_skip_locked:
+            self.stderr.write(f'{connection.vendor} has no SKIP LOCKED; running a single consumer')
+            workers = 1
+
+        self.stdout.write(f'Draining callback inbox with {workers} consumer(s) (Ctrl+C to stop)...')
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=consumer.run_forever, kwargs={'interval': options['interval'], 'stop_event': stop},
+                             name=f'callback-inbox-{n}', daemon=True)
+            for n in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
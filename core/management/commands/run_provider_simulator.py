@@ -0,0 +1,58 @@
+"""
+Serve simulated Daraja, MTN MoMo, PayHero, Paystack and Stripe endpoints locally
+
+    python manage.py run_provider_simulator --port 9090 --latency-ms 250 --jitter-ms 100 \\
+        --error-rate 0.02 --decline-rate 0.1 --callback-base http://127.0.0.1:8000
+
+then start the app with the provider base URLs pointed at it:
+
+    DARAJA_BASE_URL=http://127.0.0.1:9090 MTN_MOMO_BASE_URL=http://127.0.0.1:9090 \\
+    PAYHERO_BASE_URL=http://127.0.0.1:9090 PAYSTACK_BASE_URL=http://127.0.0.1:9090/ \\
+    STRIPE_API_BASE=http://127.0.0.1:9090 python manage.py runserver
+"""
+from django.core.management.base import BaseCommand
+
+from core.simulator import ProviderSimulator, SimulatorConfig, make_server
+
+
+class Command(BaseCommand):
+    help = 'Run a local stub of the payment providers with injectable latency, errors and callbacks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9090)
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Added to every response')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform +/- spread around --latency-ms')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failed upstream')
+        parser.add_argument('--error-status', type=int, default=503)
+        parser.add_argument('--decline-rate', type=float, default=0.0,
+                            help='Fraction of accepted payments whose callback reports a failure')
+        parser.add_argument('--callback-delay-ms', type=float, default=100.0)
+        parser.add_argument('--callback-base', default='',
+                            help='Send callbacks here instead of the host in the callback URL (e.g. http://127.0.0.1:8000)')
+        parser.add_argument('--callback-workers', type=int, default=16)
+        parser.add_argument('--no-callbacks', action='store_true')
+
+    def handle(self, *args, **options):
+        simulator = ProviderSimulator(SimulatorConfig(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            decline_rate=options['decline_rate'],
+            callback_delay_ms=options['callback_delay_ms'],
+            callbacks=not options['no_callbacks'],
+            callback_base=options['callback_base'],
+            callback_workers=options['callback_workers'],
+        ))
+        server = make_server(simulator, options['host'], options['port'])
+        host, port = server.server_address[:2]
+        self.stdout.write(f'Provider simulator on http://{host}:{port} (Ctrl+C to stop)...')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            simulator.shutdown()
+            self.stdout.write(', '.join(f'{key}={value}' for key, value in simulator.stats.items()))
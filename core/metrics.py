@@ -0,0 +1,209 @@
+"""
+Request instrumentation
+
+RequestMetricsMiddleware opens a RequestTimings for every request in a
+context variable. Three hooks fill it in: a query wrapper on every database
+connection, the pooled HTTP transports (record_upstream), and the JSON
+renderer (serialization time). When the request finishes its totals go into
+the process-wide registry, which /metrics renders in the Prometheus text
+format, and into a Server-Timing header on the response.
+
+Context variables follow the request into sync_to_async threads, so sync and
+async views are both covered. Counters are per process: scrape every worker.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROVIDER_HOSTS = (
+    ('safaricom', 'mpesa'),
+    ('momo', 'mtnmo'),
+    ('payhero', 'payhero'),
+    ('paystack', 'paystack'),
+    ('stripe', 'stripe'),
+)
+
+# Path segments that are ids (uuids, numbers, long references) collapse to {id}
+_ID_SEGMENT = re.compile(r'^(?:[0-9a-fA-F-]{32,36}|\d+|(?=.*\d)[\w-]{16,})$')
+
+_current: ContextVar = ContextVar('request_timings', default=None)
+
+
+def enabled():
+    return getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+
+
+class RequestTimings:
+    """What one request spent in the database, in provider calls and rendering."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.upstream = defaultdict(lambda: [0, 0.0])  # (provider, endpoint) -> [calls, seconds]
+        self.serialize_seconds = 0.0
+
+    def server_timing(self, total_seconds):
+        """Server-Timing header value: db, each provider endpoint, serialize and total, in ms."""
+        parts = [f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_queries} queries"']
+        for (provider, endpoint), (calls, seconds) in self.upstream.items():
+            name = re.sub(r'[^\w-]+', '-', f'{provider}{endpoint}').strip('-')
+            parts.append(f'{name};dur={seconds * 1000:.1f};desc="{calls} call(s)"')
+        parts.append(f'serialize;dur={self.serialize_seconds * 1000:.1f}')
+        parts.append(f'total;dur={total_seconds * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def begin():
+    """Start timing a request; returns the token end() needs."""
+    return _current.set(RequestTimings())
+
+
+def end(token):
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+def current():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper installed on every connection (see CoreConfig.ready)."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def provider_for(url):
+    host = urlsplit(url).hostname or ''
+    for needle, provider in PROVIDER_HOSTS:
+        if needle in host:
+            return provider
+    return host or 'unknown'
+
+
+def endpoint_for(url):
+    segments = urlsplit(url).path.split('/')
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in segments) or '/'
+
+
+def record_upstream(url, seconds):
+    """Called by the HTTP transports after every provider call, successful or not."""
+    key = (provider_for(url), endpoint_for(url))
+    registry.observe_upstream(key, seconds)
+    timings = _current.get()
+    if timings is not None:
+        entry = timings.upstream[key]
+        entry[0] += 1
+        entry[1] += seconds
+
+
+class Registry:
+    """Process-wide counters and the request duration histogram."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (method, endpoint, status) -> requests
+            self.requests = defaultdict(int)
+            # (method, endpoint) -> [duration sum, db queries, db seconds, serialize seconds, bucket counts...]
+            self.by_endpoint = defaultdict(lambda: [0.0, 0, 0.0, 0.0] + [0] * len(DURATION_BUCKETS))
+            self.upstream = defaultdict(lambda: [0, 0.0])
+
+    def observe_request(self, method, endpoint, status, seconds, timings):
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+            row = self.by_endpoint[(method, endpoint)]
+            row[0] += seconds
+            row[1] += timings.db_queries
+            row[2] += timings.db_seconds
+            row[3] += timings.serialize_seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    row[4 + i] += 1
+
+    def observe_upstream(self, key, seconds):
+        with self._lock:
+            entry = self.upstream[key]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            requests = dict(self.requests)
+            by_endpoint = {key: list(row) for key, row in self.by_endpoint.items()}
+            upstream = {key: list(entry) for key, entry in self.upstream.items()}
+
+        counts = defaultdict(int)
+        for (method, endpoint, _), n in requests.items():
+            counts[(method, endpoint)] += n
+
+        lines = ['# HELP http_requests_total Requests handled, by endpoint and status.',
+                 '# TYPE http_requests_total counter']
+        for (method, endpoint, status), n in sorted(requests.items()):
+            lines.append(f'http_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {n}')
+
+        lines += ['# HELP http_request_duration_seconds Request wall time.',
+                  '# TYPE http_request_duration_seconds histogram']
+        for (method, endpoint), row in sorted(by_endpoint.items()):
+            for bound, n in zip(DURATION_BUCKETS, row[4:]):
+                lines.append(f'http_request_duration_seconds_bucket'
+                             f'{_labels(method=method, endpoint=endpoint, le=bound)} {n}')
+            total = counts[(method, endpoint)]
+            lines.append(f'http_request_duration_seconds_bucket{_labels(method=method, endpoint=endpoint, le="+Inf")} '
+                         f'{total}')
+            lines.append(f'http_request_duration_seconds_sum{_labels(method=method, endpoint=endpoint)} {row[0]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{_labels(method=method, endpoint=endpoint)} {total}')
+
+        for index, name, kind, help_text in (
+            (1, 'http_request_db_queries_total', 'counter', 'Database queries run while handling requests.'),
+            (2, 'http_request_db_seconds_total', 'counter', 'Time spent in database queries.'),
+            (3, 'http_request_serialize_seconds_total', 'counter', 'Time spent rendering response bodies.'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (method, endpoint), row in sorted(by_endpoint.items()):
+                lines.append(f'{name}{_labels(method=method, endpoint=endpoint)} {row[index]:g}')
+
+        lines += ['# HELP upstream_requests_total Calls to payment providers.',
+                  '# TYPE upstream_requests_total counter']
+        for (provider, endpoint), (calls, _) in sorted(upstream.items()):
+            lines.append(f'upstream_requests_total{_labels(provider=provider, endpoint=endpoint)} {calls}')
+        lines += ['# HELP upstream_request_seconds_total Time spent waiting on payment providers.',
+                  '# TYPE upstream_request_seconds_total counter']
+        for (provider, endpoint), (_, seconds) in sorted(upstream.items()):
+            lines.append(f'upstream_request_seconds_total{_labels(provider=provider, endpoint=endpoint)} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
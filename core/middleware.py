@@ -0,0 +1,53 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+
+class RequestMetricsMiddleware:
+    """Time each request (see core.metrics) and add a Server-Timing header.
+
+    Works in both the WSGI and ASGI stacks without a thread hop. Requests are
+    labelled with their URL route pattern, so ids in the path do not blow up
+    the number of series.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+        token = metrics.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.end(token)
+        return self._finish(request, response, timings)
+
+    async def __acall__(self, request):
+        if not metrics.enabled():
+            return await self.get_response(request)
+        token = metrics.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.end(token)
+        return self._finish(request, response, timings)
+
+    def _finish(self, request, response, timings):
+        elapsed = time.perf_counter() - timings.start
+        match = getattr(request, 'resolver_match', None)
+        endpoint = f'/{match.route}' if match and match.route else 'unmatched'
+        metrics.registry.observe_request(request.method, endpoint, response.status_code, elapsed, timings)
+        response['Server-Timing'] = timings.server_timing(elapsed)
+        return response
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_callback_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50)),
+                ('key', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='processedcallback',
+            constraint=models.UniqueConstraint(fields=('scope', 'key'), name='core_processed_callback_key'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from django.db import models
+from django.utils import timezone
+
+
+class CallbackInbox(models.Model):
+    """Raw provider callback, stored on receipt and applied later by drain_callback_inbox."""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)  # handler key, e.g. mpesa.stk
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # retries are pushed back with backoff
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='core_inbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class ProcessedCallback(models.Model):
+    """One row per provider delivery already applied; the unique key makes replays no-ops."""
+
+    scope = models.CharField(max_length=50)  # e.g. mpesa.stk, mtnmo.disbursement, stripe
+    key = models.CharField(max_length=255)  # provider id: CheckoutRequestID, ConversationID, event id...
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='core_processed_callback_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
@@ -0,0 +1,37 @@
+"""
+Client-side rate limiting for outbound provider calls
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread-safe token bucket.
+
+    ``acquire()`` blocks until a token is available, so a worker pool of any
+    size never exceeds ``rate`` calls per second (plus an initial ``burst``).
+    A rate of 0 or None disables limiting.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate or 0)
+        self.capacity = float(burst or max(self.rate, 1))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
@@ -0,0 +1,18 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that adds its render time to the request's serialize timing."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        start = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            timings = metrics.current()
+            if timings is not None:
+                timings.serialize_seconds += time.perf_counter() - start
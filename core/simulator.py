@@ -0,0 +1,370 @@
+"""
+Local provider simulator
+
+A stand-in for Daraja, MTN MoMo, PayHero, Paystack and Stripe that serves the
+endpoints our clients call, so the payment paths can be load tested offline.
+Point the clients at it with the base URL overrides (DARAJA_BASE_URL,
+MTN_MOMO_BASE_URL, PAYHERO_BASE_URL, PAYSTACK_BASE_URL, STRIPE_API_BASE) and
+run `manage.py run_provider_simulator`.
+
+Every request waits latency_ms (+/- jitter_ms) and fails with error_status at
+error_rate. Accepted STK pushes, B2C payments, MoMo request-to-pay/transfers
+and PayHero payments get their asynchronous result POSTed to the callback URL
+the client supplied, callback_delay_ms later, in the shape our callback views
+parse. decline_rate of those results report a failed payment.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .transport import get_session
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SimulatorConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    decline_rate: float = 0.0
+    callback_delay_ms: float = 100.0
+    callbacks: bool = True
+    # Replaces scheme://host of every callback URL (MoMo callback hosts are fixed in the clients)
+    callback_base: str = ''
+    callback_workers: int = 16
+
+
+def _receipt():
+    return uuid.uuid4().hex[:10].upper()
+
+
+class ProviderSimulator:
+    """Routes simulated provider requests and schedules their callbacks.
+
+    Handlers take (simulator, match, request) and return (status, body). The
+    results kept here (by CheckoutRequestID, MoMo reference and PayHero
+    reference) are only what the status endpoints need to answer consistently.
+    """
+
+    def __init__(self, config=None, deliver=None):
+        self.config = config or SimulatorConfig()
+        self.deliver = deliver or self._post
+        self.results = {}  # provider reference -> final result, for status lookups
+        self.stats = {'requests': 0, 'errors': 0, 'callbacks': 0, 'callback_failures': 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.config.callback_workers,
+                                            thread_name_prefix='simulator-callback')
+        routes = [
+            ('GET', r'/oauth/v1/generate', daraja_token),
+            ('POST', r'/mpesa/stkpush/v1/processrequest', daraja_stk_push),
+            ('POST', r'/mpesa/stkpushquery/v1/query', daraja_stk_query),
+            ('POST', r'/mpesa/b2c/v\d+/paymentrequest', daraja_b2c),
+            ('POST', r'/v1_0/apiuser', momo_api_user),
+            ('POST', r'/v1_0/apiuser/(?P<user>[^/]+)/apikey', momo_api_key),
+            ('POST', r'/(?P<product>collection|disbursement)/token/?', momo_token),
+            ('GET', r'/(?P<product>collection|disbursement)/v1_0/account/balance', momo_balance),
+            ('POST', r'/collection/v1_0/requesttopay', momo_request_to_pay),
+            ('GET', r'/collection/v1_0/requesttopay/(?P<ref>[^/]+)', momo_status),
+            ('POST', r'/disbursement/v1_0/transfer', momo_transfer),
+            ('GET', r'/disbursement/v1_0/transfer/(?P<ref>[^/]+)', momo_status),
+            ('POST', r'/api/v2/payments', payhero_payment),
+            ('GET', r'/api/v2/transaction-status', payhero_status),
+            ('GET', r'/api/v2/transactions', payhero_transactions),
+            ('GET', r'/api/v2/(?:wallets|payment_channels/\d+)', payhero_balance),
+            ('POST', r'/api/v2/(?:withdraw|topup)', payhero_queued),
+            ('GET', r'/transaction/verify/(?P<ref>[^/]+)', paystack_verify),
+            ('POST', r'/v1/checkout/sessions', stripe_checkout_session),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in routes]
+
+    def handle(self, method, path, headers, body):
+        """Return (status, body) for one request, after the configured latency and error injection."""
+        config = self.config
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        with self._lock:
+            self.stats['requests'] += 1
+
+        url = urlsplit(path)
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, {'errorMessage': f'No simulated endpoint for {method} {url.path}'}
+
+        if random.random() < config.error_rate:
+            with self._lock:
+                self.stats['errors'] += 1
+            return config.error_status, {'errorCode': 'simulated', 'errorMessage': 'Simulated upstream failure'}
+        request = {'headers': headers, 'query': parse_qs(url.query), 'json': _json(body), 'raw': body}
+        return handler(self, match, request)
+
+    def declined(self):
+        return random.random() < self.config.decline_rate
+
+    def callback(self, url, payload):
+        """Deliver payload to url callback_delay_ms from now, off the request thread."""
+        if not (self.config.callbacks and url):
+            return
+        if self.config.callback_base:
+            parts = urlsplit(url)
+            url = self.config.callback_base.rstrip('/') + parts.path + (f'?{parts.query}' if parts.query else '')
+        self._executor.submit(self._send, url, payload)
+
+    def _send(self, url, payload):
+        if self.config.callback_delay_ms:
+            time.sleep(self.config.callback_delay_ms / 1000)
+        try:
+            self.deliver(url, payload)
+            key = 'callbacks'
+        except Exception as e:
+            logger.warning(f"Simulated callback to {url} failed: {e}")
+            key = 'callback_failures'
+        with self._lock:
+            self.stats[key] += 1
+
+    def _post(self, url, payload):
+        get_session(url).post(url, json=payload).raise_for_status()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _json(body):
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        return {}
+
+
+# ---- Daraja ----
+
+def daraja_token(sim, match, request):
+    return 200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'}
+
+
+def daraja_stk_push(sim, match, request):
+    data = request['json']
+    merchant_id, checkout_id = f'sim-{uuid.uuid4().hex[:12]}', f'ws_CO_sim_{uuid.uuid4().hex[:16]}'
+    if sim.declined():
+        result = {'MerchantRequestID': merchant_id, 'CheckoutRequestID': checkout_id,
+                  'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user'}
+    else:
+        result = {
+            'MerchantRequestID': merchant_id, 'CheckoutRequestID': checkout_id,
+            'ResultCode': 0, 'ResultDesc': 'The service request is processed successfully.',
+            'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': data.get('Amount')},
+                {'Name': 'MpesaReceiptNumber', 'Value': _receipt()},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': int(data.get('PhoneNumber') or 0)},
+            ]},
+        }
+    sim.results[checkout_id] = result
+    sim.callback(data.get('CallBackURL'), {'Body': {'stkCallback': result}})
+    return 200, {
+        'MerchantRequestID': merchant_id, 'CheckoutRequestID': checkout_id, 'ResponseCode': '0',
+        'ResponseDescription': 'Success. Request accepted for processing',
+        'CustomerMessage': 'Success. Request accepted for processing',
+    }
+
+
+def daraja_stk_query(sim, match, request):
+    checkout_id = request['json'].get('CheckoutRequestID')
+    result = sim.results.get(checkout_id)
+    if result is None:
+        return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+    return 200, {'ResponseCode': '0', 'ResponseDescription': 'The service request has been accepted successsfully',
+                 'MerchantRequestID': result['MerchantRequestID'], 'CheckoutRequestID': checkout_id,
+                 'ResultCode': str(result['ResultCode']), 'ResultDesc': result['ResultDesc']}
+
+
+def daraja_b2c(sim, match, request):
+    data = request['json']
+    conversation_id = f'AG_sim_{uuid.uuid4().hex[:16]}'
+    originator_id = data.get('OriginatorConversationID') or f'sim-{uuid.uuid4().hex[:12]}'
+    result = {'ResultType': 0, 'OriginatorConversationID': originator_id, 'ConversationID': conversation_id,
+              'TransactionID': _receipt()}
+    if sim.declined():
+        result.update(ResultCode=2001, ResultDesc='The initiator information is invalid.')
+    else:
+        result.update(ResultCode=0, ResultDesc='The service request is processed successfully.', ResultParameters={
+            'ResultParameter': [
+                {'Key': 'TransactionAmount', 'Value': data.get('Amount')},
+                {'Key': 'TransactionReceipt', 'Value': result['TransactionID']},
+                {'Key': 'ReceiverPartyPublicName', 'Value': f"{data.get('PartyB')} - Simulated Customer"},
+                {'Key': 'TransactionCompletedDateTime', 'Value': datetime.now().strftime('%d.%m.%Y %H:%M:%S')},
+                {'Key': 'B2CUtilityAccountAvailableFunds', 'Value': 100000.00},
+                {'Key': 'B2CWorkingAccountAvailableFunds', 'Value': 100000.00},
+            ]})
+    sim.callback(data.get('ResultURL'), {'Result': result})
+    return 200, {'ConversationID': conversation_id, 'OriginatorConversationID': originator_id,
+                 'ResponseCode': '0', 'ResponseDescription': 'Accept the service request successfully.'}
+
+
+# ---- MTN MoMo ----
+
+def momo_api_user(sim, match, request):
+    return 201, {}
+
+
+def momo_api_key(sim, match, request):
+    return 201, {'apiKey': uuid.uuid4().hex}
+
+
+def momo_token(sim, match, request):
+    return 200, {'access_token': uuid.uuid4().hex, 'token_type': 'access_token', 'expires_in': 3600}
+
+
+def momo_balance(sim, match, request):
+    return 200, {'availableBalance': '100000', 'currency': 'USD'}
+
+
+def _momo_result(sim, request, party_key):
+    data = request['json']
+    failed = sim.declined()
+    return {
+        'financialTransactionId': '' if failed else str(random.randrange(10 ** 9, 10 ** 10)),
+        'externalId': data.get('externalId', ''),
+        'amount': data.get('amount'),
+        'currency': data.get('currency', ''),
+        party_key: data.get(party_key, {}),
+        'payerMessage': data.get('payerMessage', ''),
+        'payeeNote': data.get('payeeNote', ''),
+        'status': 'FAILED' if failed else 'SUCCESSFUL',
+        **({'reason': 'APPROVAL_REJECTED'} if failed else {}),
+    }
+
+
+def momo_request_to_pay(sim, match, request):
+    ref = request['headers'].get('X-Reference-Id') or str(uuid.uuid4())
+    result = _momo_result(sim, request, 'payer')
+    sim.results[ref] = result
+    sim.callback(request['headers'].get('X-Callback-Url'), result)
+    return 202, {}
+
+
+def momo_transfer(sim, match, request):
+    ref = request['headers'].get('X-Reference-Id') or str(uuid.uuid4())
+    result = _momo_result(sim, request, 'payee')
+    sim.results[ref] = result
+    # Our disbursement callback view takes the envelope getTransactionStatus returns
+    sim.callback(request['headers'].get('X-Callback-Url'), {'response': 200, 'ref': ref, 'data': result})
+    return 202, {}
+
+
+def momo_status(sim, match, request):
+    result = sim.results.get(match['ref'])
+    if result is None:
+        return 404, {'code': 'RESOURCE_NOT_FOUND', 'message': 'Requested resource was not found.'}
+    return 200, result
+
+
+# ---- PayHero ----
+
+def payhero_payment(sim, match, request):
+    data = request['json']
+    reference, checkout_id = str(uuid.uuid4()), f'ws_CO_sim_{uuid.uuid4().hex[:16]}'
+    failed = sim.declined()
+    result = {
+        'Amount': data.get('amount'), 'CheckoutRequestID': checkout_id,
+        'ExternalReference': data.get('external_reference', ''), 'MerchantRequestID': f'sim-{uuid.uuid4().hex[:12]}',
+        'MpesaReceiptNumber': '' if failed else _receipt(), 'Phone': data.get('phone_number'),
+        'ResultCode': 1032 if failed else 0,
+        'ResultDesc': 'Request cancelled by user' if failed else 'The service request is processed successfully.',
+        'Status': 'Failed' if failed else 'Success',
+    }
+    sim.results[reference] = result
+    sim.callback(data.get('callback_url'), {'forward_url': '', 'response': result, 'status': not failed})
+    return 201, {'success': True, 'status': 'QUEUED', 'reference': reference, 'CheckoutRequestID': checkout_id}
+
+
+def payhero_status(sim, match, request):
+    reference = (request['query'].get('reference') or [''])[0]
+    result = sim.results.get(reference)
+    if result is None:
+        return 404, {'error_message': 'transaction not found'}
+    return 200, {'reference': reference, 'status': 'SUCCESS' if result['ResultCode'] == 0 else 'FAILED',
+                 'provider_reference': result['MpesaReceiptNumber'], 'amount': result['Amount']}
+
+
+def payhero_transactions(sim, match, request):
+    page = int((request['query'].get('page') or ['1'])[0])
+    per = int((request['query'].get('per') or ['20'])[0])
+    rows = [
+        {'reference': reference, 'amount': result['Amount'], 'phone': result['Phone'],
+         'status': 'SUCCESS' if result['ResultCode'] == 0 else 'FAILED',
+         'provider_reference': result['MpesaReceiptNumber']}
+        for reference, result in list(sim.results.items()) if 'ExternalReference' in result
+    ]
+    return 200, {'pagination': {'page': page, 'per': per, 'count': len(rows)},
+                 'transactions': rows[(page - 1) * per:page * per]}
+
+
+def payhero_balance(sim, match, request):
+    return 200, {'available_balance': 100000, 'balance': 100000, 'currency': 'KES'}
+
+
+def payhero_queued(sim, match, request):
+    return 201, {'success': True, 'status': 'QUEUED', 'merchant_reference': str(uuid.uuid4())}
+
+
+# ---- Paystack / Stripe ----
+
+def paystack_verify(sim, match, request):
+    ref = match['ref']
+    failed = sim.declined()
+    return 200, {'status': True, 'message': 'Verification successful', 'data': {
+        'id': random.randrange(10 ** 9, 10 ** 10), 'reference': ref, 'amount': 10000, 'currency': 'NGN',
+        'status': 'failed' if failed else 'success', 'gateway_response': 'Declined' if failed else 'Successful',
+        'paid_at': None if failed else datetime.utcnow().isoformat() + 'Z', 'channel': 'card',
+    }}
+
+
+def stripe_checkout_session(sim, match, request):
+    session_id = f'cs_test_sim_{uuid.uuid4().hex}'
+    return 200, {'id': session_id, 'object': 'checkout.session', 'mode': 'payment', 'status': 'open',
+                 'url': f'https://checkout.stripe.com/c/pay/{session_id}'}
+
+
+class _SimulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real gateways
+    disable_nagle_algorithm = True
+    simulator = None
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode() if length else ''
+        status, payload = self.simulator.handle(self.command, self.path, self.headers, body)
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    do_GET = do_POST = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(simulator, host='127.0.0.1', port=0):
+    """ThreadingHTTPServer serving simulator; port 0 picks a free port (server.server_address[1])."""
+    handler = type('SimulatorHandler', (_SimulatorHandler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
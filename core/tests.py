@@ -0,0 +1,242 @@
+import json
+import queue
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mpesa.models import MpesaTransaction
+from mpesa.services.callback import CallbackService
+from mtnmo.disbursement_views import apply_disbursement_callback
+from mtnmo.models import DisbursementCallback
+from . import idempotency, inbox, metrics, tracing
+from .models import CallbackInbox, ProcessedCallback
+from .simulator import ProviderSimulator, SimulatorConfig, make_server
+from .transport import TransportSettings, close_all, get_session
+
+
+class TransportTests(SimpleTestCase):
+    def tearDown(self):
+        close_all()
+
+    def test_one_session_per_host(self):
+        first = get_session("https://api.safaricom.co.ke/oauth/v1/generate")
+        second = get_session("https://API.safaricom.co.ke/mpesa/stkpush/v1/processrequest")
+        other = get_session("https://proxy.momoapi.mtn.com/collection/token/")
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+
+    @override_settings(HTTP_POOL_MAXSIZE=7, HTTP_CONNECT_TIMEOUT=2, HTTP_READ_TIMEOUT=9)
+    def test_settings_applied_to_pool_and_timeouts(self):
+        session = get_session("https://backend.payhero.co.ke")
+        adapter = session.get_adapter("https://backend.payhero.co.ke/api/v2/payments")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(session.default_timeout, (2.0, 9.0))
+
+    def test_retry_policy_never_replays_post(self):
+        retry = TransportSettings().retry_policy()
+        self.assertNotIn("POST", retry.allowed_methods)
+        self.assertIn("GET", retry.allowed_methods)
+
+
+class CallbackInboxTests(TestCase):
+    def _stk_callback(self, checkout_request_id):
+        return self.client.post('/mpesa/stk-callback/', json.dumps({'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1', 'CheckoutRequestID': checkout_request_id, 'ResultCode': 0,
+            'ResultDesc': 'The service request is processed successfully.',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'}]},
+        }}}), content_type='application/json')
+
+    def test_webhook_is_stored_then_applied_by_consumer(self):
+        txn = MpesaTransaction.objects.create(merchant_request_id='mr-1', checkout_request_id='ws-1',
+                                              result_desc='Payment request initiated', amount=10)
+
+        with self.assertNumQueries(1):
+            response = self._stk_callback('ws-1')
+        self.assertEqual(response.json()['ResultCode'], 0)
+        txn.refresh_from_db()
+        self.assertIsNone(txn.result_code)
+        self.assertEqual(inbox.stats()['depth'], 1)
+
+        self.assertEqual(inbox.CallbackInboxConsumer().run_once(), 1)
+        txn.refresh_from_db()
+        self.assertEqual((txn.result_code, txn.mpesa_receipt_number), (0, 'NLJ7RT61SV'))
+        self.assertEqual(CallbackInbox.objects.get().status, CallbackInbox.DONE)
+        self.assertEqual(inbox.stats(), {'depth': 0, 'lag_seconds': 0.0, 'failed': 0})
+
+    def test_unmatched_callback_is_retried_then_dead_lettered(self):
+        self._stk_callback('ws-unknown')
+        consumer = inbox.CallbackInboxConsumer(max_attempts=2, base_delay=0)
+
+        consumer.run_once()
+        row = CallbackInbox.objects.get()
+        self.assertEqual((row.status, row.attempts, row.last_error), (CallbackInbox.PENDING, 1, 'Transaction not found'))
+
+        consumer.run_once()
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts), (CallbackInbox.FAILED, 2))
+        self.assertEqual(inbox.stats()['failed'], 1)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        idempotency.recent.clear()
+        self.addCleanup(idempotency.recent.clear)  # test rollbacks do not undo the per-process cache
+
+    def _stk(self, checkout_request_id='ws-1'):
+        return CallbackService().handle_stk_callback({'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1', 'CheckoutRequestID': checkout_request_id, 'ResultCode': 0,
+            'ResultDesc': 'The service request is processed successfully.',
+        }}})
+
+    @mock.patch.object(CallbackService, '_handle_successful_subscription_payment')
+    def test_stk_replay_is_rejected_without_touching_transactions(self, activate):
+        MpesaTransaction.objects.create(merchant_request_id='mr-1', checkout_request_id='ws-1',
+                                        result_desc='Payment request initiated', amount=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self._stk()['status'], 'success')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._stk()['status'], 'duplicate')
+        self.assertFalse([q for q in queries if 'SAVEPOINT' not in q['sql']])
+        idempotency.recent.clear()
+        self.assertEqual(self._stk()['status'], 'duplicate')  # unique constraint catches it after a restart
+        activate.assert_called_once()
+
+    def test_failed_delivery_does_not_consume_the_key(self):
+        self.assertEqual(self._stk('ws-late')['message'], 'Transaction not found')
+        self.assertFalse(ProcessedCallback.objects.exists())
+
+    def test_disbursement_callback_stored_once(self):
+        payload = {'ref': 'ref-1', 'data': {'financialTransactionId': 'ft-1', 'externalId': 'ext-1',
+                                            'amount': '5', 'currency': 'EUR', 'status': 'SUCCESSFUL'}}
+        self.assertEqual(apply_disbursement_callback(payload), {'status': 'success'})
+        self.assertEqual(apply_disbursement_callback(payload), {'status': 'ignored'})
+        self.assertEqual(DisbursementCallback.objects.count(), 1)
+
+
+class ProviderSimulatorTests(TestCase):
+    def setUp(self):
+        self.addCleanup(idempotency.recent.clear)
+        self.delivered = queue.Queue()
+        self.simulator = ProviderSimulator(SimulatorConfig(callback_delay_ms=0),
+                                           deliver=lambda url, payload: self.delivered.put((url, payload)))
+        self.addCleanup(self.simulator.shutdown)
+
+    @mock.patch.object(CallbackService, '_handle_successful_subscription_payment')
+    def test_stk_push_callback_is_applied_by_our_handler(self, activate):
+        server = make_server(self.simulator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+
+        response = get_session(base).post(f'{base}/mpesa/stkpush/v1/processrequest', json={
+            'Amount': 10, 'PhoneNumber': '254700000001', 'CallBackURL': 'https://app.test/mpesa/stk-callback/',
+        })
+        self.assertEqual(response.json()['ResponseCode'], '0')
+        MpesaTransaction.objects.create(merchant_request_id=response.json()['MerchantRequestID'],
+                                        checkout_request_id=response.json()['CheckoutRequestID'],
+                                        result_desc='Payment request initiated', amount=10)
+
+        url, payload = self.delivered.get(timeout=5)
+        self.assertEqual(url, 'https://app.test/mpesa/stk-callback/')
+        self.assertEqual(CallbackService().handle_stk_callback(payload)['status'], 'success')
+        txn = MpesaTransaction.objects.get()
+        self.assertEqual(txn.result_code, 0)
+        self.assertEqual(len(txn.mpesa_receipt_number), 10)
+
+    def test_error_injection_and_momo_status(self):
+        self.simulator.config.callback_base = 'http://127.0.0.1:8000'
+        headers = {'X-Reference-Id': 'ref-1', 'X-Callback-Url': 'https://app.test/mtnmo/disbursement/callback/'}
+        body = json.dumps({'amount': '5', 'currency': 'EUR', 'externalId': 'ext-1', 'payee': {'partyId': '231'}})
+        self.assertEqual(self.simulator.handle('POST', '/disbursement/v1_0/transfer', headers, body)[0], 202)
+        url, payload = self.delivered.get(timeout=5)
+        self.assertEqual(url, 'http://127.0.0.1:8000/mtnmo/disbursement/callback/')
+        self.assertEqual(apply_disbursement_callback(payload), {'status': 'success'})
+        status, result = self.simulator.handle('GET', '/disbursement/v1_0/transfer/ref-1', {}, '')
+        self.assertEqual((status, result['status']), (200, 'SUCCESSFUL'))
+
+        self.simulator.config.error_rate = 1.0
+        self.assertEqual(self.simulator.handle('GET', '/oauth/v1/generate', {}, '')[0], 503)
+        self.assertEqual(self.simulator.handle('GET', '/nope', {}, '')[0], 404)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_server_timing_and_prometheus_series_per_route(self):
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        response = self.client.get('/mtnmo/collection/callbacks/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn('serialize;dur=', timing)
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{method="GET",endpoint="/mtnmo/collection/callbacks/",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",endpoint="/mtnmo/collection/callbacks/"} 1',
+                      body)
+
+    def test_upstream_calls_grouped_by_provider_and_endpoint(self):
+        token = metrics.begin()
+        metrics.record_upstream('https://proxy.momoapi.mtn.com/collection/v1_0/requesttopay/'
+                                '0b9c8f3e-6c1d-4c53-9d0e-2f1a7f0e9b11', 0.25)
+        timings = metrics.end(token)
+        self.assertIn('mtnmo-collection-v1_0-requesttopay-id;dur=250.0;desc="1 call(s)"', timings.server_timing(0.3))
+        self.assertIn('upstream_requests_total{provider="mtnmo",endpoint="/collection/v1_0/requesttopay/{id}"} 1',
+                      metrics.registry.render())
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+
+    def test_metrics_without_token_is_staff_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.client.logout()
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class TracingSamplerTests(SimpleTestCase):
+    def _sampler(self, mode):
+        return tracing.Sampler(tracing.TracingSettings(mode=mode, payment_rate=0.5, callback_rate=0.25, read_rate=0.0))
+
+    def test_tail_mode_is_the_default(self):
+        self.assertEqual(tracing.TracingSettings().mode, tracing.TAIL)
+
+    def test_head_mode_samples_by_endpoint_kind(self):
+        sampler = self._sampler(tracing.HEAD)
+
+        def rate(method, path, **context):
+            return sampler.traces_sampler({'wsgi_environ': {'REQUEST_METHOD': method, 'PATH_INFO': path}, **context})
+
+        self.assertEqual(rate('POST', '/mpesa/stk-push/'), 0.5)
+        self.assertEqual(rate('POST', '/mtnmo/collection/callback/'), 0.25)
+        self.assertEqual(rate('GET', '/mtnmo/collection/callbacks/'), 0.0)
+        self.assertEqual(rate('GET', '/metrics'), 0.0)
+        self.assertEqual(rate('GET', '/mpesa/transactions/', parent_sampled=True), 1.0)
+        self.assertEqual(sampler.traces_sampler({'asgi_scope': {'type': 'http', 'method': 'POST',
+                                                                'path': '/mpesa/async/send-money/'}}), 0.5)
+
+    def test_tail_mode_keeps_failures_and_drops_unsampled_successes(self):
+        sampler = self._sampler(tracing.TAIL)
+        self.assertEqual(sampler.traces_sampler({'wsgi_environ': {'PATH_INFO': '/mpesa/transactions/'}}), 1.0)
+
+        def event(method, path, status):
+            return {'request': {'url': f'https://pay.test{path}', 'method': method},
+                    'contexts': {'trace': {'status': status}}}
+
+        self.assertIsNone(sampler.before_send_transaction(event('GET', '/mpesa/transactions/', 'ok'), {}))
+        self.assertIsNone(sampler.before_send_transaction(event('GET', '/mpesa/transactions/', 'not_found'), {}))
+        self.assertIsNotNone(sampler.before_send_transaction(event('GET', '/mpesa/transactions/', 'internal_error'), {}))
+        self.assertIsNotNone(sampler.before_send_transaction(event('POST', '/mpesa/stk-callback/', 'invalid_argument'), {}))
@@ -0,0 +1,148 @@
+"""
+Sentry tracing configuration
+
+Errors are always reported. Performance traces are sampled per kind of
+endpoint instead of at 100%:
+
+    payment    initiation endpoints (stk-push, send-money, collect, disburse...)
+    callback   provider webhooks
+    read       GETs and anything else
+    ignored    /metrics, static files and health probes: never traced
+
+SENTRY_TRACES_MODE picks how:
+
+    tail   (default) record every request, then keep it in
+           before_send_transaction if it failed (5xx, or any non-ok callback)
+           or wins its endpoint rate. Costs span bookkeeping on every
+           request, but no failure is missed.
+    head   decide when the request starts (traces_sampler), before the
+           outcome is known: failures are kept only at their endpoint rate.
+           Unsampled requests record no spans at all, so this is the
+           cheapest mode, for when that overhead matters more than
+           tracing every failure.
+    off    no performance tracing.
+
+Profiling (SENTRY_PROFILES_SAMPLE_RATE) applies to sampled transactions only
+and defaults to off. `manage.py bench_tracing` measures what each mode costs.
+"""
+import random
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+from decouple import config
+
+OFF, HEAD, TAIL = 'off', 'head', 'tail'
+PAYMENT, CALLBACK, READ, IGNORED = 'payment', 'callback', 'read', 'ignored'
+
+DEFAULT_DSN = 'https://8e541baa3a303916a24b83648af7478b@o4507199206129664.ingest.us.sentry.io/4507208649080832'
+
+CALLBACK_MARKERS = ('callback', 'b2c-result', 'b2c-timeout', 'webhook')
+PAYMENT_MARKERS = ('stk-push', 'send-money', 'collect', 'disburse', 'b2c/batches', 'payments', 'withdraw',
+                   'checkout')
+IGNORED_PREFIXES = ('/metrics', '/static/', '/favicon.ico', '/health')
+
+# Trace statuses Sentry derives from 4xx responses: the client's fault, not ours
+CLIENT_ERROR_STATUSES = {'invalid_argument', 'unauthenticated', 'permission_denied', 'not_found',
+                         'already_exists', 'failed_precondition', 'resource_exhausted', 'cancelled'}
+
+
+@dataclass(frozen=True)
+class TracingSettings:
+    dsn: str = DEFAULT_DSN
+    environment: str = 'production'
+    mode: str = TAIL
+    payment_rate: float = 0.2
+    callback_rate: float = 0.1
+    read_rate: float = 0.01
+    profiles_rate: float = 0.0
+
+    @staticmethod
+    def load() -> "TracingSettings":
+        defaults = TracingSettings()
+        return TracingSettings(
+            dsn=config('SENTRY_DSN', default=defaults.dsn),
+            environment=config('SENTRY_ENVIRONMENT', default=defaults.environment),
+            mode=config('SENTRY_TRACES_MODE', default=defaults.mode),
+            payment_rate=config('SENTRY_TRACES_RATE_PAYMENTS', default=defaults.payment_rate, cast=float),
+            callback_rate=config('SENTRY_TRACES_RATE_CALLBACKS', default=defaults.callback_rate, cast=float),
+            read_rate=config('SENTRY_TRACES_RATE_READS', default=defaults.read_rate, cast=float),
+            profiles_rate=config('SENTRY_PROFILES_SAMPLE_RATE', default=defaults.profiles_rate, cast=float),
+        )
+
+    def rate(self, kind):
+        return {PAYMENT: self.payment_rate, CALLBACK: self.callback_rate, READ: self.read_rate}.get(kind, 0.0)
+
+
+def classify(path, method='GET'):
+    """Endpoint kind of a request path."""
+    path = path or '/'
+    if path.startswith(IGNORED_PREFIXES):
+        return IGNORED
+    if method == 'GET':
+        return READ
+    if any(marker in path for marker in CALLBACK_MARKERS):
+        return CALLBACK
+    if any(marker in path for marker in PAYMENT_MARKERS):
+        return PAYMENT
+    return READ
+
+
+def _request_of(sampling_context):
+    """(path, method) of the HTTP request a transaction is starting for, if any."""
+    environ = sampling_context.get('wsgi_environ')
+    if environ:
+        return environ.get('PATH_INFO', '/'), environ.get('REQUEST_METHOD', 'GET')
+    scope = sampling_context.get('asgi_scope')
+    if scope and scope.get('type') == 'http':
+        return scope.get('path', '/'), scope.get('method', 'GET')
+    return None, None
+
+
+class Sampler:
+    """traces_sampler and before_send_transaction for the configured mode."""
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def traces_sampler(self, sampling_context):
+        if sampling_context.get('parent_sampled') is not None:
+            # Keep distributed traces whole
+            return float(sampling_context['parent_sampled'])
+        path, method = _request_of(sampling_context)
+        kind = classify(path, method) if path is not None else READ
+        if kind == IGNORED:
+            return 0.0
+        if self.settings.mode == TAIL:
+            return 1.0
+        return self.settings.rate(kind)
+
+    def before_send_transaction(self, event, hint):
+        if self.settings.mode != TAIL:
+            return event
+        url = (event.get('request') or {}).get('url') or ''
+        kind = classify(urlsplit(url).path, (event.get('request') or {}).get('method', 'GET'))
+        status = ((event.get('contexts') or {}).get('trace') or {}).get('status') or 'ok'
+        if status != 'ok' and (kind == CALLBACK or status not in CLIENT_ERROR_STATUSES):
+            return event
+        return event if random.random() < self.settings.rate(kind) else None
+
+
+def sentry_options(settings=None, **overrides):
+    """Keyword arguments for sentry_sdk.init."""
+    settings = settings or TracingSettings.load()
+    options = {'dsn': settings.dsn, 'environment': settings.environment}
+    if settings.mode != OFF:
+        sampler = Sampler(settings)
+        options.update(
+            traces_sampler=sampler.traces_sampler,
+            before_send_transaction=sampler.before_send_transaction,
+            profiles_sample_rate=settings.profiles_rate,
+        )
+    options.update(overrides)
+    return options
+
+
+def init_sentry(settings=None, **overrides):
+    import sentry_sdk
+
+    sentry_sdk.init(**sentry_options(settings, **overrides))
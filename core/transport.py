@@ -0,0 +1,128 @@
+"""
+Shared HTTP transport
+Pooled, keep-alive requests sessions used by every provider client
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+
+@dataclass(frozen=True)
+class TransportSettings:
+    pool_connections: int = 10
+    pool_maxsize: int = 50
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    max_retries: int = 2
+    backoff_factor: float = 0.3
+    status_forcelist: tuple = (429, 502, 503, 504)
+
+    @staticmethod
+    def load() -> "TransportSettings":
+        # Prefer Django settings, fallback to environment
+        def _value(name, cast, default):
+            raw = getattr(settings, name, None)
+            if raw is None:
+                raw = os.getenv(name)
+            if raw in (None, ""):
+                return default
+            return cast(raw)
+
+        defaults = TransportSettings()
+        return TransportSettings(
+            pool_connections=_value("HTTP_POOL_CONNECTIONS", int, defaults.pool_connections),
+            pool_maxsize=_value("HTTP_POOL_MAXSIZE", int, defaults.pool_maxsize),
+            connect_timeout=_value("HTTP_CONNECT_TIMEOUT", float, defaults.connect_timeout),
+            read_timeout=_value("HTTP_READ_TIMEOUT", float, defaults.read_timeout),
+            max_retries=_value("HTTP_MAX_RETRIES", int, defaults.max_retries),
+            backoff_factor=_value("HTTP_RETRY_BACKOFF", float, defaults.backoff_factor),
+        )
+
+    @property
+    def timeout(self) -> tuple:
+        return (self.connect_timeout, self.read_timeout)
+
+    def retry_policy(self) -> Retry:
+        """Retry connection failures for every method, but only replay idempotent requests.
+
+        urllib3 never retries read errors or retryable statuses for methods outside
+        ``allowed_methods``, so a POST that reached the provider (STK push, B2C,
+        transfer) is never sent twice.
+        """
+        return Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+
+
+class PooledSession(requests.Session):
+    """requests.Session that applies the transport's default (connect, read) timeout."""
+
+    def __init__(self, transport_settings: TransportSettings):
+        super().__init__()
+        self.default_timeout = transport_settings.timeout
+        adapter = HTTPAdapter(
+            pool_connections=transport_settings.pool_connections,
+            pool_maxsize=transport_settings.pool_maxsize,
+            max_retries=transport_settings.retry_policy(),
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            metrics.record_upstream(url, time.perf_counter() - start)
+
+
+_sessions: dict = {}
+_sessions_lock = threading.Lock()
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_session(url: str) -> PooledSession:
+    """Return the process-wide pooled session for the host of ``url``.
+
+    One session (and therefore one connection pool) is kept per scheme+host, so
+    connections to Safaricom, MTN, PayHero and Paystack are reused across requests.
+    """
+    key = _host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = PooledSession(TransportSettings.load())
+                _sessions[key] = session
+    return session
+
+
+def close_all() -> None:
+    """Close every pooled session (tests, benchmarks, worker shutdown)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
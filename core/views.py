@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from . import metrics
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint for this worker's request and upstream metrics.
+
+    Scrapers authenticate with METRICS_TOKEN. Without one, only staff sessions
+    may read it (anyone, under DEBUG).
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not (settings.DEBUG or request.user.is_staff):
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
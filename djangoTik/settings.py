@@ -42,13 +42,16 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'corsheaders',
     'rest_framework',
+    'core',
     'mpesa',
     'mtnmo',
+    'reporting',
     # 'paystack',
     # 'stripe_pay',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -130,10 +133,65 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
-db_from_env = dj_database_url.config(conn_max_age=600)
+# Persistent connections stay off by default: the web process runs under ASGI
+# (Procfile), where sync views run in a thread pool and each thread would hold
+# its own long-lived connection. Worker processes may set CONN_MAX_AGE.
+db_from_env = dj_database_url.config(conn_max_age=config('CONN_MAX_AGE', default=0, cast=int))
 DATABASES['default'].update(db_from_env)
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Shared state such as M-Pesa OAuth tokens lives here. Set REDIS_URL (requires
+# the `redis` package) so all gunicorn workers share one cache; otherwise each
+# worker falls back to its own local-memory cache.
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Outbound HTTP transport (core/transport.py)
+# Per-host pooled keep-alive sessions shared by every provider client
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=10, cast=int)
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=50, cast=int)
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5.0, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=30.0, cast=float)
+HTTP_MAX_RETRIES = config('HTTP_MAX_RETRIES', default=2, cast=int)
+HTTP_RETRY_BACKOFF = config('HTTP_RETRY_BACKOFF', default=0.3, cast=float)
+
+
+# Provider webhooks are stored in core.CallbackInbox and applied by
+# `manage.py drain_callback_inbox`; set to False to apply them inline again
+CALLBACK_INBOX_ENABLED = config('CALLBACK_INBOX_ENABLED', default=True, cast=bool)
+# Provider ids remembered per process in front of core.ProcessedCallback
+IDEMPOTENCY_CACHE_SIZE = config('IDEMPOTENCY_CACHE_SIZE', default=50000, cast=int)
+
+# Request instrumentation (core/metrics.py): Server-Timing headers and /metrics.
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics; without
+# it /metrics is served to staff sessions only (or to anyone when DEBUG is on).
+REQUEST_METRICS_ENABLED = config('REQUEST_METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+REST_FRAMEWORK = {
+    # Same as DRF's defaults, with the JSON renderer timed for Server-Timing
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -180,15 +238,7 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Sentry
-import sentry_sdk
-
-sentry_sdk.init(
-    dsn="https://8e541baa3a303916a24b83648af7478b@o4507199206129664.ingest.us.sentry.io/4507208649080832",
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
\ No newline at end of file
+# Errors are always reported; traces are sampled per endpoint kind (see core/tracing.py)
+from core.tracing import init_sentry
+
+init_sentry()
\ No newline at end of file
@@ -17,6 +17,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import TemplateView
 
+from core.views import metrics_view
+
 def trigger_error(request):
     division_by_zero = 1 / 0
 
@@ -26,9 +28,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('mpesa/', include('mpesa.urls')),
     path('mtnmo/', include('mtnmo.urls')),
+    path('reporting/', include('reporting.urls')),
     # path('paystack/', include('paystack.urls')),
     # path('stripe-pay/', include('stripe_pay.urls')),
     path('sentry-debug/', trigger_error),
+    path('metrics', metrics_view, name='metrics'),
 
     path('<path:path>', TemplateView.as_view(template_name='404.html'), name='catch_all_404'),
 ]
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class MpesaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mpesa'
+
+    def ready(self):
+        from core import inbox
+        from .services.callback import B2C_RESULT, B2C_TIMEOUT, STK_CALLBACK, CallbackService
+
+        service = CallbackService()
+        inbox.register(STK_CALLBACK, service.handle_stk_callback, service.apply_stk_callbacks)
+        inbox.register(B2C_RESULT, service.handle_b2c_result, service.apply_b2c_results)
+        inbox.register(B2C_TIMEOUT, service.handle_b2c_timeout)
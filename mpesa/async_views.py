@@ -0,0 +1,99 @@
+"""
+M-Pesa async views
+ASGI counterparts of the initiation endpoints; the worker is not held while
+Safaricom responds
+"""
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+
+from core.async_views import async_api_view
+from .services.stk_push import STKPushService
+from .services.b2c_transfer import B2CTransferService
+
+
+@async_api_view(['POST'], permission_classes=[IsAuthenticated])
+async def stk_push_payment(request):
+    """Async STK Push initiation; same request and response format as stk_push_payment"""
+    try:
+        phone = request.data.get('phone')
+        amount = request.data.get('amount')
+        if not phone or not amount:
+            return Response({
+                'error': 'Phone number and amount are required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        result = await STKPushService().ainitiate_payment(
+            phone=phone,
+            amount=amount,
+            payment_type=request.data.get('payment_type', 'product'),
+            product_id=request.data.get('product_id'),
+            subscription_plan_id=request.data.get('subscription_plan_id'),
+            account_reference=request.data.get('account_reference', f'SKYFIELD-{request.user.id}'),
+            transaction_desc=request.data.get('transaction_desc', 'Payment for Skyfield services'),
+            user_id=request.user.id
+        )
+
+        if result.get('ResponseCode') == '0':
+            return Response({
+                'success': True,
+                'message': 'Payment request sent successfully',
+                'data': {
+                    'checkout_request_id': result.get('CheckoutRequestID'),
+                    'merchant_request_id': result.get('MerchantRequestID'),
+                    'customer_message': result.get('CustomerMessage')
+                }
+            }, status=status.HTTP_200_OK)
+        return Response({
+            'error': result.get('ResponseDescription', 'Payment initiation failed')
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': f'Payment initiation failed: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['POST'], permission_classes=[IsAuthenticated])
+async def send_money(request):
+    """Async B2C transfer; same request and response format as send_money"""
+    try:
+        phone = request.data.get('phone')
+        amount = request.data.get('amount')
+        if not phone or not amount:
+            return Response({
+                'error': 'Phone number and amount are required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        result = await B2CTransferService().asend_money(
+            phone=phone,
+            amount=amount,
+            occasion=request.data.get('occasion', 'Money transfer'),
+            remarks=request.data.get('remarks', 'Payment from Skyfield'),
+            command_id=request.data.get('command_id', 'BusinessPayment'),
+            user_id=request.user.id,
+            reference=request.data.get('reference')
+        )
+
+        if result.get('ResponseCode') == '0':
+            return Response({
+                'success': True,
+                'message': 'Money transfer initiated successfully',
+                'data': {
+                    'conversation_id': result.get('ConversationID'),
+                    'originator_conversation_id': result.get('OriginatorConversationID'),
+                    'transaction_id': result.get('transaction_id')
+                }
+            }, status=status.HTTP_200_OK)
+        return Response({
+            'error': result.get('ResponseDescription', 'Money transfer failed')
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': f'Money transfer failed: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mpesa.services.referrals import apply_pending_awards
+
+
+class Command(BaseCommand):
+    help = 'Apply referral points queued with REFERRAL_POINTS_MODE=deferred'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep when nothing is queued')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['daemon']:
+            applied = apply_pending_awards(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Applied {applied} point award(s)'))
+            return
+
+        self.stdout.write('Applying queued point awards (Ctrl+C to stop)...')
+        try:
+            while True:
+                if apply_pending_awards(options['batch_size']) < options['batch_size']:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mpesa.services.bulk_b2c import VALID_COMMANDS, BulkB2CPayout, load_rows, validate_rows
+
+
+class Command(BaseCommand):
+    help = 'Send B2C transfers for every (phone, amount, reference) row in a CSV or JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='CSV with a phone,amount,reference header, or a JSON list of objects')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Defaults to the file extension')
+        parser.add_argument('--command-id', default='BusinessPayment', choices=VALID_COMMANDS)
+        parser.add_argument('--occasion', default='Bulk payout')
+        parser.add_argument('--remarks', default='Bulk payout')
+        parser.add_argument('--name', default='')
+        parser.add_argument('--workers', type=int, help='Concurrent requests (MPESA_B2C_BULK_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Max requests per second (MPESA_B2C_BULK_RATE)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without sending anything')
+
+    def handle(self, *args, **options):
+        path = options['file']
+        fmt = options['format'] or ('json' if path.lower().endswith('.json') else 'csv')
+        try:
+            with open(path, 'rb') as f:
+                rows = load_rows(f.read(), fmt)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+
+        if options['dry_run']:
+            valid, errors = validate_rows(rows)
+            for error in errors:
+                self.stderr.write(f"Row {error['row']}: {error['error']}")
+            total = sum(r.amount for r in valid)
+            self.stdout.write(self.style.SUCCESS(f'{len(valid)} valid row(s), {len(errors)} invalid, KES {total}'))
+            return
+
+        payout = BulkB2CPayout(workers=options['workers'], rate=options['rate'])
+        batch, valid = payout.create_batch(
+            rows,
+            command_id=options['command_id'],
+            occasion=options['occasion'],
+            remarks=options['remarks'],
+            name=options['name'],
+            claimed=True,
+        )
+        self.stdout.write(f'Batch {batch.pk}: sending {len(valid)} transfer(s), {batch.failed_count} invalid row(s)')
+        batch = payout.run(batch)
+
+        for error in batch.row_errors():
+            self.stderr.write(f"Row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Batch {batch.pk} {batch.status}: {batch.accepted_count} accepted, {batch.failed_count} failed, '
+            f'{batch.in_doubt_count} in doubt'
+        ))
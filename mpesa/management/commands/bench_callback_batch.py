@@ -0,0 +1,82 @@
+"""
+Benchmark: per-row vs batched STK callback application
+
+Seeds 2 x --callbacks pending STK rows, applies one half through
+handle_stk_callback (one get + one save per delivery) and the other half
+through apply_stk_callbacks in --batch-size chunks, and prints wall time,
+throughput and database round-trips for each.
+
+    python manage.py bench_callback_batch --callbacks 5000 --batch-size 200
+
+Rows are tagged with a "bench-" prefix and removed afterwards.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import idempotency
+from core.models import ProcessedCallback
+from mpesa.models import MpesaTransaction
+from mpesa.services.callback import STK_CALLBACK, CallbackService
+from reporting.models import LedgerEntry
+
+PREFIX = 'bench-'
+
+
+def _payload(i):
+    # ResultCode 1032 (cancelled by user) keeps subscription side effects out of the measurement
+    return {'Body': {'stkCallback': {
+        'MerchantRequestID': f'{PREFIX}mr-{i}', 'CheckoutRequestID': f'{PREFIX}ws-{i}',
+        'ResultCode': 1032, 'ResultDesc': 'Request cancelled by user',
+    }}}
+
+
+class Command(BaseCommand):
+    help = 'Compare per-row and batched STK callback application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--callbacks', type=int, default=2000, help='Callbacks applied by each strategy')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        count, size = options['callbacks'], options['batch_size']
+        service = CallbackService()
+        try:
+            with transaction.atomic():
+                MpesaTransaction.objects.bulk_create([
+                    MpesaTransaction(merchant_request_id=f'{PREFIX}mr-{i}', checkout_request_id=f'{PREFIX}ws-{i}',
+                                     result_desc='Payment request initiated', amount=10, user_id=i % 20)
+                    for i in range(2 * count)
+                ], batch_size=5000)
+
+            def per_row():
+                for i in range(count):
+                    service.handle_stk_callback(_payload(i))
+
+            def batched():
+                for start in range(count, 2 * count, size):
+                    with transaction.atomic():
+                        service.apply_stk_callbacks([_payload(i) for i in range(start, min(start + size, 2 * count))])
+
+            self.stdout.write(f"{'strategy':<12}{'total ms':>12}{'per cb ms':>12}{'cb/s':>10}{'queries':>10}")
+            for name, run in (('per-row', per_row), (f'batch {size}', batched)):
+                queries = [0]
+
+                def count_query(execute, sql, params, many, context):
+                    queries[0] += 1
+                    return execute(sql, params, many, context)
+
+                with connection.execute_wrapper(count_query):
+                    start = time.perf_counter()
+                    run()
+                    elapsed = (time.perf_counter() - start) * 1000
+                self.stdout.write(
+                    f"{name:<12}{elapsed:>12.1f}{elapsed / count:>12.3f}{count / (elapsed / 1000):>10.0f}"
+                    f"{queries[0]:>10}"
+                )
+        finally:
+            MpesaTransaction.objects.filter(checkout_request_id__startswith=PREFIX).delete()
+            ProcessedCallback.objects.filter(scope=STK_CALLBACK, key__startswith=PREFIX).delete()
+            LedgerEntry.objects.filter(reference__startswith=PREFIX).purge()
+            idempotency.recent.clear()
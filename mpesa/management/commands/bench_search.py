@@ -0,0 +1,105 @@
+"""
+Benchmark: transaction search latency on large tables
+
+Seeds --rows synthetic STK and B2C rows, then times each query type through
+TransactionSearchService and prints p50/p95/p99 plus the query plan, which
+should name an index for every type (trigram GIN for text on Postgres).
+
+    python manage.py bench_search --rows 2000000
+
+Rows are tagged with a "bench-" prefix and removed afterwards unless --keep.
+Run it against a scratch database.
+"""
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.benchmarks import percentile, timed_ms
+from mpesa.models import MpesaTransaction, MpesaB2CTransaction
+from mpesa.services.search import TransactionSearchService, classify
+
+PREFIX = 'bench-'
+
+
+def _phone(i):
+    return f'2547{i % 100_000_000:08d}'
+
+
+def _receipt(i):
+    return f'BQ{i:08d}'
+
+
+def _stk_row(i):
+    return MpesaTransaction(
+        merchant_request_id=f'{PREFIX}mr-{i}', checkout_request_id=f'{PREFIX}ws-{i}', result_code=0,
+        result_desc='The service request is processed successfully.', amount=10, phone_number=_phone(i),
+        mpesa_receipt_number=_receipt(i), account_reference=f'{PREFIX}invoice-{i}', user_id=i % 5000,
+    )
+
+
+def _b2c_row(i):
+    return MpesaB2CTransaction(
+        conversation_id=f'{PREFIX}conv-{i}', originator_conversation_id=f'{PREFIX}oc-{i}', response_code='0',
+        response_description='Accept the service request successfully.', amount=10, phone_number=_phone(i + 7),
+        command_id='BusinessPayment', remarks=f'{PREFIX}payout {i}', occasion='bench',
+        reference=f'{PREFIX}ref-{i}', user_id=i % 5000,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Measure transaction search latency per query type'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Rows per table')
+        parser.add_argument('--samples', type=int, default=200, help='Searches per query type')
+        parser.add_argument('--chunk', type=int, default=20_000, help='bulk_create batch size while seeding')
+        parser.add_argument('--keep', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        service = TransactionSearchService()
+        queries = {
+            'receipt': lambda i: _receipt(i),
+            'phone_prefix': lambda i: '0' + _phone(i)[3:],
+            'phone_suffix': lambda i: _phone(i)[-6:],
+            'text': lambda i: f'invoice-{i}',
+        }
+
+        try:
+            self._seed(rows, options['chunk'])
+            self.stdout.write(f"{'query':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            for name, make in queries.items():
+                samples = [
+                    timed_ms(service.search, make(random.randrange(rows)), limit=20)[1]
+                    for _ in range(options['samples'])
+                ]
+                self.stdout.write(
+                    f"{name:<14}{percentile(samples, 50):>10.3f}{percentile(samples, 95):>10.3f}"
+                    f"{percentile(samples, 99):>10.3f}"
+                )
+
+            for name, make in queries.items():
+                kind, term = classify(make(123_456))
+                self.stdout.write(f'\n{name} plan (STK):')
+                self.stdout.write(
+                    MpesaTransaction.objects.filter(service._stk_filter(kind, term))
+                    .order_by('-created_at', '-id')[:20].explain()
+                )
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+    def _seed(self, rows, chunk):
+        for model, factory in ((MpesaTransaction, _stk_row), (MpesaB2CTransaction, _b2c_row)):
+            for offset in range(0, rows, chunk):
+                with transaction.atomic():
+                    model.objects.bulk_create([factory(i) for i in range(offset, min(offset + chunk, rows))])
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                for model in (MpesaTransaction, MpesaB2CTransaction):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def _cleanup(self):
+        MpesaTransaction.objects.filter(checkout_request_id__startswith=PREFIX).delete()
+        MpesaB2CTransaction.objects.filter(conversation_id__startswith=PREFIX).delete()
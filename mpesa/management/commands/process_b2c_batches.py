@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from mpesa.services.bulk_b2c import BulkB2CPayout
+
+
+class Command(BaseCommand):
+    help = 'Send the transfers of bulk B2C batches queued through the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep when no batch is pending')
+        parser.add_argument('--batch-id', type=int, help='Run (or resume a failed or abandoned) batch by id. Rows '
+                                                         'that were being sent when it stopped are marked in '
+                                                         'doubt, not resent')
+        parser.add_argument('--workers', type=int, help='Concurrent requests (MPESA_B2C_BULK_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Max requests per second (MPESA_B2C_BULK_RATE)')
+
+    def handle(self, *args, **options):
+        payout = BulkB2CPayout(workers=options['workers'], rate=options['rate'])
+        if options['daemon']:
+            self.stdout.write('Processing B2C batches (Ctrl+C to stop)...')
+            try:
+                payout.run_forever(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        batch = payout.run_next(options['batch_id'])
+        if batch is None:
+            self.stdout.write('No pending B2C batch')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Batch {batch.pk} {batch.status}: {batch.accepted_count} accepted, {batch.failed_count} failed, '
+            f'{batch.in_doubt_count} in doubt'
+        ))
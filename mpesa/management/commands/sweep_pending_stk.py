@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from mpesa.services.stk_sweeper import STKPendingSweeper
+
+
+class Command(BaseCommand):
+    help = 'Query Daraja for STK pushes still pending after their callback should have arrived, and finalize them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds to sleep once the backlog is drained')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, help='Concurrent STK queries (default: MPESA_STK_SWEEP_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Max STK queries per second (default: MPESA_STK_SWEEP_RATE)')
+        parser.add_argument('--older-than', type=int, default=120, help='Seconds a push must have been pending')
+        parser.add_argument('--expire-after', type=int, default=24, help='Hours after which a push still being '
+                                                                         'processed is closed as expired')
+
+    def handle(self, *args, **options):
+        sweeper = STKPendingSweeper(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            rate=options['rate'],
+            older_than=timedelta(seconds=options['older_than']),
+            expire_after=timedelta(hours=options['expire_after']),
+        )
+        if options['daemon']:
+            self.stdout.write('Sweeping pending STK pushes (Ctrl+C to stop)...')
+            try:
+                sweeper.run_forever(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        processed = sweeper.run_once()
+        self.stdout.write(self.style.SUCCESS(f'Queried {processed} pending STK push(es)'))
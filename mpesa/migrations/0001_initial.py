@@ -5,8 +5,6 @@ from django.db import migrations, models
 
 class Migration(migrations.Migration):
 
-    replaces = [('mpesa', '0001_initial'), ('mpesa', '0002_alter_mpesatransaction_result_code')]
-
     initial = True
 
     dependencies = [
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.4 on 2026-10-17 11:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_checkout_request_ids(apps, schema_editor):
+    """Drop unsettled duplicates of a checkout_request_id so it can be made unique.
+
+    Duplicates come from retried initiations. The settled row (result_code set) is
+    kept, else the oldest one. Two settled rows for one id need a human, so the
+    migration stops and names them.
+    """
+    MpesaTransaction = apps.get_model('mpesa', 'MpesaTransaction')
+    duplicated = (MpesaTransaction.objects.values('checkout_request_id')
+                  .annotate(n=Count('id')).filter(n__gt=1).values_list('checkout_request_id', flat=True))
+    for checkout_request_id in duplicated.iterator():
+        rows = list(MpesaTransaction.objects.filter(checkout_request_id=checkout_request_id).order_by('id'))
+        settled = [row for row in rows if row.result_code is not None]
+        if len(settled) > 1:
+            raise RuntimeError(
+                f"Cannot make checkout_request_id unique: MpesaTransaction rows "
+                f"{[row.pk for row in settled]} are all settled for {checkout_request_id}. "
+                f"Resolve them by hand, then rerun migrate."
+            )
+        keep = settled[0] if settled else rows[0]
+        MpesaTransaction.objects.filter(checkout_request_id=checkout_request_id).exclude(pk=keep.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0002_b2c_batches'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_checkout_request_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='checkout_request_id',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='merchant_request_id',
+            field=models.CharField(db_index=True, max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='mpesab2ctransaction',
+            index=models.Index(fields=['user_id', '-created_at'], name='mpesa_b2c_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['user_id', '-created_at'], name='mpesa_stk_user_created_idx'),
+        ),
+    ]
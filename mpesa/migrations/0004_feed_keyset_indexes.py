@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0003_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mpesab2ctransaction',
+            name='mpesa_b2c_user_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mpesatransaction',
+            name='mpesa_stk_user_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mpesab2ctransaction',
+            index=models.Index(fields=['user_id', '-created_at', '-id'], name='mpesa_b2c_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['user_id', '-created_at', '-id'], name='mpesa_stk_user_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:05
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# Trigram indexes serving the icontains text search. Django renders icontains
+# on Postgres as UPPER("col"::text) LIKE UPPER(...), so the indexed expression
+# must match that exactly. Other backends keep the plain LIKE scan.
+TRIGRAM_INDEXES = [
+    ('mpesa_stk_account_ref_trgm', 'mpesa_mpesatransaction', 'account_reference'),
+    ('mpesa_b2c_reference_trgm', 'mpesa_mpesab2ctransaction', 'reference'),
+    ('mpesa_b2c_remarks_trgm', 'mpesa_mpesab2ctransaction', 'remarks'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0004_feed_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesab2ctransaction',
+            name='phone_reversed',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.functions.text.Reverse('phone_number'), output_field=models.CharField(max_length=14)),
+        ),
+        migrations.AddField(
+            model_name='mpesatransaction',
+            name='phone_reversed',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.functions.text.Reverse('phone_number'), output_field=models.CharField(max_length=14, null=True)),
+        ),
+        migrations.AlterField(
+            model_name='mpesab2ctransaction',
+            name='mpesa_receipt_number',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mpesab2ctransaction',
+            name='phone_number',
+            field=models.CharField(db_index=True, max_length=14),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='mpesa_receipt_number',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='mpesatransaction',
+            name='phone_number',
+            field=models.CharField(blank=True, db_index=True, max_length=14, null=True),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0005_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingPointAward',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('points', models.IntegerField()),
+                ('referral_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['applied_at', 'id'], name='mpesa_point_award_due_idx')],
+            },
+        ),
+    ]
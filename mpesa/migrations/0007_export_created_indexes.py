@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0006_pending_point_awards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mpesab2ctransaction',
+            index=models.Index(fields=['created_at', 'id'], name='mpesa_b2c_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['created_at', 'id'], name='mpesa_stk_created_idx'),
+        ),
+    ]
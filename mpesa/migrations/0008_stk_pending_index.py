@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0007_export_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['result_code', 'created_at'], name='mpesa_stk_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0008_stk_pending_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaB2CBatchRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField()),
+                ('phone_number', models.CharField(max_length=14)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(blank=True, max_length=100, null=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('accepted', 'Accepted'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='mpesa.mpesab2cbatch')),
+                ('transaction', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_row', to='mpesa.mpesab2ctransaction')),
+            ],
+            options={
+                'ordering': ['batch', 'row'],
+                'indexes': [models.Index(fields=['batch', 'status', 'row'], name='mpesa_b2c_batch_row_idx')],
+            },
+        ),
+    ]
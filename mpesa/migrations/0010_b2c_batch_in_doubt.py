@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mpesa', '0009_b2c_batch_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesab2cbatch',
+            name='in_doubt_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mpesab2cbatchrow',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('accepted', 'Accepted'), ('failed', 'Failed'), ('in_doubt', 'In doubt')], default='queued', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='mpesab2cbatchrow',
+            index=models.Index(fields=['status', 'phone_number'], name='mpesa_b2c_row_doubt_idx'),
+        ),
+    ]
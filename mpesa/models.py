@@ -1,14 +1,22 @@
 from django.db import models
+from django.db.models.functions import Reverse
 
 class MpesaTransaction(models.Model):
-    merchant_request_id = models.CharField(max_length=50)
-    checkout_request_id = models.CharField(max_length=50)
+    merchant_request_id = models.CharField(max_length=50, db_index=True)
+    checkout_request_id = models.CharField(max_length=50, unique=True)
     result_code = models.IntegerField(null=True, blank=True)
     result_desc = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
-    mpesa_receipt_number = models.CharField(max_length=50, null=True, blank=True)
+    mpesa_receipt_number = models.CharField(max_length=50, null=True, blank=True, db_index=True)
     transaction_date = models.BigIntegerField(null=True, blank=True)
-    phone_number = models.CharField(max_length=14, null=True, blank=True)
+    phone_number = models.CharField(max_length=14, null=True, blank=True, db_index=True)
+    # Reversed digits so phone suffix searches are index range scans (see services/search.py)
+    phone_reversed = models.GeneratedField(
+        expression=Reverse('phone_number'),
+        output_field=models.CharField(max_length=14, null=True),
+        db_persist=True,
+        db_index=True,
+    )
     
     # New fields to match frontend interface
     payment_type = models.CharField(
@@ -33,6 +41,61 @@ class MpesaTransaction(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_id', '-created_at', '-id'], name='mpesa_stk_user_feed_idx'),
+            # Date-windowed ledger export (reporting/export.py)
+            models.Index(fields=['created_at', 'id'], name='mpesa_stk_created_idx'),
+            # Stale pending sweep (services/stk_sweeper.py)
+            models.Index(fields=['result_code', 'created_at'], name='mpesa_stk_pending_idx'),
+        ]
+
+
+class MpesaB2CBatch(models.Model):
+    """Progress record for a bulk B2C payout"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, blank=True)
+    command_id = models.CharField(max_length=50)
+    occasion = models.CharField(max_length=255)
+    remarks = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # Progress counters (accepted = Daraja returned ResponseCode 0; in doubt = sent, answer lost)
+    total_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    processed_count = models.IntegerField(default=0)
+    accepted_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    in_doubt_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)  # Invalid rows, written once: [{"row": n, "error": "..."}]
+
+    user_id = models.IntegerField(null=True, blank=True)  # Reference to user who initiated
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"B2C Batch {self.pk}: {self.processed_count}/{self.total_count} ({self.status})"
+
+    def row_errors(self):
+        """Invalid rows plus the failed and in-doubt payees, in file order"""
+        errors = list(self.errors)
+        errors.extend(
+            {"row": row, "error": error, "status": status}
+            for row, error, status in self.rows.filter(
+                status__in=[MpesaB2CBatchRow.FAILED, MpesaB2CBatchRow.IN_DOUBT]
+            ).values_list('row', 'error', 'status')
+        )
+        return sorted(errors, key=lambda e: e["row"])
+
+    class Meta:
+        ordering = ['-created_at']
 
 
 class MpesaB2CTransaction(models.Model):
@@ -44,7 +107,13 @@ class MpesaB2CTransaction(models.Model):
     
     # Transaction details
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    phone_number = models.CharField(max_length=14)
+    phone_number = models.CharField(max_length=14, db_index=True)
+    phone_reversed = models.GeneratedField(
+        expression=Reverse('phone_number'),
+        output_field=models.CharField(max_length=14),
+        db_persist=True,
+        db_index=True,
+    )
     command_id = models.CharField(max_length=50)  # BusinessPayment, SalaryPayment, PromotionPayment
     remarks = models.TextField()
     occasion = models.CharField(max_length=255)
@@ -52,7 +121,7 @@ class MpesaB2CTransaction(models.Model):
     # Result details (populated by callback)
     result_code = models.IntegerField(null=True, blank=True)
     result_description = models.TextField(null=True, blank=True)
-    mpesa_receipt_number = models.CharField(max_length=50, null=True, blank=True)
+    mpesa_receipt_number = models.CharField(max_length=50, null=True, blank=True, db_index=True)
     transaction_date = models.CharField(max_length=20, null=True, blank=True)
     transaction_completed_date = models.CharField(max_length=20, null=True, blank=True)
     b2c_utility_account_available_funds = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
@@ -63,6 +132,8 @@ class MpesaB2CTransaction(models.Model):
     # Additional tracking
     user_id = models.IntegerField(null=True, blank=True)  # Reference to user who initiated
     reference = models.CharField(max_length=100, null=True, blank=True)  # Custom reference
+    batch = models.ForeignKey(MpesaB2CBatch, null=True, blank=True, on_delete=models.SET_NULL,
+                              related_name='transactions')
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -72,4 +143,70 @@ class MpesaB2CTransaction(models.Model):
         return f"B2C Transfer: {self.phone_number} - KES {self.amount}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user_id', '-created_at', '-id'], name='mpesa_b2c_user_feed_idx'),
+            # Date-windowed ledger export (reporting/export.py)
+            models.Index(fields=['created_at', 'id'], name='mpesa_b2c_created_idx'),
+        ]
+
+class MpesaB2CBatchRow(models.Model):
+    """One payee of a bulk B2C payout, persisted before anything is sent (see services/bulk_b2c.py).
+
+    A row is marked sending just before its request goes out and accepted or
+    failed as soon as Daraja answers, so a worker that dies mid-batch leaves
+    only its in-flight rows in doubt and never sends a row twice. Rows whose
+    request went out without a usable answer (read timeout, 5xx, interrupted
+    worker) stay in doubt until a B2C result callback settles them.
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    ACCEPTED = 'accepted'
+    FAILED = 'failed'
+    IN_DOUBT = 'in_doubt'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (ACCEPTED, 'Accepted'),
+        (FAILED, 'Failed'),
+        (IN_DOUBT, 'In doubt'),
+    ]
+
+    batch = models.ForeignKey(MpesaB2CBatch, on_delete=models.CASCADE, related_name='rows')
+    row = models.IntegerField()  # 1-based position in the uploaded file
+    phone_number = models.CharField(max_length=14)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reference = models.CharField(max_length=100, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    transaction = models.OneToOneField(MpesaB2CTransaction, null=True, blank=True, on_delete=models.SET_NULL,
+                                       related_name='batch_row')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"B2C Batch {self.batch_id} row {self.row}: {self.status}"
+
+    class Meta:
+        ordering = ['batch', 'row']
+        indexes = [
+            models.Index(fields=['batch', 'status', 'row'], name='mpesa_b2c_batch_row_idx'),
+            # Result callbacks matching an in-doubt row (services/bulk_b2c.py:settle_in_doubt)
+            models.Index(fields=['status', 'phone_number'], name='mpesa_b2c_row_doubt_idx'),
+        ]
+
+
+class PendingPointAward(models.Model):
+    """Referral points queued by a subscription payment (REFERRAL_POINTS_MODE=deferred)"""
+    user_id = models.IntegerField()  # Reference to the user receiving the points
+    points = models.IntegerField()
+    referral_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.points} point(s) for user {self.user_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['applied_at', 'id'], name='mpesa_point_award_due_idx'),
+        ]
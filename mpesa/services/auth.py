@@ -0,0 +1,189 @@
+"""
+M-Pesa OAuth Token Manager
+Shares Daraja bearer tokens across services, requests and workers
+"""
+import logging
+import threading
+import time
+
+import requests
+from requests.auth import HTTPBasicAuth
+from decouple import config
+from django.core.cache import caches
+
+from core.transport import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class DarajaTokenManager:
+    """
+    Process-wide cache for Daraja OAuth tokens
+
+    Tokens are stored in Django's cache framework so every gunicorn worker
+    shares one token, with an in-process copy as a fallback when the cache
+    backend is unavailable. Fetches are single-flight: one lock per process
+    plus a cache-level lock across workers, so a burst of concurrent
+    checkouts triggers a single call to /oauth/v1/generate. Tokens close to
+    expiry are refreshed in a background thread while the current one is
+    still served.
+    """
+
+    CACHE_KEY_PREFIX = 'mpesa:oauth'
+
+    def __init__(self, consumer_key, consumer_secret, base_host, cache_alias='default',
+                 refresh_margin=None, lock_timeout=None):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.base_host = base_host
+        self.cache_alias = cache_alias
+        self.refresh_margin = refresh_margin if refresh_margin is not None else config(
+            'MPESA_TOKEN_REFRESH_MARGIN', default=300, cast=int)
+        self.lock_timeout = lock_timeout if lock_timeout is not None else config(
+            'MPESA_TOKEN_LOCK_TIMEOUT', default=20, cast=int)
+
+        self.cache_key = f"{self.CACHE_KEY_PREFIX}:{base_host}:{consumer_key}"
+        self.lock_key = f"{self.cache_key}:lock"
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._local = None  # (token, expires_at) fallback when the shared cache is down
+        self._refreshing = False
+
+    def get_token(self):
+        """Return an Authorization header value ("Bearer ...") for Daraja requests"""
+        entry = self._current_entry()
+        if entry is None:
+            entry = self._fetch_single_flight()
+        elif entry[1] - time.time() < self.refresh_margin:
+            self._schedule_refresh()
+        return f"Bearer {entry[0]}"
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Safaricom rejects it with a 401"""
+        with self._lock:
+            self._local = None
+        self._cache_call('delete', self.cache_key)
+
+    def _current_entry(self):
+        """Return the shared unexpired (token, expires_at) pair, or None
+
+        The shared cache is authoritative, so an invalidate() in any worker
+        is seen by all of them; the in-process copy is only used while the
+        cache backend is down.
+        """
+        now = time.time()
+        try:
+            cached = caches[self.cache_alias].get(self.cache_key)
+        except Exception as e:
+            logger.warning("M-Pesa token cache unavailable (get): %s", e)
+            return self._local if self._local and self._local[1] > now else None
+
+        if cached and cached.get('expires_at', 0) > now:
+            self._local = (cached['access_token'], cached['expires_at'])
+            return self._local
+        return None
+
+    def _fetch_single_flight(self, force=False):
+        """Fetch a new token, making sure only one caller does the upstream request"""
+        with self._lock:
+            if not force:
+                entry = self._current_entry()
+                if entry is not None:
+                    return entry
+
+            # Cross-worker lock: cache.add is atomic on the shared backends
+            acquired = self._cache_call('add', self.lock_key, 1, self.lock_timeout)
+            if acquired is False:
+                entry = self._wait_for_peer()
+                if entry is not None:
+                    return entry
+
+            try:
+                if force and acquired:
+                    # A peer may have refreshed while this worker crossed the margin
+                    entry = self._current_entry()
+                    if entry is not None and entry[1] - time.time() >= self.refresh_margin:
+                        return entry
+                entry = self._request_token()
+                self._local = entry
+                timeout = max(int(entry[1] - time.time()), 1)
+                self._cache_call('set', self.cache_key, {
+                    'access_token': entry[0],
+                    'expires_at': entry[1],
+                }, timeout)
+                return entry
+            finally:
+                if acquired:
+                    self._cache_call('delete', self.lock_key)
+
+    def _wait_for_peer(self):
+        """Another worker holds the fetch lock; wait for it to publish the token"""
+        known_expiry = self._local[1] if self._local else 0
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            cached = self._cache_call('get', self.cache_key)
+            if cached and cached.get('expires_at', 0) > max(known_expiry, time.time()):
+                return cached['access_token'], cached['expires_at']
+            if self._cache_call('get', self.lock_key) is None:
+                break
+        return None
+
+    def _schedule_refresh(self):
+        """Refresh the token in the background before it expires"""
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self._fetch_single_flight(force=True)
+            except Exception as e:
+                logger.warning("Background M-Pesa token refresh failed: %s", e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_run, name='mpesa-token-refresh', daemon=True).start()
+
+    def _request_token(self):
+        """Call Safaricom's OAuth endpoint and return (token, expires_at)"""
+        api_url = f"{self.base_host}/oauth/v1/generate?grant_type=client_credentials"
+
+        try:
+            response = get_session(api_url).get(
+                api_url,
+                auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
+                timeout=15
+            )
+            response.raise_for_status()
+            token_data = response.json()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to get access token: {str(e)}")
+
+        expires_in = int(token_data.get('expires_in', 3599))
+        return token_data['access_token'], time.time() + expires_in
+
+    def _cache_call(self, method, *args):
+        """Run a cache operation, degrading to the in-process copy on backend errors"""
+        try:
+            return getattr(caches[self.cache_alias], method)(*args)
+        except Exception as e:
+            logger.warning("M-Pesa token cache unavailable (%s): %s", method, e)
+            return None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(consumer_key, consumer_secret, base_host):
+    """Return the shared token manager for a Daraja host and app credentials"""
+    key = (base_host, consumer_key)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None or manager.consumer_secret != consumer_secret:
+            manager = DarajaTokenManager(consumer_key, consumer_secret, base_host)
+            _managers[key] = manager
+        return manager
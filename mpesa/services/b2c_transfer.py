@@ -3,9 +3,15 @@ M-Pesa B2C Transfer Service
 Handles sending money to customers (B2C)
 """
 import requests
+import httpx
 import json
-from requests.auth import HTTPBasicAuth
+from asgiref.sync import sync_to_async
 from decouple import config
+from core.aio_transport import get_async_client
+from core.transport import get_session
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from .auth import get_token_manager
 from ..models import MpesaB2CTransaction
 from django.conf import settings
 
@@ -27,23 +33,16 @@ class B2CTransferService:
             raise ValueError('B2C_QUEUE_TIMEOUT_URL and B2C_RESULT_URL must be set in environment variables')
 
     def _base_host(self) -> str:
-        return 'https://sandbox.safaricom.co.ke' if getattr(settings, 'DEBUG', False) else 'https://api.safaricom.co.ke'
+        default = 'https://sandbox.safaricom.co.ke' if getattr(settings, 'DEBUG', False) else 'https://api.safaricom.co.ke'
+        return config('DARAJA_BASE_URL', default=default)
         
+    def _token_manager(self):
+        """Shared OAuth token manager for this host and credentials"""
+        return get_token_manager(self.consumer_key, self.consumer_secret, self._base_host())
+
     def get_access_token(self):
-        """Get access token from Safaricom API"""
-        api_url = f"{self._base_host()}/oauth/v1/generate?grant_type=client_credentials"
-        
-        try:
-            response = requests.get(
-                api_url,
-                auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
-                timeout=15
-            )
-            response.raise_for_status()
-            token_data = response.json()
-            return f"Bearer {token_data['access_token']}"
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Failed to get access token: {str(e)}")
+        """Get access token from Safaricom API (cached across requests and workers)"""
+        return self._token_manager().get_token()
             
     def validate_phone_number(self, phone):
         """Validate and format phone number"""
@@ -61,22 +60,8 @@ class B2CTransferService:
         except (ValueError, TypeError):
             raise ValueError("Invalid amount. Must be a positive number")
             
-    def send_money(self, phone, amount, occasion="Payment", remarks="Money transfer", 
-                   command_id="BusinessPayment", user_id=None, reference=None):
-        """
-        Send money to customer
-        
-        Args:
-            phone: Customer phone number (254XXXXXXXXX)
-            amount: Amount to send
-            occasion: Occasion for the payment
-            remarks: Remarks for the payment
-            command_id: BusinessPayment, SalaryPayment, or PromotionPayment
-            user_id: User ID if this is linked to a user
-            reference: Reference for tracking
-        """
-        
-        # Validate inputs
+    def _validate_transfer(self, phone, amount, command_id):
+        """Validate transfer inputs, returning normalized phone and amount"""
         phone = self.validate_phone_number(phone)
         amount = self.validate_amount(amount)
         
@@ -84,11 +69,10 @@ class B2CTransferService:
         valid_commands = ["BusinessPayment", "SalaryPayment", "PromotionPayment"]
         if command_id not in valid_commands:
             raise ValueError(f"Invalid command_id. Must be one of: {valid_commands}")
-        
-        # Get access token
-        access_token = self.get_access_token()
-        
-        # Prepare payload
+        return phone, amount
+    
+    def _build_request(self, access_token, phone, amount, occasion, remarks, command_id):
+        """Build B2C payload and headers"""
         payload = {
             "InitiatorName": self.initiator_name,
             "SecurityCredential": self.security_credential,
@@ -106,33 +90,68 @@ class B2CTransferService:
             "Authorization": access_token,
             "Content-Type": "application/json"
         }
+        return payload, headers
+    
+    def _transaction_fields(self, response_data, phone, amount, occasion, remarks, command_id, user_id, reference):
+        """Fields for the MpesaB2CTransaction row"""
+        return dict(
+            conversation_id=response_data.get('ConversationID', ''),
+            originator_conversation_id=response_data.get('OriginatorConversationID', ''),
+            response_code=response_data.get('ResponseCode', ''),
+            response_description=response_data.get('ResponseDescription', ''),
+            amount=amount,
+            phone_number=phone,
+            command_id=command_id,
+            remarks=remarks,
+            occasion=occasion,
+            user_id=user_id,
+            reference=reference
+        )
+            
+    def send_money(self, phone, amount, occasion="Payment", remarks="Money transfer", 
+                   command_id="BusinessPayment", user_id=None, reference=None):
+        """
+        Send money to customer
+        
+        Args:
+            phone: Customer phone number (254XXXXXXXXX)
+            amount: Amount to send
+            occasion: Occasion for the payment
+            remarks: Remarks for the payment
+            command_id: BusinessPayment, SalaryPayment, or PromotionPayment
+            user_id: User ID if this is linked to a user
+            reference: Reference for tracking
+        """
+        
+        # Validate inputs
+        phone, amount = self._validate_transfer(phone, amount, command_id)
+        
+        # Get access token and prepare request
+        access_token = self.get_access_token()
+        payload, headers = self._build_request(access_token, phone, amount, occasion, remarks, command_id)
         
         try:
             # Make API request
-            response = requests.post(
+            response = get_session(self._base_host()).post(
                 f"{self._base_host()}/mpesa/b2c/v1/paymentrequest",
                 json=payload,
                 headers=headers,
                 timeout=20
             )
+            if response.status_code == 401:
+                # Token revoked or rotated upstream; force a fresh one next time
+                self._token_manager().invalidate()
             response.raise_for_status()
             response_data = response.json()
             
             # Store transaction in database
             if response_data.get('ResponseCode') == '0':
-                transaction = MpesaB2CTransaction.objects.create(
-                    conversation_id=response_data.get('ConversationID', ''),
-                    originator_conversation_id=response_data.get('OriginatorConversationID', ''),
-                    response_code=response_data.get('ResponseCode', ''),
-                    response_description=response_data.get('ResponseDescription', ''),
-                    amount=amount,
-                    phone_number=phone,
-                    command_id=command_id,
-                    remarks=remarks,
-                    occasion=occasion,
-                    user_id=user_id,
-                    reference=reference
-                )
+                transaction = MpesaB2CTransaction.objects.create(**self._transaction_fields(
+                    response_data, phone, amount, occasion, remarks, command_id, user_id, reference
+                ))
+                rollups.record(Provider.MPESA_B2C, transaction.created_at, RollupStatus.PENDING,
+                               transaction.amount, transaction.user_id)
+                ledger.record(LedgerProvider.MPESA_B2C, transaction)
                 
                 # Add transaction ID to response
                 response_data['transaction_id'] = transaction.id
@@ -143,6 +162,45 @@ class B2CTransferService:
             raise Exception(f"B2C transfer request failed: {str(e)}")
         except Exception as e:
             raise Exception(f"Failed to send money: {str(e)}")
+
+    async def asend_money(self, phone, amount, occasion="Payment", remarks="Money transfer",
+                          command_id="BusinessPayment", user_id=None, reference=None):
+        """Async variant of send_money for the ASGI request path"""
+        
+        # Validate inputs
+        phone, amount = self._validate_transfer(phone, amount, command_id)
+        
+        # Token is usually cached; a refresh runs off the event loop
+        access_token = await sync_to_async(self.get_access_token, thread_sensitive=False)()
+        payload, headers = self._build_request(access_token, phone, amount, occasion, remarks, command_id)
+        
+        try:
+            response = await get_async_client(self._base_host()).post(
+                f"{self._base_host()}/mpesa/b2c/v1/paymentrequest",
+                json=payload,
+                headers=headers,
+                timeout=20
+            )
+            if response.status_code == 401:
+                await sync_to_async(self._token_manager().invalidate, thread_sensitive=False)()
+            response.raise_for_status()
+            response_data = response.json()
+            
+            if response_data.get('ResponseCode') == '0':
+                transaction = await MpesaB2CTransaction.objects.acreate(**self._transaction_fields(
+                    response_data, phone, amount, occasion, remarks, command_id, user_id, reference
+                ))
+                await sync_to_async(rollups.record)(Provider.MPESA_B2C, transaction.created_at,
+                                                    RollupStatus.PENDING, transaction.amount, transaction.user_id)
+                await sync_to_async(ledger.record)(LedgerProvider.MPESA_B2C, transaction)
+                response_data['transaction_id'] = transaction.id
+            
+            return response_data
+            
+        except httpx.HTTPError as e:
+            raise Exception(f"B2C transfer request failed: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Failed to send money: {str(e)}")
             
     def get_transfer_status(self, conversation_id):
         """Get transfer status by conversation ID"""
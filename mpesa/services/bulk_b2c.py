@@ -0,0 +1,342 @@
+"""
+M-Pesa Bulk B2C Payout Service
+Validates and dispatches batches of B2C transfers (salaries, refunds, commissions)
+"""
+import csv
+import io
+import json
+import logging
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from decouple import config
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.ratelimit import RateLimiter
+from core.transport import get_session
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from .b2c_transfer import B2CTransferService
+from ..models import MpesaB2CBatch, MpesaB2CBatchRow, MpesaB2CTransaction
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_REQUEST_PATH = "/mpesa/b2c/v1/paymentrequest"
+VALID_COMMANDS = ("BusinessPayment", "SalaryPayment", "PromotionPayment")
+
+_PHONE_RE = re.compile(r"^254\d{9}$")
+_AMOUNT_RE = re.compile(r"^\d+$")
+
+
+class InDoubt(Exception):
+    """The request went out but no usable answer came back: M-Pesa may have accepted it"""
+
+
+@dataclass(frozen=True)
+class PayoutRow:
+    row: int  # 1-based position in the uploaded file
+    phone: str
+    amount: int
+    reference: str | None = None
+
+
+def load_rows(data, fmt=None):
+    """Parse CSV (phone,amount,reference header) or a JSON list of objects"""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    fmt = (fmt or ("json" if data.lstrip().startswith(("[", "{")) else "csv")).lower()
+    if fmt == "json":
+        parsed = json.loads(data)
+        rows = parsed.get("rows", []) if isinstance(parsed, dict) else parsed
+        if not isinstance(rows, list):
+            raise ValueError("JSON payouts must be a list of {phone, amount, reference} objects")
+        return rows
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(data))
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        return list(reader)
+    raise ValueError("Unsupported format. Use csv or json")
+
+
+def validate_rows(rows):
+    """Validate every row in one pass before anything is sent.
+
+    Returns (valid PayoutRows, [{"row": n, "error": "..."}]). Uses the same rules
+    as B2CTransferService.validate_phone_number / validate_amount, and rejects
+    references repeated within the file so one upload cannot pay a row twice.
+    """
+    valid, errors = [], []
+    seen_refs = set()
+    for index, item in enumerate(rows, start=1):
+        if not isinstance(item, dict):
+            errors.append({"row": index, "error": "Row must be an object"})
+            continue
+        phone = str(item.get("phone") or "").strip().lstrip("+")
+        amount = str(item.get("amount") or "").strip()
+        reference = str(item.get("reference") or "").strip() or None
+
+        if not _PHONE_RE.match(phone):
+            errors.append({"row": index, "error": "Invalid phone number. Use format 254XXXXXXXXX"})
+        elif not _AMOUNT_RE.match(amount) or int(amount) < 1:
+            errors.append({"row": index, "error": "Invalid amount. Must be a positive whole number"})
+        elif reference and reference in seen_refs:
+            errors.append({"row": index, "error": f"Duplicate reference {reference}"})
+        else:
+            if reference:
+                seen_refs.add(reference)
+            valid.append(PayoutRow(index, phone, int(amount), reference))
+    return valid, errors
+
+
+class BulkB2CPayout:
+    """
+    Dispatches a batch on a bounded thread pool sharing one pooled session and
+    token, throttled by a token bucket so Daraja's per-second limits hold for
+    any worker count.
+
+    Every payee is stored as an MpesaB2CBatchRow when the batch is created.
+    A row is marked sending before its request goes out, and each accepted
+    transfer is written (with its rollup and ledger entries) as soon as
+    Daraja answers, so at most ``workers`` rows are ever in flight. Batches
+    are run by a worker process (process_b2c_batches), never by the web
+    request that created them.
+
+    A worker owns a batch from the conditional update that moves it to
+    processing; every row it settles bumps the batch's updated_at, so a
+    processing batch untouched for ``stale_after`` belongs to a dead worker
+    and may be taken over. Rows that may have reached M-Pesa (read timeout,
+    5xx, left sending by a dead worker) are marked in doubt rather than
+    failed or resent; settle_in_doubt matches them to their result callback.
+    """
+
+    INTERRUPTED = "Interrupted while sending; M-Pesa may have accepted it"
+
+    def __init__(self, service=None, workers=None, rate=None, stale_after=None):
+        self.service = service or B2CTransferService()
+        self.workers = workers or config('MPESA_B2C_BULK_WORKERS', default=8, cast=int)
+        self.rate = rate if rate is not None else config('MPESA_B2C_BULK_RATE', default=10, cast=float)
+        self.stale_after = timedelta(seconds=stale_after if stale_after is not None else
+                                     config('MPESA_B2C_BULK_STALE_AFTER', default=600, cast=int))
+
+    def create_batch(self, rows, command_id="BusinessPayment", occasion="Bulk payout", remarks="Bulk payout",
+                     name="", user_id=None, claimed=False):
+        """Validate rows and record the batch with its payees; returns (batch, valid rows)
+
+        claimed=True creates the batch already processing, owned by the caller,
+        so no worker picks it up before the caller's run().
+        """
+        if command_id not in VALID_COMMANDS:
+            raise ValueError(f"Invalid command_id. Must be one of: {list(VALID_COMMANDS)}")
+        valid, errors = validate_rows(rows)
+        with transaction.atomic():
+            batch = MpesaB2CBatch.objects.create(
+                name=name,
+                command_id=command_id,
+                occasion=occasion,
+                remarks=remarks,
+                status='processing' if claimed else 'pending',
+                total_count=len(valid) + len(errors),
+                total_amount=sum((Decimal(r.amount) for r in valid), Decimal(0)),
+                processed_count=len(errors),
+                failed_count=len(errors),
+                errors=errors,
+                user_id=user_id,
+            )
+            MpesaB2CBatchRow.objects.bulk_create(
+                MpesaB2CBatchRow(batch=batch, row=r.row, phone_number=r.phone, amount=r.amount, reference=r.reference)
+                for r in valid
+            )
+        return batch, valid
+
+    def _submit(self, batch, row):
+        """Send one transfer; returns Daraja's response data, raises InDoubt if it may have been sent"""
+        self.limiter.acquire()
+        access_token = self.service.get_access_token()
+        payload, headers = self.service._build_request(
+            access_token, row.phone_number, int(row.amount), batch.occasion, batch.remarks, batch.command_id
+        )
+        host = self.service._base_host()
+        try:
+            response = get_session(host).post(f"{host}{PAYMENT_REQUEST_PATH}", json=payload, headers=headers,
+                                              timeout=20)
+        except requests.ConnectTimeout:
+            raise  # never connected, so nothing was sent
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise InDoubt(f"No answer from M-Pesa: {e}") from e
+        if response.status_code == 401:
+            self.service._token_manager().invalidate()
+        if response.status_code >= 500:
+            raise InDoubt(f"M-Pesa answered HTTP {response.status_code}")
+        response.raise_for_status()
+        return response.json()
+
+    def run(self, batch):
+        """Dispatch the batch's queued rows and return the updated batch
+
+        The caller must own the batch: see run_next, or create_batch(claimed=True).
+        """
+        self.limiter = RateLimiter(self.rate)
+
+        try:
+            for row in batch.rows.filter(status=MpesaB2CBatchRow.SENDING):
+                self._in_doubt(batch, row, self.INTERRUPTED)
+
+            queued = iter(list(batch.rows.filter(status=MpesaB2CBatchRow.QUEUED).order_by('row')))
+            in_flight = {}
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                while True:
+                    while len(in_flight) < self.workers:
+                        row = next(queued, None)
+                        if row is None:
+                            break
+                        # Durable before the request goes out, so a crash cannot lead to a second payment.
+                        # Conditional, so a row another worker already took is skipped
+                        if not MpesaB2CBatchRow.objects.filter(pk=row.pk, status=MpesaB2CBatchRow.QUEUED).update(
+                                status=MpesaB2CBatchRow.SENDING, updated_at=timezone.now()):
+                            continue
+                        in_flight[pool.submit(self._submit, batch, row)] = row
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        row = in_flight.pop(future)
+                        try:
+                            data = future.result()
+                        except InDoubt as e:
+                            self._in_doubt(batch, row, str(e))
+                            continue
+                        except Exception as e:
+                            # One bad row (timeout, 5xx, token failure) must not stop the batch
+                            data = {"ResponseDescription": f"B2C transfer request failed: {e}"}
+                        if data.get('ResponseCode') == '0':
+                            self._accepted(batch, row, data)
+                        else:
+                            self._failed(batch, row, data.get('ResponseDescription') or data.get('errorMessage')
+                                         or 'Rejected')
+        except Exception:
+            MpesaB2CBatch.objects.filter(pk=batch.pk).update(status='failed', updated_at=timezone.now())
+            raise
+
+        MpesaB2CBatch.objects.filter(pk=batch.pk).update(status='completed', completed_at=timezone.now(),
+                                                         updated_at=timezone.now())
+        batch.refresh_from_db()
+        return batch
+
+    def _count(self, batch, **counters):
+        """Bump the batch's counters in the database; also its heartbeat (updated_at)"""
+        MpesaB2CBatch.objects.filter(pk=batch.pk).update(
+            updated_at=timezone.now(), **{name: F(name) + step for name, step in counters.items()}
+        )
+
+    def _accepted(self, batch, row, data):
+        with transaction.atomic():
+            transfer = MpesaB2CTransaction.objects.create(batch=batch, **self.service._transaction_fields(
+                data, row.phone_number, row.amount, batch.occasion, batch.remarks, batch.command_id,
+                batch.user_id, row.reference
+            ))
+            MpesaB2CBatchRow.objects.filter(pk=row.pk).update(status=MpesaB2CBatchRow.ACCEPTED, transaction=transfer,
+                                                              updated_at=timezone.now())
+            self._count(batch, processed_count=1, accepted_count=1)
+            rollups.record(Provider.MPESA_B2C, transfer.created_at, RollupStatus.PENDING, transfer.amount,
+                           transfer.user_id)
+            ledger.record(LedgerProvider.MPESA_B2C, transfer)
+
+    def _failed(self, batch, row, error):
+        with transaction.atomic():
+            MpesaB2CBatchRow.objects.filter(pk=row.pk).update(status=MpesaB2CBatchRow.FAILED, error=error,
+                                                              updated_at=timezone.now())
+            self._count(batch, processed_count=1, failed_count=1)
+
+    def _in_doubt(self, batch, row, error):
+        logger.warning(f"B2C batch {batch.pk} row {row.row} in doubt: {error}")
+        with transaction.atomic():
+            MpesaB2CBatchRow.objects.filter(pk=row.pk).update(status=MpesaB2CBatchRow.IN_DOUBT, error=error,
+                                                              updated_at=timezone.now())
+            self._count(batch, processed_count=1, in_doubt_count=1)
+
+    def run_next(self, batch_id=None):
+        """Claim and run the oldest pending batch (or the given one, to resume it); returns it or None
+
+        A processing batch is only taken over once its heartbeat is older than
+        stale_after. A batch another worker owns is returned as it is.
+        """
+        stale = Q(status='processing', updated_at__lt=timezone.now() - self.stale_after)
+        if batch_id:
+            batches = MpesaB2CBatch.objects.filter(Q(status__in=('pending', 'failed')) | stale, pk=batch_id)
+        else:
+            batches = MpesaB2CBatch.objects.filter(Q(status='pending') | stale).order_by('created_at', 'id')
+        batch = batches.first()
+        if batch is None:
+            return MpesaB2CBatch.objects.filter(pk=batch_id).first() if batch_id else None
+        # Conditional on what was read: of two workers racing for it, one updates a row
+        claimed = MpesaB2CBatch.objects.filter(pk=batch.pk, status=batch.status, updated_at=batch.updated_at).update(
+            status='processing', updated_at=timezone.now()
+        )
+        if not claimed:
+            return MpesaB2CBatch.objects.get(pk=batch.pk)
+        return self.run(batch)
+
+    def run_forever(self, interval=5, stop_event=None):
+        """Daemon loop: run pending (or abandoned) batches one after another, sleeping when there are none."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                batch = self.run_next()
+            except Exception as e:
+                logger.error(f"Error running B2C batches: {e}")
+                batch = None
+            if batch is None:
+                stop_event.wait(interval)
+
+
+def settle_in_doubt(result):
+    """Attach a successful B2C result with an unknown ConversationID to the in-doubt row it paid
+
+    Matches on the receiver's phone number and the amount, oldest row first,
+    and records the accepted transfer the batch run could not. Call inside
+    the callback's transaction; returns the new MpesaB2CTransaction or None.
+    A failed result carries neither, so its row stays in doubt for a person
+    to check.
+    """
+    parameters = {p.get('Key'): p.get('Value')
+                  for p in (result.get('ResultParameters') or {}).get('ResultParameter', [])}
+    phone = str(parameters.get('ReceiverPartyPublicName') or '').split(' - ')[0].strip()
+    amount = parameters.get('TransactionAmount')
+    if not (result.get('ConversationID') and _PHONE_RE.match(phone) and amount):
+        return None
+    row = MpesaB2CBatchRow.objects.select_for_update().filter(
+        status=MpesaB2CBatchRow.IN_DOUBT, phone_number=phone, amount=amount
+    ).order_by('updated_at', 'pk').select_related('batch').first()
+    if row is None:
+        return None
+
+    batch = row.batch
+    transfer = MpesaB2CTransaction.objects.create(
+        batch=batch,
+        conversation_id=result['ConversationID'],
+        originator_conversation_id=result.get('OriginatorConversationID') or '',
+        response_code='0',
+        response_description='Accepted (settled from the result callback)',
+        amount=row.amount,
+        phone_number=row.phone_number,
+        command_id=batch.command_id,
+        remarks=batch.remarks,
+        occasion=batch.occasion,
+        user_id=batch.user_id,
+        reference=row.reference,
+    )
+    MpesaB2CBatchRow.objects.filter(pk=row.pk).update(status=MpesaB2CBatchRow.ACCEPTED, transaction=transfer,
+                                                      error='', updated_at=timezone.now())
+    MpesaB2CBatch.objects.filter(pk=batch.pk).update(accepted_count=F('accepted_count') + 1,
+                                                     in_doubt_count=F('in_doubt_count') - 1)
+    rollups.record(Provider.MPESA_B2C, transfer.created_at, RollupStatus.PENDING, transfer.amount, transfer.user_id)
+    ledger.record(LedgerProvider.MPESA_B2C, transfer)
+    return transfer
@@ -4,8 +4,27 @@ Handles all M-Pesa callback processing
 """
 import json
 from django.utils import timezone
+from django.db import transaction as db_transaction
 from django.http import JsonResponse
+from core import idempotency, inbox
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from reporting.rollups import mpesa_status
 from ..models import MpesaTransaction, MpesaB2CTransaction
+from .bulk_b2c import settle_in_doubt
+from .referrals import SubscriptionActivationService, subscription_id_from_reference
+
+# Callback inbox kinds (see core/inbox.py)
+STK_CALLBACK = 'mpesa.stk'
+B2C_RESULT = 'mpesa.b2c_result'
+B2C_TIMEOUT = 'mpesa.b2c_timeout'
+
+# Columns a callback can change; everything else is left untouched on write
+STK_RESULT_FIELDS = ['result_code', 'result_desc', 'amount', 'mpesa_receipt_number', 'transaction_date',
+                     'phone_number', 'updated_at']
+B2C_RESULT_FIELDS = ['result_code', 'result_description', 'mpesa_receipt_number', 'transaction_completed_date',
+                     'b2c_utility_account_available_funds', 'b2c_working_account_available_funds',
+                     'b2c_charges_paid_account_available_funds', 'receiver_party_public_name', 'updated_at']
 
 
 class CallbackService:
@@ -13,61 +32,49 @@ class CallbackService:
     def process_stk_callback_request(self, request):
         """
         Process STK Push callback HTTP request
-        Parses request body and delegates to handle_stk_callback
+        Parses request body and queues it for handle_stk_callback
         """
-        try:
-            data = json.loads(request.body.decode('utf-8'))
-            result = self.handle_stk_callback(data)
-            
-            return JsonResponse({
-                'ResultCode': 0,
-                'ResultDesc': 'Callback processed successfully'
-            })
-            
-        except Exception as e:
-            return JsonResponse({
-                'ResultCode': 1,
-                'ResultDesc': f'Callback processing failed: {str(e)}'
-            })
+        return self._accept(request, STK_CALLBACK, 'Callback')
     
     def process_b2c_result_request(self, request):
         """
         Process B2C result callback HTTP request
-        Parses request body and delegates to handle_b2c_result
+        Parses request body and queues it for handle_b2c_result
         """
-        try:
-            data = json.loads(request.body.decode('utf-8'))
-            result = self.handle_b2c_result(data)
-            
-            return JsonResponse({
-                'ResultCode': 0,
-                'ResultDesc': 'B2C callback processed successfully'
-            })
-            
-        except Exception as e:
-            return JsonResponse({
-                'ResultCode': 1,
-                'ResultDesc': f'B2C callback processing failed: {str(e)}'
-            })
+        return self._accept(request, B2C_RESULT, 'B2C callback')
     
     def process_b2c_timeout_request(self, request):
         """
         Process B2C timeout callback HTTP request
-        Parses request body and delegates to handle_b2c_timeout
+        Parses request body and queues it for handle_b2c_timeout
+        """
+        return self._accept(request, B2C_TIMEOUT, 'B2C timeout')
+    
+    def _accept(self, request, kind, label):
+        """
+        Store the payload in the callback inbox and acknowledge straight away,
+        so Safaricom never waits on our database. With CALLBACK_INBOX_ENABLED
+        off the payload is applied inline as before.
         """
         try:
             data = json.loads(request.body.decode('utf-8'))
-            result = self.handle_b2c_timeout(data)
+            if inbox.enabled():
+                inbox.enqueue(kind, data)
+                return JsonResponse({
+                    'ResultCode': 0,
+                    'ResultDesc': f'{label} accepted'
+                })
             
+            inbox.dispatch(kind, data)
             return JsonResponse({
                 'ResultCode': 0,
-                'ResultDesc': 'B2C timeout processed successfully'
+                'ResultDesc': f'{label} processed successfully'
             })
             
         except Exception as e:
             return JsonResponse({
                 'ResultCode': 1,
-                'ResultDesc': f'B2C timeout processing failed: {str(e)}'
+                'ResultDesc': f'{label} processing failed: {str(e)}'
             })
     
     def handle_stk_callback(self, request_data):
@@ -81,7 +88,6 @@ class CallbackService:
             merchant_request_id = stkCallback.get('MerchantRequestID')
             checkout_request_id = stkCallback.get('CheckoutRequestID')
             result_code = stkCallback.get('ResultCode', -1)
-            result_desc = stkCallback.get('ResultDesc', 'Unknown error')
             
             if not merchant_request_id or not checkout_request_id:
                 return {
@@ -89,53 +95,47 @@ class CallbackService:
                     'message': 'Missing required callback data'
                 }
             
-            # Find the transaction
-            try:
-                transaction = MpesaTransaction.objects.get(
-                    merchant_request_id=merchant_request_id,
-                    checkout_request_id=checkout_request_id
-                )
-            except MpesaTransaction.DoesNotExist:
+            with db_transaction.atomic():
+                # Replays of an applied delivery stop here, before any transaction lookup
+                if not idempotency.claim(STK_CALLBACK, checkout_request_id):
+                    return {
+                        'status': 'duplicate',
+                        'message': 'Callback already processed'
+                    }
+                
+                # Find and lock the transaction, so a concurrent writer (the STK sweeper) is not double counted
+                try:
+                    transaction = MpesaTransaction.objects.select_for_update().get(
+                        merchant_request_id=merchant_request_id,
+                        checkout_request_id=checkout_request_id
+                    )
+                except MpesaTransaction.DoesNotExist:
+                    db_transaction.set_rollback(True)
+                    return {
+                        'status': 'error',
+                        'message': 'Transaction not found'
+                    }
+                
+                previous_status, previous_amount = mpesa_status(transaction.result_code), transaction.amount
+                
+                self._apply_stk_result(transaction, stkCallback)
+                transaction.save(update_fields=STK_RESULT_FIELDS)
+                rollups.transition(Provider.MPESA_STK, transaction.created_at, previous_status,
+                                   mpesa_status(result_code), transaction.amount, transaction.user_id,
+                                   from_amount=previous_amount)
+                ledger.transition(LedgerProvider.MPESA_STK, transaction, previous_status)
+                
+                # If payment successful, handle subscription activation
+                if result_code == 0:
+                    self._handle_successful_subscription_payment(transaction)
+                
                 return {
-                    'status': 'error',
-                    'message': 'Transaction not found'
+                    'status': 'success',
+                    'message': 'Callback processed successfully',
+                    'transaction_id': transaction.id,
+                    'result_code': result_code
                 }
             
-            # Update transaction with callback data
-            transaction.result_code = result_code
-            transaction.result_desc = result_desc
-            
-            # If successful, extract additional details
-            if result_code == 0:
-                callback_metadata = stkCallback.get('CallbackMetadata', {})
-                items = callback_metadata.get('Item', [])
-                
-                for item in items:
-                    name = item.get('Name')
-                    value = item.get('Value')
-                    
-                    if name == 'Amount':
-                        transaction.amount = value
-                    elif name == 'MpesaReceiptNumber':
-                        transaction.mpesa_receipt_number = value
-                    elif name == 'TransactionDate':
-                        transaction.transaction_date = value
-                    elif name == 'PhoneNumber':
-                        transaction.phone_number = value
-            
-            transaction.save()
-            
-            # If payment successful, handle subscription activation
-            if result_code == 0:
-                self._handle_successful_subscription_payment(transaction)
-            
-            return {
-                'status': 'success',
-                'message': 'Callback processed successfully',
-                'transaction_id': transaction.id,
-                'result_code': result_code
-            }
-            
         except Exception as e:
             return {
                 'status': 'error',
@@ -153,7 +153,6 @@ class CallbackService:
             conversation_id = result.get('ConversationID')
             originator_conversation_id = result.get('OriginatorConversationID')
             result_code = result.get('ResultCode', -1)
-            result_desc = result.get('ResultDesc', 'Unknown error')
             
             if not conversation_id:
                 return {
@@ -161,55 +160,44 @@ class CallbackService:
                     'message': 'Missing ConversationID in callback'
                 }
             
-            # Find the transaction
-            try:
-                transaction = MpesaB2CTransaction.objects.get(
-                    conversation_id=conversation_id
-                )
-            except MpesaB2CTransaction.DoesNotExist:
+            with db_transaction.atomic():
+                # Replays of an applied delivery stop here, before any transaction lookup
+                if not idempotency.claim(B2C_RESULT, conversation_id):
+                    return {
+                        'status': 'duplicate',
+                        'message': 'Callback already processed'
+                    }
+                
+                # Find and lock the transaction; a result and a timeout for it may race
+                try:
+                    transaction = MpesaB2CTransaction.objects.select_for_update().get(
+                        conversation_id=conversation_id
+                    )
+                except MpesaB2CTransaction.DoesNotExist:
+                    # A bulk payout row whose request timed out may have gone through after all
+                    transaction = settle_in_doubt(result)
+                    if transaction is None:
+                        db_transaction.set_rollback(True)
+                        return {
+                            'status': 'error',
+                            'message': 'B2C Transaction not found'
+                        }
+                
+                previous_status = mpesa_status(transaction.result_code)
+                
+                self._apply_b2c_result(transaction, result)
+                transaction.save(update_fields=B2C_RESULT_FIELDS)
+                rollups.transition(Provider.MPESA_B2C, transaction.created_at, previous_status,
+                                   mpesa_status(result_code), transaction.amount, transaction.user_id)
+                ledger.transition(LedgerProvider.MPESA_B2C, transaction, previous_status)
+                
                 return {
-                    'status': 'error',
-                    'message': 'B2C Transaction not found'
+                    'status': 'success',
+                    'message': 'B2C callback processed successfully',
+                    'transaction_id': transaction.id,
+                    'result_code': result_code
                 }
             
-            # Update transaction with result data
-            transaction.result_code = result_code
-            transaction.result_description = result_desc
-            
-            # If successful, extract additional details
-            if result_code == 0:
-                result_parameters = result.get('ResultParameters', {})
-                parameters = result_parameters.get('ResultParameter', [])
-                
-                for param in parameters:
-                    key = param.get('Key')
-                    value = param.get('Value')
-                    
-                    if key == 'TransactionReceipt':
-                        transaction.mpesa_receipt_number = value
-                    elif key == 'TransactionCompletedDateTime':
-                        transaction.transaction_completed_date = value
-                    elif key == 'B2CUtilityAccountAvailableFunds':
-                        transaction.b2c_utility_account_available_funds = value
-                    elif key == 'B2CWorkingAccountAvailableFunds':
-                        transaction.b2c_working_account_available_funds = value
-                    elif key == 'B2CChargesPaidAccountAvailableFunds':
-                        transaction.b2c_charges_paid_account_available_funds = value
-                    elif key == 'ReceiverPartyPublicName':
-                        transaction.receiver_party_public_name = value
-                    elif key == 'TransactionAmount':
-                        # This is often returned as confirmation
-                        pass
-            
-            transaction.save()
-            
-            return {
-                'status': 'success',
-                'message': 'B2C callback processed successfully',
-                'transaction_id': transaction.id,
-                'result_code': result_code
-            }
-            
         except Exception as e:
             return {
                 'status': 'error',
@@ -231,34 +219,226 @@ class CallbackService:
                     'message': 'Missing ConversationID in timeout callback'
                 }
             
-            # Find the transaction
-            try:
-                transaction = MpesaB2CTransaction.objects.get(
-                    conversation_id=conversation_id
-                )
-            except MpesaB2CTransaction.DoesNotExist:
+            with db_transaction.atomic():
+                # Replays of an applied delivery stop here, before any transaction lookup
+                if not idempotency.claim(B2C_TIMEOUT, conversation_id):
+                    return {
+                        'status': 'duplicate',
+                        'message': 'Callback already processed'
+                    }
+                
+                # Find and lock the transaction; a result and a timeout for it may race
+                try:
+                    transaction = MpesaB2CTransaction.objects.select_for_update().get(
+                        conversation_id=conversation_id
+                    )
+                except MpesaB2CTransaction.DoesNotExist:
+                    db_transaction.set_rollback(True)
+                    return {
+                        'status': 'error',
+                        'message': 'B2C Transaction not found'
+                    }
+                
+                # Mark as timed out
+                previous_status = mpesa_status(transaction.result_code)
+                transaction.result_code = -1
+                transaction.result_description = 'Request timeout'
+                transaction.save()
+                rollups.transition(Provider.MPESA_B2C, transaction.created_at, previous_status,
+                                   RollupStatus.FAILED, transaction.amount, transaction.user_id)
+                ledger.transition(LedgerProvider.MPESA_B2C, transaction, previous_status)
+                
                 return {
-                    'status': 'error',
-                    'message': 'B2C Transaction not found'
+                    'status': 'success',
+                    'message': 'B2C timeout processed successfully',
+                    'transaction_id': transaction.id
                 }
             
-            # Mark as timed out
-            transaction.result_code = -1
-            transaction.result_description = 'Request timeout'
-            transaction.save()
-            
-            return {
-                'status': 'success',
-                'message': 'B2C timeout processed successfully',
-                'transaction_id': transaction.id
-            }
-            
         except Exception as e:
             return {
                 'status': 'error',
                 'message': f'B2C timeout processing failed: {str(e)}'
             }
     
+    def _apply_stk_result(self, transaction, stkCallback):
+        """Copy an stkCallback onto its transaction (in memory)"""
+        result_code = stkCallback.get('ResultCode', -1)
+        
+        # Update transaction with callback data
+        transaction.result_code = result_code
+        transaction.result_desc = stkCallback.get('ResultDesc', 'Unknown error')
+        
+        # If successful, extract additional details
+        if result_code == 0:
+            callback_metadata = stkCallback.get('CallbackMetadata', {})
+            items = callback_metadata.get('Item', [])
+            
+            for item in items:
+                name = item.get('Name')
+                value = item.get('Value')
+                
+                if name == 'Amount':
+                    transaction.amount = value
+                elif name == 'MpesaReceiptNumber':
+                    transaction.mpesa_receipt_number = value
+                elif name == 'TransactionDate':
+                    transaction.transaction_date = value
+                elif name == 'PhoneNumber':
+                    transaction.phone_number = value
+    
+    def _apply_b2c_result(self, transaction, result):
+        """Copy a B2C Result onto its transaction (in memory)"""
+        result_code = result.get('ResultCode', -1)
+        
+        # Update transaction with result data
+        transaction.result_code = result_code
+        transaction.result_description = result.get('ResultDesc', 'Unknown error')
+        
+        # If successful, extract additional details
+        if result_code == 0:
+            result_parameters = result.get('ResultParameters', {})
+            parameters = result_parameters.get('ResultParameter', [])
+            
+            for param in parameters:
+                key = param.get('Key')
+                value = param.get('Value')
+                
+                if key == 'TransactionReceipt':
+                    transaction.mpesa_receipt_number = value
+                elif key == 'TransactionCompletedDateTime':
+                    transaction.transaction_completed_date = value
+                elif key == 'B2CUtilityAccountAvailableFunds':
+                    transaction.b2c_utility_account_available_funds = value
+                elif key == 'B2CWorkingAccountAvailableFunds':
+                    transaction.b2c_working_account_available_funds = value
+                elif key == 'B2CChargesPaidAccountAvailableFunds':
+                    transaction.b2c_charges_paid_account_available_funds = value
+                elif key == 'ReceiverPartyPublicName':
+                    transaction.receiver_party_public_name = value
+                elif key == 'TransactionAmount':
+                    # This is often returned as confirmation
+                    pass
+    
+    def apply_stk_callbacks(self, payloads):
+        """
+        Batch form of handle_stk_callback for the callback inbox
+        
+        One query finds replays, one loads every target row, one inserts the
+        idempotency claims and one bulk_update writes the results, however
+        many callbacks are in the batch. Returns one result dict per payload.
+        """
+        callbacks = [(p or {}).get('Body', {}).get('stkCallback', {}) for p in payloads]
+        
+        def key(cb):
+            if cb.get('MerchantRequestID') and cb.get('CheckoutRequestID'):
+                return cb['CheckoutRequestID']
+        
+        rows = lambda ids: MpesaTransaction.objects.select_for_update().filter(checkout_request_id__in=ids).in_bulk(
+            field_name='checkout_request_id')
+        
+        def apply(transaction, cb):
+            if transaction.merchant_request_id != cb['MerchantRequestID']:
+                return None
+            previous = (mpesa_status(transaction.result_code), transaction.amount)
+            self._apply_stk_result(transaction, cb)
+            return previous
+        
+        results, applied = self._apply_batch(STK_CALLBACK, callbacks, key, rows, apply, STK_RESULT_FIELDS,
+                                             'Transaction not found')
+        rollups.transitions(Provider.MPESA_STK, (
+            (t.created_at, t.user_id, previous_status, mpesa_status(t.result_code), t.amount, previous_amount)
+            for t, (previous_status, previous_amount) in applied
+        ))
+        ledger.transitions(LedgerProvider.MPESA_STK, ((t, previous_status) for t, (previous_status, _) in applied))
+        for transaction, _ in applied:
+            if transaction.result_code == 0:
+                self._handle_successful_subscription_payment(transaction)
+        return results
+    
+    def apply_b2c_results(self, payloads):
+        """Batch form of handle_b2c_result for the callback inbox (see apply_stk_callbacks)"""
+        callbacks = [(p or {}).get('Result', {}) for p in payloads]
+        
+        by_id = {cb.get('ConversationID'): cb for cb in callbacks}
+        
+        def rows(ids):
+            found = MpesaB2CTransaction.objects.select_for_update().filter(conversation_id__in=ids).in_bulk(
+                field_name='conversation_id')
+            for conversation_id in ids:
+                if conversation_id not in found:
+                    # See handle_b2c_result: a result may settle an in-doubt bulk payout row
+                    transaction = settle_in_doubt(by_id[conversation_id])
+                    if transaction is not None:
+                        found[conversation_id] = transaction
+            return found
+        
+        def apply(transaction, result):
+            previous = (mpesa_status(transaction.result_code), None)
+            self._apply_b2c_result(transaction, result)
+            return previous
+        
+        results, applied = self._apply_batch(B2C_RESULT, callbacks, lambda r: r.get('ConversationID'), rows,
+                                             apply, B2C_RESULT_FIELDS, 'B2C Transaction not found')
+        rollups.transitions(Provider.MPESA_B2C, (
+            (t.created_at, t.user_id, previous_status, mpesa_status(t.result_code), t.amount, None)
+            for t, (previous_status, _) in applied
+        ))
+        ledger.transitions(LedgerProvider.MPESA_B2C, ((t, previous_status) for t, (previous_status, _) in applied))
+        return results
+    
+    def _apply_batch(self, scope, callbacks, key, rows, apply, fields, missing):
+        """
+        Shared batch pipeline: drop replays, load targets, claim, mutate, bulk_update
+        
+        Returns (result per callback, [(transaction, apply() return value)]).
+        """
+        with db_transaction.atomic():  # holds the row locks taken by rows() until the bulk_update
+            return self._apply_batch_locked(scope, callbacks, key, rows, apply, fields, missing)
+    
+    def _apply_batch_locked(self, scope, callbacks, key, rows, apply, fields, missing):
+        results = [None] * len(callbacks)
+        keys = [key(cb) for cb in callbacks]
+        fresh = idempotency.unseen(scope, keys)
+        
+        first = {}
+        for index, k in enumerate(keys):
+            if not k:
+                results[index] = {'status': 'error', 'message': 'Missing required callback data'}
+            elif k not in fresh or k in first:
+                results[index] = {'status': 'duplicate', 'message': 'Callback already processed'}
+            else:
+                first[k] = index
+        
+        targets = rows(list(first)) if first else {}
+        changed = []
+        for k, index in first.items():
+            transaction = targets.get(k)
+            previous = apply(transaction, callbacks[index]) if transaction else None
+            if previous is None:
+                results[index] = {'status': 'error', 'message': missing}
+                continue
+            changed.append((index, transaction, previous))
+        
+        claimed = idempotency.claim_many(scope, [keys[index] for index, _, _ in changed])
+        applied = []
+        for index, transaction, previous in changed:
+            if keys[index] not in claimed:
+                # A concurrent delivery won the claim; leave its row alone
+                results[index] = {'status': 'duplicate', 'message': 'Callback already processed'}
+                continue
+            transaction.updated_at = timezone.now()
+            applied.append((transaction, previous))
+            results[index] = {
+                'status': 'success',
+                'message': 'Callback processed successfully',
+                'transaction_id': transaction.id,
+                'result_code': transaction.result_code
+            }
+        
+        if applied:
+            type(applied[0][0]).objects.bulk_update([t for t, _ in applied], fields)
+        return results, applied
+    
     def get_transaction_status(self, checkout_request_id=None, conversation_id=None):
         """
         Get transaction status by either checkout_request_id (STK) or conversation_id (B2C)
@@ -344,64 +524,10 @@ class CallbackService:
         """Handle successful subscription payment and award referral points"""
         try:
             # Check if this is a subscription payment
-            if not transaction.account_reference or 'Sub_' not in transaction.account_reference:
-                return
-            
-            # Extract subscription ID from account_reference
-            # Format: "Skyfield_{plan}_Sub_{subscription_id}"
-            parts = transaction.account_reference.split('_')
-            if len(parts) >= 3 and parts[-2] == 'Sub':
-                subscription_id = parts[-1]
+            subscription_id = subscription_id_from_reference(transaction.account_reference)
+            if subscription_id:
+                SubscriptionActivationService().activate(subscription_id, transaction.mpesa_receipt_number)
                 
-                # Import here to avoid circular imports
-                from coreapis.models import Subscription, Referral
-                from django.utils import timezone
-                
-                try:
-                    subscription = Subscription.objects.get(id=subscription_id)
-                    
-                    # Activate subscription
-                    subscription.status = 'active'
-                    subscription.is_active = True
-                    subscription.mpesa_receipt_number = transaction.mpesa_receipt_number
-                    subscription.payment_date = timezone.now()
-                    subscription.save()
-                    
-                    # Process referral points
-                    user = subscription.user
-                    try:
-                        # Check if this user was referred and hasn't been awarded points yet
-                        referral = Referral.objects.get(
-                            referred=user,
-                            is_subscription_complete=False
-                        )
-                        
-                        # Award points to both referrer and referred user
-                        referrer = referral.referrer
-                        
-                        # Award 1 point to referrer
-                        referrer.points += 1
-                        referrer.save()
-                        
-                        # Award 1 point to referred user
-                        user.points += 1
-                        user.save()
-                        
-                        # Update referral record
-                        referral.is_subscription_complete = True
-                        referral.points_awarded_to_referrer = 1
-                        referral.points_awarded_to_referred = 1
-                        referral.subscription_date = timezone.now()
-                        referral.note = f"Points awarded - referrer and referred each earned 1 point"
-                        referral.save()
-                        
-                    except Referral.DoesNotExist:
-                        # User wasn't referred or already got points
-                        pass
-                        
-                except Subscription.DoesNotExist:
-                    pass
-                    
         except Exception as e:
             # Log error but don't fail the callback
-            pass
\ No newline at end of file
+            pass
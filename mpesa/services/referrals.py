@@ -0,0 +1,128 @@
+"""
+M-Pesa Subscription Activation
+Activates paid subscriptions and awards referral points without lost updates
+"""
+from collections import Counter
+
+from decouple import config
+from django.db import connection, transaction
+from django.db.models import Case, F, Subquery, Value, When
+from django.utils import timezone
+
+from ..models import PendingPointAward
+
+REFERRAL_POINTS = 1  # awarded to both the referrer and the referred user
+INLINE = 'inline'
+DEFERRED = 'deferred'
+
+
+def subscription_id_from_reference(account_reference):
+    """Subscription id from an account reference of the form "Skyfield_{plan}_Sub_{subscription_id}"."""
+    if not account_reference or 'Sub_' not in account_reference:
+        return None
+    parts = account_reference.split('_')
+    if len(parts) >= 3 and parts[-2] == 'Sub':
+        return parts[-1]
+    return None
+
+
+class SubscriptionActivationService:
+    """
+    One transaction per successful subscription payment:
+
+    1. UPDATE the subscription to active
+    2. SELECT ... FOR UPDATE the referred user's open referral (the user id is
+       a subquery on the subscription, not a separate read)
+    3. award points with UPDATE ... SET points = points + 1 for both users in
+       one statement, or queue them as PendingPointAward rows in deferred mode
+    4. UPDATE the referral as complete
+
+    The referral row lock plus the is_subscription_complete filter mean two
+    concurrent payments cannot both award, and F() means no award is lost.
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode or config('REFERRAL_POINTS_MODE', default=INLINE)
+
+    def activate(self, subscription_id, receipt_number):
+        # Subscriptions and referrals live in the main API project
+        from coreapis.models import Subscription, Referral
+
+        now = timezone.now()
+        with transaction.atomic():
+            activated = Subscription.objects.filter(id=subscription_id).update(
+                status='active',
+                is_active=True,
+                mpesa_receipt_number=receipt_number,
+                payment_date=now,
+            )
+            if not activated:
+                return False
+
+            referral = (
+                Referral.objects
+                .select_for_update()
+                .filter(
+                    referred_id=Subquery(Subscription.objects.filter(id=subscription_id).values('user_id')[:1]),
+                    is_subscription_complete=False,
+                )
+                .values('id', 'referrer_id', 'referred_id')
+                .first()
+            )
+            if referral is None:
+                # User wasn't referred or already got points
+                return True
+
+            user_ids = [referral['referrer_id'], referral['referred_id']]
+            if self.mode == DEFERRED:
+                PendingPointAward.objects.bulk_create([
+                    PendingPointAward(user_id=user_id, points=REFERRAL_POINTS, referral_id=referral['id'])
+                    for user_id in user_ids
+                ])
+            else:
+                user_model(Referral).objects.filter(pk__in=user_ids).update(points=F('points') + REFERRAL_POINTS)
+
+            Referral.objects.filter(pk=referral['id']).update(
+                is_subscription_complete=True,
+                points_awarded_to_referrer=REFERRAL_POINTS,
+                points_awarded_to_referred=REFERRAL_POINTS,
+                subscription_date=now,
+                note=f"Points awarded - referrer and referred each earned {REFERRAL_POINTS} point",
+            )
+        return True
+
+
+def user_model(referral_model):
+    """The model holding `points`: whatever Referral.referrer points at."""
+    return referral_model._meta.get_field('referrer').related_model
+
+
+def apply_pending_awards(batch_size=1000):
+    """
+    Apply queued point awards; returns the number of awards applied
+
+    Awards are summed per user and written with a single
+    UPDATE ... SET points = points + CASE id WHEN ... END, so a popular
+    referrer with many awards in the batch costs one row write.
+    """
+    from coreapis.models import Referral
+
+    with transaction.atomic():
+        pending = PendingPointAward.objects.filter(applied_at__isnull=True)
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        awards = list(pending.order_by('id').values_list('id', 'user_id', 'points')[:batch_size])
+        if not awards:
+            return 0
+
+        totals = Counter()
+        for _, user_id, points in awards:
+            totals[user_id] += points
+        user_model(Referral).objects.filter(pk__in=list(totals)).update(
+            points=F('points') + Case(*[When(pk=user_id, then=Value(points)) for user_id, points in totals.items()],
+                                      default=Value(0))
+        )
+        PendingPointAward.objects.filter(pk__in=[award_id for award_id, _, _ in awards]).update(
+            applied_at=timezone.now()
+        )
+    return len(awards)
@@ -0,0 +1,147 @@
+"""
+M-Pesa Transaction Search
+Classifies the query, then runs one index-backed lookup per table
+"""
+import heapq
+import re
+from itertools import islice
+
+from django.db.models import Q
+
+from ..models import MpesaTransaction, MpesaB2CTransaction
+
+RECEIPT = 'receipt'
+PHONE_PREFIX = 'phone_prefix'
+PHONE_SUFFIX = 'phone_suffix'
+TEXT = 'text'
+
+# M-Pesa receipts are 10 upper-case letters and digits, e.g. NLJ7RT61SV
+RECEIPT_PATTERN = re.compile(r'^(?=.*[A-Z])(?=.*\d)[A-Z0-9]{10}$')
+PHONE_PATTERN = re.compile(r'^\+?\d[\d\s-]{3,}$')
+# Trigram indexes need at least 3 characters to narrow anything down
+MIN_TEXT_LENGTH = 3
+
+# Digit strings sort before ':', so [term, term + ':') is every string starting with term
+_RANGE_END = ':'
+
+
+def classify(query):
+    """
+    Work out what a search query is
+
+    Returns (kind, term) where term is normalized for that lookup:
+    - RECEIPT: upper-cased receipt number, matched exactly
+    - PHONE_PREFIX: 254-prefixed digits ("0712..." and "+254712..." both become "254712...")
+    - PHONE_SUFFIX: reversed digits, for a local fragment like "5678" or "712345678"
+    - TEXT: anything else, matched as a substring of references/remarks
+    """
+    query = (query or '').strip()
+    if RECEIPT_PATTERN.match(query.upper()):
+        return RECEIPT, query.upper()
+    if PHONE_PATTERN.match(query):
+        digits = re.sub(r'\D', '', query)
+        if digits.startswith('254'):
+            return PHONE_PREFIX, digits
+        if digits.startswith('0'):
+            return PHONE_PREFIX, '254' + digits[1:]
+        return PHONE_SUFFIX, digits[::-1]
+    return TEXT, query
+
+
+class TransactionSearchService:
+
+    STK_FIELDS = ('id', 'result_code', 'amount', 'phone_number', 'mpesa_receipt_number', 'account_reference',
+                  'created_at')
+    B2C_FIELDS = ('id', 'result_code', 'amount', 'phone_number', 'mpesa_receipt_number', 'reference', 'remarks',
+                  'created_at')
+
+    def search(self, query, user_id=None, limit=50):
+        """
+        Search STK and B2C transactions, newest first
+
+        Each query kind hits an index: receipt numbers an equality lookup,
+        phone numbers a range scan on phone_number (prefix) or phone_reversed
+        (suffix), and text the trigram indexes on Postgres (a LIKE scan on
+        other databases). Text shorter than MIN_TEXT_LENGTH matches nothing.
+        A query of bare digits is looked up both as a phone number and as
+        text, so numeric references and remarks stay searchable.
+
+        Args:
+            query: Search query
+            user_id: User ID to filter by (optional)
+            limit: Maximum results
+        """
+        kind, term = classify(query)
+        if not term or (kind == TEXT and len(term) < MIN_TEXT_LENGTH):
+            return []
+
+        stk_filter, b2c_filter = self._stk_filter(kind, term), self._b2c_filter(kind, term)
+        digits = (query or '').strip()
+        if kind != TEXT and digits.isdigit() and len(digits) >= MIN_TEXT_LENGTH:
+            # Bare digits may be a phone fragment or a numeric reference ("2024"): match both
+            stk_filter |= self._stk_filter(TEXT, digits)
+            b2c_filter |= self._b2c_filter(TEXT, digits)
+
+        stk = self._rows(MpesaTransaction, stk_filter, self.STK_FIELDS, user_id, limit)
+        b2c = self._rows(MpesaB2CTransaction, b2c_filter, self.B2C_FIELDS, user_id, limit)
+        merged = heapq.merge(
+            ((row['created_at'], self._stk_result, row) for row in stk),
+            ((row['created_at'], self._b2c_result, row) for row in b2c),
+            key=lambda item: item[0],
+            reverse=True,
+        )
+        return [shape(row) for _, shape, row in islice(merged, limit)]
+
+    def _rows(self, model, condition, fields, user_id, limit):
+        queryset = model.objects.filter(condition)
+        if user_id:
+            queryset = queryset.filter(user_id=user_id)
+        return queryset.order_by('-created_at', '-id').values(*fields)[:limit]
+
+    def _phone_filter(self, kind, term):
+        column = 'phone_number' if kind == PHONE_PREFIX else 'phone_reversed'
+        return Q(**{f'{column}__gte': term, f'{column}__lt': term + _RANGE_END})
+
+    def _stk_filter(self, kind, term):
+        if kind == RECEIPT:
+            return Q(mpesa_receipt_number=term)
+        if kind == TEXT:
+            return Q(account_reference__icontains=term)
+        return self._phone_filter(kind, term)
+
+    def _b2c_filter(self, kind, term):
+        if kind == RECEIPT:
+            return Q(mpesa_receipt_number=term)
+        if kind == TEXT:
+            return Q(reference__icontains=term) | Q(remarks__icontains=term)
+        return self._phone_filter(kind, term)
+
+    def _status(self, result_code):
+        if result_code is None:
+            return "pending"
+        return "success" if result_code == 0 else "failed"
+
+    def _stk_result(self, row):
+        return {
+            'id': row['id'],
+            'type': 'stk_push',
+            'status': self._status(row['result_code']),
+            'amount': float(row['amount']) if row['amount'] else None,
+            'phone_number': row['phone_number'],
+            'mpesa_receipt_number': row['mpesa_receipt_number'],
+            'account_reference': row['account_reference'],
+            'created_at': row['created_at'].isoformat()
+        }
+
+    def _b2c_result(self, row):
+        return {
+            'id': row['id'],
+            'type': 'b2c_transfer',
+            'status': self._status(row['result_code']),
+            'amount': float(row['amount']),
+            'phone_number': row['phone_number'],
+            'mpesa_receipt_number': row['mpesa_receipt_number'],
+            'reference': row['reference'],
+            'remarks': row['remarks'],
+            'created_at': row['created_at'].isoformat()
+        }
@@ -3,13 +3,20 @@ M-Pesa STK Push Service
 Handles customer payment requests (C2B)
 """
 import requests
+import httpx
 import datetime
 import base64
 import json
-from requests.auth import HTTPBasicAuth
+from asgiref.sync import sync_to_async
 from decouple import config
+from core.aio_transport import get_async_client
+from core.transport import get_session
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from .auth import get_token_manager
 from ..models import MpesaTransaction
-from django.conf import settings
+
+STK_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
 
 
 class STKPushService:
@@ -24,24 +31,16 @@ class STKPushService:
             raise ValueError('CALLBACK_URL must be set in environment variables')
 
     def _base_host(self) -> str:
-        """Return Safaricom API host based on DEBUG flag."""
-        return 'https://api.safaricom.co.ke' if getattr(settings, 'DEBUG', False) else 'https://api.safaricom.co.ke'
+        """Return Safaricom API host (DARAJA_BASE_URL overrides it, e.g. for the local simulator)."""
+        return config('DARAJA_BASE_URL', default='https://api.safaricom.co.ke')
         
+    def _token_manager(self):
+        """Shared OAuth token manager for this host and credentials"""
+        return get_token_manager(self.consumer_key, self.consumer_secret, self._base_host())
+
     def get_access_token(self):
-        """Get access token from Safaricom API"""
-        api_url = f"{self._base_host()}/oauth/v1/generate?grant_type=client_credentials"
-        
-        try:
-            response = requests.get(
-                api_url,
-                auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
-                timeout=15
-            )
-            response.raise_for_status()
-            token_data = response.json()
-            return f"Bearer {token_data['access_token']}"
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Failed to get access token: {str(e)}")
+        """Get access token from Safaricom API (cached across requests and workers)"""
+        return self._token_manager().get_token()
             
     def generate_password(self):
         """Generate password for STK Push"""
@@ -66,19 +65,10 @@ class STKPushService:
         except (ValueError, TypeError):
             raise ValueError("Invalid amount. Must be a positive number")
             
-    def initiate_payment(self, phone, amount, account_reference="Skyfield", transaction_desc="Payment", 
-                         payment_type="product", product_id=None, subscription_plan_id=None, user_id=None):
-        """Initiate STK Push payment request"""
-        
-        # Validate inputs
-        phone = self.validate_phone_number(phone)
-        amount = self.validate_amount(amount)
-        
-        # Get access token and password
-        access_token = self.get_access_token()
+    def _build_request(self, access_token, phone, amount, account_reference, transaction_desc):
+        """Build STK Push payload and headers"""
         password, timestamp = self.generate_password()
         
-        # Prepare payload
         payload = {
             "BusinessShortCode": self.business_shortcode,
             "Password": password,
@@ -97,38 +87,134 @@ class STKPushService:
             "Authorization": access_token,
             "Content-Type": "application/json"
         }
+        return payload, headers
+    
+    def _transaction_fields(self, response_data, phone, amount, account_reference, transaction_desc,
+                            payment_type, product_id, subscription_plan_id, user_id):
+        """Fields for the pending MpesaTransaction row"""
+        return dict(
+            merchant_request_id=response_data.get('MerchantRequestID', ''),
+            checkout_request_id=response_data.get('CheckoutRequestID', ''),
+            result_code=None,  # Pending until callback updates
+            result_desc='Payment request initiated',
+            amount=amount,
+            phone_number=phone,
+            payment_type=payment_type,
+            product_id=product_id,
+            subscription_plan_id=subscription_plan_id,
+            account_reference=account_reference,
+            transaction_desc=transaction_desc,
+            user_id=user_id
+        )
+            
+    def initiate_payment(self, phone, amount, account_reference="Skyfield", transaction_desc="Payment", 
+                         payment_type="product", product_id=None, subscription_plan_id=None, user_id=None):
+        """Initiate STK Push payment request"""
+        
+        # Validate inputs
+        phone = self.validate_phone_number(phone)
+        amount = self.validate_amount(amount)
+        
+        # Get access token and prepare request
+        access_token = self.get_access_token()
+        payload, headers = self._build_request(access_token, phone, amount, account_reference, transaction_desc)
         
         try:
             # Make API request
-            response = requests.post(
+            response = get_session(self._base_host()).post(
                 f"{self._base_host()}/mpesa/stkpush/v1/processrequest",
                 json=payload,
                 headers=headers,
                 timeout=20
             )
+            if response.status_code == 401:
+                # Token revoked or rotated upstream; force a fresh one next time
+                self._token_manager().invalidate()
             response.raise_for_status()
             response_data = response.json()
             
             # Store transaction in database if successful
             if response_data.get('ResponseCode') == '0':
-                MpesaTransaction.objects.create(
-                    merchant_request_id=response_data.get('MerchantRequestID', ''),
-                    checkout_request_id=response_data.get('CheckoutRequestID', ''),
-                    result_code=None,  # Pending until callback updates
-                    result_desc='Payment request initiated',
-                    amount=amount,
-                    phone_number=phone,
-                    payment_type=payment_type,
-                    product_id=product_id,
-                    subscription_plan_id=subscription_plan_id,
-                    account_reference=account_reference,
-                    transaction_desc=transaction_desc,
-                    user_id=user_id
-                )
+                transaction = MpesaTransaction.objects.create(**self._transaction_fields(
+                    response_data, phone, amount, account_reference, transaction_desc,
+                    payment_type, product_id, subscription_plan_id, user_id
+                ))
+                rollups.record(Provider.MPESA_STK, transaction.created_at, RollupStatus.PENDING,
+                               transaction.amount, transaction.user_id)
+                ledger.record(LedgerProvider.MPESA_STK, transaction)
             
             return response_data
             
         except requests.exceptions.RequestException as e:
             raise Exception(f"STK Push request failed: {str(e)}")
         except Exception as e:
-            raise Exception(f"Failed to initiate STK Push: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Failed to initiate STK Push: {str(e)}")
+
+    def query_status(self, checkout_request_id):
+        """Ask Daraja for the result of an STK push (the STK push query API)
+        
+        Returns Daraja's JSON either way: ResultCode/ResultDesc once the
+        payment has a result, or errorCode 500.001.1001 while it is still
+        being processed. Raises if there is no JSON answer.
+        """
+        password, timestamp = self.generate_password()
+        payload = {
+            "BusinessShortCode": self.business_shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+        headers = {
+            "Authorization": self.get_access_token(),
+            "Content-Type": "application/json"
+        }
+        host = self._base_host()
+        response = get_session(host).post(f"{host}{STK_QUERY_PATH}", json=payload, headers=headers, timeout=20)
+        if response.status_code == 401:
+            self._token_manager().invalidate()
+            response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise
+
+    async def ainitiate_payment(self, phone, amount, account_reference="Skyfield", transaction_desc="Payment",
+                                payment_type="product", product_id=None, subscription_plan_id=None, user_id=None):
+        """Async variant of initiate_payment for the ASGI request path"""
+        
+        # Validate inputs
+        phone = self.validate_phone_number(phone)
+        amount = self.validate_amount(amount)
+        
+        # Token is usually cached; a refresh runs off the event loop
+        access_token = await sync_to_async(self.get_access_token, thread_sensitive=False)()
+        payload, headers = self._build_request(access_token, phone, amount, account_reference, transaction_desc)
+        
+        try:
+            response = await get_async_client(self._base_host()).post(
+                f"{self._base_host()}/mpesa/stkpush/v1/processrequest",
+                json=payload,
+                headers=headers,
+                timeout=20
+            )
+            if response.status_code == 401:
+                await sync_to_async(self._token_manager().invalidate, thread_sensitive=False)()
+            response.raise_for_status()
+            response_data = response.json()
+            
+            if response_data.get('ResponseCode') == '0':
+                transaction = await MpesaTransaction.objects.acreate(**self._transaction_fields(
+                    response_data, phone, amount, account_reference, transaction_desc,
+                    payment_type, product_id, subscription_plan_id, user_id
+                ))
+                await sync_to_async(rollups.record)(Provider.MPESA_STK, transaction.created_at,
+                                                    RollupStatus.PENDING, transaction.amount, transaction.user_id)
+                await sync_to_async(ledger.record)(LedgerProvider.MPESA_STK, transaction)
+            
+            return response_data
+            
+        except httpx.HTTPError as e:
+            raise Exception(f"STK Push request failed: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Failed to initiate STK Push: {str(e)}")
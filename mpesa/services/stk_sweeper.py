@@ -0,0 +1,140 @@
+"""
+M-Pesa STK Pending Sweeper
+Finalizes STK pushes whose callback never arrived, using the STK push query API
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from decouple import config
+from django.db import close_old_connections, transaction as db_transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.ratelimit import RateLimiter
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from reporting.rollups import mpesa_status
+from .callback import CallbackService
+from .stk_push import STKPushService
+from ..models import MpesaTransaction
+
+logger = logging.getLogger(__name__)
+
+STILL_PROCESSING = '500.001.1001'  # Daraja errorCode: "The transaction is being processed"
+EXPIRED_RESULT_CODE = -1  # same code handle_b2c_timeout uses for a transfer that never completed
+
+
+class STKPendingSweeper:
+    """Resolves STK pushes left pending (result_code NULL) by a lost callback.
+
+    Each pass takes the next batch of pending rows older than `older_than`
+    (the (result_code, created_at) index), queries Daraja for every row on
+    a rate-limited thread pool, and finalizes the answered ones with one
+    bulk_update. Rows Daraja still reports as processing after
+    `expire_after` are closed as expired so clients stop polling. Passes
+    walk the backlog with a (created_at, id) cursor, so rows that stay
+    pending cannot starve newer ones.
+
+    A callback that arrives after the sweep still applies: it fills in the
+    receipt details and moves the rollups only if its result differs.
+    """
+
+    UPDATE_FIELDS = ['result_code', 'result_desc', 'updated_at']
+
+    def __init__(self, batch_size=100, workers=None, rate=None, older_than=timedelta(minutes=2),
+                 expire_after=timedelta(hours=24), service=None):
+        self.batch_size = batch_size
+        self.workers = workers or config('MPESA_STK_SWEEP_WORKERS', default=4, cast=int)
+        self.rate = rate if rate is not None else config('MPESA_STK_SWEEP_RATE', default=5, cast=float)
+        self.older_than = older_than
+        self.expire_after = expire_after
+        self.service = service
+        self.limiter = RateLimiter(self.rate)
+        self._cursor = None  # (created_at, id) of the last row of the previous batch
+
+    def due(self):
+        rows = MpesaTransaction.objects.filter(result_code__isnull=True,
+                                               created_at__lt=timezone.now() - self.older_than)
+        if self._cursor:
+            created_at, pk = self._cursor
+            rows = rows.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        return list(rows.order_by('created_at', 'id')[:self.batch_size])
+
+    def _query(self, txn):
+        self.limiter.acquire()
+        try:
+            return self.service.query_status(txn.checkout_request_id)
+        except Exception as e:
+            return {'error': str(e)}
+
+    def run_once(self):
+        """Process one batch; returns the number of rows queried."""
+        transactions = self.due()
+        # Start over from the oldest row once the end of the backlog is reached
+        self._cursor = ((transactions[-1].created_at, transactions[-1].id)
+                        if len(transactions) == self.batch_size else None)
+        if not transactions:
+            return 0
+
+        self.service = self.service or STKPushService()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._query, transactions))
+
+        expire_before = timezone.now() - self.expire_after
+        results_by_pk = {}
+        for txn, result in zip(transactions, results):
+            if str(result.get('ResultCode', '')).lstrip('-').isdigit():
+                results_by_pk[txn.pk] = (int(result['ResultCode']), result.get('ResultDesc') or '')
+            elif result.get('errorCode') == STILL_PROCESSING:
+                if txn.created_at < expire_before:
+                    results_by_pk[txn.pk] = (EXPIRED_RESULT_CODE, 'Expired: no result from M-Pesa')
+            else:
+                logger.warning(f"STK query failed for {txn.checkout_request_id}: "
+                               f"{result.get('error') or result.get('errorMessage') or result}")
+        self.finalize(transactions, results_by_pk)
+        return len(transactions)
+
+    def finalize(self, transactions, results_by_pk):
+        """Write {pk: (result_code, result_desc)} to the rows that are still pending, in bulk."""
+        if not results_by_pk:
+            return 0
+        now = timezone.now()
+        with db_transaction.atomic():
+            # Rows a callback finalized while Daraja was being queried are left as it wrote them.
+            # Callbacks lock the row too, so one arriving now waits and transitions from the swept status.
+            pending = set(
+                MpesaTransaction.objects.select_for_update()
+                .filter(pk__in=list(results_by_pk), result_code__isnull=True)
+                .values_list('pk', flat=True)
+            )
+            finalized = [txn for txn in transactions if txn.pk in pending]
+            for txn in finalized:
+                txn.result_code, txn.result_desc = results_by_pk[txn.pk]
+                txn.updated_at = now
+            MpesaTransaction.objects.bulk_update(finalized, self.UPDATE_FIELDS)
+            rollups.transitions(Provider.MPESA_STK, (
+                (t.created_at, t.user_id, RollupStatus.PENDING, mpesa_status(t.result_code), t.amount, None)
+                for t in finalized
+            ))
+            ledger.transitions(LedgerProvider.MPESA_STK, ((t, RollupStatus.PENDING) for t in finalized))
+
+        callbacks = CallbackService()
+        for txn in finalized:
+            if txn.result_code == 0:
+                callbacks._handle_successful_subscription_payment(txn)
+        return len(finalized)
+
+    def run_forever(self, interval=30, stop_event=None):
+        """Daemon loop: sweep batches back to back, then sleep once the backlog is drained."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.error(f"Error sweeping pending STK pushes: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                stop_event.wait(interval)
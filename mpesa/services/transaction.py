@@ -2,122 +2,222 @@
 M-Pesa Transaction Service
 Unified transaction management and queries
 """
+import base64
+import heapq
+import json
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
 from django.db.models import Q
+from reporting.models import ALL_USERS, DailyRollup, Provider, RollupStatus
 from ..models import MpesaTransaction, MpesaB2CTransaction
+from .search import TransactionSearchService
+
+MAX_PAGE_SIZE = 200
+
+# Tie-break between feeds when two rows share a created_at
+FEED_RANK = {'b2c_transfer': 0, 'stk_push': 1}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, rank, row_id):
+    """Opaque cursor for the position after a row of the merged feed"""
+    raw = json.dumps([created_at.isoformat(), rank, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, rank, row_id = json.loads(raw)
+        created_at = datetime.fromisoformat(created_at)
+        if created_at.tzinfo is None or rank not in FEED_RANK.values() or not isinstance(row_id, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    return created_at, rank, row_id
 
 
 class TransactionService:
     
     def get_user_transactions(self, user_id, transaction_type=None, limit=50):
         """
-        Get transactions for a specific user
+        Get the most recent transactions for a specific user
+        
+        First page of get_user_transactions_page; kept for existing callers.
+        """
+        return self.get_user_transactions_page(user_id, transaction_type, limit)['transactions']
+    
+    def get_user_transactions_page(self, user_id, transaction_type=None, limit=50, cursor=None):
+        """
+        Get one page of a user's STK and B2C history, newest first
+        
+        Each table is read with a keyset filter on (created_at, id) and at most
+        limit + 1 rows, and the two ordered streams are merged, so any page costs
+        the same however deep into the history it is.
         
         Args:
             user_id: User ID
             transaction_type: 'stk_push', 'b2c_transfer', or None for all
-            limit: Maximum number of transactions to return
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page, or None for the first page
+        
+        Raises:
+            InvalidCursor: if cursor was not produced by this method
         """
-        transactions = []
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        position = decode_cursor(cursor) if cursor else None
         
-        if transaction_type is None or transaction_type == 'stk_push':
-            # Get STK Push transactions
-            stk_filter = Q()
-            if user_id:
-                stk_filter &= Q(user_id=user_id)
-            
-            stk_transactions = MpesaTransaction.objects.filter(stk_filter).order_by('-created_at')[:limit]
-            
-            for txn in stk_transactions:
-                transactions.append({
-                    'id': txn.id,
-                    'type': 'stk_push',
-                    'status': self._get_stk_status(txn),
-                    'amount': float(txn.amount) if txn.amount else None,
-                    'phone_number': txn.phone_number,
-                    'payment_type': txn.payment_type,
-                    'product_id': txn.product_id,
-                    'mpesa_receipt_number': txn.mpesa_receipt_number,
-                    'transaction_date': txn.transaction_date,
-                    'result_desc': txn.result_desc,
-                    'created_at': txn.created_at.isoformat(),
-                    'updated_at': txn.updated_at.isoformat()
-                })
-        
-        if transaction_type is None or transaction_type == 'b2c_transfer':
-            # Get B2C transactions
-            b2c_transactions = MpesaB2CTransaction.objects.filter(
-                user_id=user_id
-            ).order_by('-created_at')[:limit]
-            
-            for txn in b2c_transactions:
-                transactions.append({
-                    'id': txn.id,
-                    'type': 'b2c_transfer',
-                    'status': self._get_b2c_status(txn),
-                    'amount': float(txn.amount) if txn.amount is not None else None,
-                    'phone_number': txn.phone_number,
-                    'mpesa_receipt_number': txn.mpesa_receipt_number,
-                    'reference': getattr(txn, 'reference', None),
-                    'remarks': getattr(txn, 'remarks', None),
-                    'result_description': getattr(txn, 'result_description', None),
-                    'created_at': txn.created_at.isoformat(),
-                    'updated_at': txn.updated_at.isoformat()
-                })
+        streams = []
+        for kind, (model, fields, shape) in self._FEEDS.items():
+            if transaction_type not in (None, kind):
+                continue
+            queryset = model.objects.all()
+            if user_id or kind == 'b2c_transfer':
+                queryset = queryset.filter(user_id=user_id)
+            if position:
+                queryset = queryset.filter(self._after(kind, position))
+            rows = queryset.order_by('-created_at', '-id').values(*fields)[:limit + 1]
+            streams.append(self._stream(kind, shape, rows))
         
-        # Sort by created_at descending
-        transactions.sort(key=lambda x: x['created_at'], reverse=True)
+        page = list(islice(heapq.merge(*streams, key=lambda item: item[:3], reverse=True), limit + 1))
+        has_more = len(page) > limit
+        page = page[:limit]
         
-        return transactions[:limit]
+        return {
+            'transactions': [shape(self, row) for _, _, _, shape, row in page],
+            'next_cursor': encode_cursor(*page[-1][:3]) if has_more else None,
+            'has_more': has_more,
+        }
+    
+    def _stream(self, kind, shape, rows):
+        rank = FEED_RANK[kind]
+        for row in rows:
+            yield row['created_at'], rank, row['id'], shape, row
+    
+    def _after(self, kind, position):
+        """Rows of this feed that sort strictly after the cursor (created_at, rank, id) descending"""
+        created_at, rank, last_id = position
+        own_rank = FEED_RANK[kind]
+        if own_rank < rank:
+            return Q(created_at__lte=created_at)
+        if own_rank > rank:
+            return Q(created_at__lt=created_at)
+        return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id)
+    
+    def _stk_row(self, row):
+        return {
+            'id': row['id'],
+            'type': 'stk_push',
+            'status': self._status(row['result_code']),
+            'amount': float(row['amount']) if row['amount'] else None,
+            'phone_number': row['phone_number'],
+            'payment_type': row['payment_type'],
+            'product_id': row['product_id'],
+            'mpesa_receipt_number': row['mpesa_receipt_number'],
+            'transaction_date': row['transaction_date'],
+            'result_desc': row['result_desc'],
+            'created_at': row['created_at'].isoformat(),
+            'updated_at': row['updated_at'].isoformat()
+        }
+    
+    def _b2c_row(self, row):
+        return {
+            'id': row['id'],
+            'type': 'b2c_transfer',
+            'status': self._status(row['result_code']),
+            'amount': float(row['amount']) if row['amount'] is not None else None,
+            'phone_number': row['phone_number'],
+            'mpesa_receipt_number': row['mpesa_receipt_number'],
+            'reference': row['reference'],
+            'remarks': row['remarks'],
+            'result_description': row['result_description'],
+            'created_at': row['created_at'].isoformat(),
+            'updated_at': row['updated_at'].isoformat()
+        }
+    
+    # feed type -> (model, columns read, row shaper)
+    _FEEDS = {
+        'stk_push': (MpesaTransaction, (
+            'id', 'result_code', 'amount', 'phone_number', 'payment_type', 'product_id',
+            'mpesa_receipt_number', 'transaction_date', 'result_desc', 'created_at', 'updated_at',
+        ), _stk_row),
+        'b2c_transfer': (MpesaB2CTransaction, (
+            'id', 'result_code', 'amount', 'phone_number', 'mpesa_receipt_number', 'reference',
+            'remarks', 'result_description', 'created_at', 'updated_at',
+        ), _b2c_row),
+    }
     
     def get_transaction_summary(self, user_id=None, days=30):
         """
         Get transaction summary statistics
         
+        Read from the daily rollups (reporting app): one query over at most
+        days x 2 providers x 3 statuses rows, whatever the transaction volume.
+        
         Args:
             user_id: User ID (None for all users)
-            days: Number of days to look back
+            days: Number of days to look back (including today)
         """
         from django.utils import timezone
         from datetime import timedelta
         
-        start_date = timezone.now() - timedelta(days=days)
+        start_day = timezone.localdate() - timedelta(days=days - 1)
+        providers = {Provider.MPESA_STK: 'stk_push', Provider.MPESA_B2C: 'b2c_transfer'}
         
-        # STK Push summary
-        stk_filter = Q(created_at__gte=start_date)
-        if user_id:
-            stk_filter &= Q(user_id=user_id)
+        buckets = DailyRollup.objects.filter(
+            user_id=user_id or ALL_USERS,
+            provider__in=list(providers),
+            day__gte=start_day,
+        ).values_list('day', 'provider', 'status', 'count', 'amount')
         
-        stk_transactions = MpesaTransaction.objects.filter(stk_filter)
-        stk_successful = stk_transactions.filter(result_code=0)
-        stk_total_amount = sum(float(t.amount) for t in stk_successful if t.amount)
+        totals = {key: self._empty_bucket() for key in providers.values()}
+        daily = {}
+        for day, provider, status, count, amount in buckets:
+            key = providers[provider]
+            for bucket in (totals[key], daily.setdefault(day, {}).setdefault(key, self._empty_bucket())):
+                bucket[status] += count
+                if status == RollupStatus.SUCCESS:
+                    bucket['amount'] += amount
         
-        # B2C summary
-        b2c_filter = Q(created_at__gte=start_date)
-        if user_id:
-            b2c_filter &= Q(user_id=user_id)
-        
-        b2c_transactions = MpesaB2CTransaction.objects.filter(b2c_filter)
-        b2c_successful = b2c_transactions.filter(result_code=0)
-        b2c_total_amount = sum(float(t.amount) for t in b2c_successful)
+        stk = self._summarize(totals['stk_push'])
+        b2c = self._summarize(totals['b2c_transfer'])
         
         return {
             'period_days': days,
-            'stk_push': {
-                'total_transactions': stk_transactions.count(),
-                'successful_transactions': stk_successful.count(),
-                'total_amount': stk_total_amount,
-                'success_rate': (stk_successful.count() / stk_transactions.count() * 100) if stk_transactions.count() > 0 else 0
-            },
-            'b2c_transfer': {
-                'total_transactions': b2c_transactions.count(),
-                'successful_transactions': b2c_successful.count(),
-                'total_amount': b2c_total_amount,
-                'success_rate': (b2c_successful.count() / b2c_transactions.count() * 100) if b2c_transactions.count() > 0 else 0
-            },
+            'stk_push': stk,
+            'b2c_transfer': b2c,
             'overall': {
-                'total_transactions': stk_transactions.count() + b2c_transactions.count(),
-                'successful_transactions': stk_successful.count() + b2c_successful.count(),
-                'net_amount': stk_total_amount - b2c_total_amount  # Money in - Money out
+                'total_transactions': stk['total_transactions'] + b2c['total_transactions'],
+                'successful_transactions': stk['successful_transactions'] + b2c['successful_transactions'],
+                'net_amount': stk['total_amount'] - b2c['total_amount']  # Money in - Money out
+            },
+            'daily': [
+                dict(date=day.isoformat(), **{key: self._summarize(bucket) for key, bucket in daily[day].items()})
+                for day in sorted(daily)
+            ]
+        }
+    
+    def _empty_bucket(self):
+        return {RollupStatus.SUCCESS: 0, RollupStatus.FAILED: 0, RollupStatus.PENDING: 0, 'amount': Decimal('0')}
+    
+    def _summarize(self, bucket):
+        """Shape per-status counts into the summary format"""
+        successful = bucket[RollupStatus.SUCCESS]
+        total = successful + bucket[RollupStatus.FAILED] + bucket[RollupStatus.PENDING]
+        return {
+            'total_transactions': total,
+            'successful_transactions': successful,
+            'total_amount': bucket['amount'],
+            'success_rate': round(successful / total * 100, 2) if total > 0 else 0,
+            'by_status': {
+                'success': successful,
+                'failed': bucket[RollupStatus.FAILED],
+                'pending': bucket[RollupStatus.PENDING]
             }
         }
     
@@ -125,65 +225,14 @@ class TransactionService:
         """
         Search transactions by phone number, receipt number, or reference
         
+        See TransactionSearchService for how each kind of query is matched.
+        
         Args:
             query: Search query
             user_id: User ID to filter by (optional)
             limit: Maximum results
         """
-        transactions = []
-        
-        # Search STK transactions
-        stk_filter = Q(
-            Q(phone_number__icontains=query) |
-            Q(mpesa_receipt_number__icontains=query) |
-            Q(account_reference__icontains=query)
-        )
-        if user_id:
-            stk_filter &= Q(user_id=user_id)
-        
-        stk_results = MpesaTransaction.objects.filter(stk_filter).order_by('-created_at')[:limit]
-        
-        for txn in stk_results:
-            transactions.append({
-                'id': txn.id,
-                'type': 'stk_push',
-                'status': self._get_stk_status(txn),
-                'amount': float(txn.amount) if txn.amount else None,
-                'phone_number': txn.phone_number,
-                'mpesa_receipt_number': txn.mpesa_receipt_number,
-                'account_reference': txn.account_reference,
-                'created_at': txn.created_at.isoformat()
-            })
-        
-        # Search B2C transactions
-        b2c_filter = Q(
-            Q(phone_number__icontains=query) |
-            Q(mpesa_receipt_number__icontains=query) |
-            Q(reference__icontains=query) |
-            Q(remarks__icontains=query)
-        )
-        if user_id:
-            b2c_filter &= Q(user_id=user_id)
-        
-        b2c_results = MpesaB2CTransaction.objects.filter(b2c_filter).order_by('-created_at')[:limit]
-        
-        for txn in b2c_results:
-            transactions.append({
-                'id': txn.id,
-                'type': 'b2c_transfer',
-                'status': self._get_b2c_status(txn),
-                'amount': float(txn.amount),
-                'phone_number': txn.phone_number,
-                'mpesa_receipt_number': txn.mpesa_receipt_number,
-                'reference': txn.reference,
-                'remarks': txn.remarks,
-                'created_at': txn.created_at.isoformat()
-            })
-        
-        # Sort by created_at descending
-        transactions.sort(key=lambda x: x['created_at'], reverse=True)
-        
-        return transactions[:limit]
+        return TransactionSearchService().search(query, user_id=user_id, limit=limit)
     
     def get_failed_transactions(self, user_id=None, limit=50):
         """
@@ -232,6 +281,11 @@ class TransactionService:
         
         return transactions[:limit]
     
+    def _status(self, result_code):
+        if result_code is None:
+            return "pending"
+        return "success" if result_code == 0 else "failed"
+    
     def _get_stk_status(self, transaction):
         """Get STK transaction status"""
         if transaction.result_code is None:
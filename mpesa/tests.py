@@ -1,3 +1,510 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core import idempotency
+from .models import MpesaB2CBatch, MpesaB2CBatchRow, MpesaB2CTransaction, MpesaTransaction
+from .services.auth import DarajaTokenManager
+from .services.callback import CallbackService
+from .services.referrals import subscription_id_from_reference
+from .services.bulk_b2c import BulkB2CPayout, load_rows, validate_rows
+from .services.search import PHONE_PREFIX, PHONE_SUFFIX, RECEIPT, TEXT, classify
+from .services.stk_sweeper import EXPIRED_RESULT_CODE, STILL_PROCESSING, STKPendingSweeper
+from .services.transaction import InvalidCursor, TransactionService
+from reporting.backfill import backfill
+from reporting import ledger
+from reporting.models import ALL_USERS, DailyRollup, LedgerEntry, LedgerStatus, Provider, RollupStatus
+
+
+def _token_response(token='tok-1', expires_in='3599'):
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {'access_token': token, 'expires_in': expires_in}
+    return response
+
+
+class DarajaTokenManagerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = DarajaTokenManager('key', 'secret', 'https://daraja.test', refresh_margin=60, lock_timeout=5)
+
+    @mock.patch('mpesa.services.auth.get_session')
+    def test_token_is_reused_across_calls(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = _token_response()
+
+        self.assertEqual(self.manager.get_token(), 'Bearer tok-1')
+        self.assertEqual(self.manager.get_token(), 'Bearer tok-1')
+
+        # A second manager (another worker) reads the shared cache
+        other = DarajaTokenManager('key', 'secret', 'https://daraja.test')
+        self.assertEqual(other.get_token(), 'Bearer tok-1')
+        self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch('mpesa.services.auth.get_session')
+    def test_concurrent_burst_fetches_once(self, mock_session):
+        mock_get = mock_session.return_value.get
+        def slow_fetch(*args, **kwargs):
+            time.sleep(0.1)
+            return _token_response()
+        mock_get.side_effect = slow_fetch
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.manager.get_token())) for _ in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(set(results), {'Bearer tok-1'})
+
+    @mock.patch('mpesa.services.auth.get_session')
+    def test_invalidate_is_seen_by_every_worker(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [_token_response('revoked'), _token_response('fresh')]
+        other = DarajaTokenManager('key', 'secret', 'https://daraja.test', refresh_margin=60, lock_timeout=5)
+
+        self.assertEqual(self.manager.get_token(), 'Bearer revoked')
+        self.assertEqual(other.get_token(), 'Bearer revoked')
+        self.manager.invalidate()  # Safaricom answered 401 in this worker
+
+        self.assertEqual(other.get_token(), 'Bearer fresh')
+        self.assertEqual(self.manager.get_token(), 'Bearer fresh')
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch('mpesa.services.auth.get_session')
+    def test_forced_refresh_reuses_a_peer_token(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = _token_response('old', '30')
+        self.manager.get_token()
+        # Another worker refreshed first and published its token
+        cache.set(self.manager.cache_key, {'access_token': 'peer', 'expires_at': time.time() + 3600})
+
+        self.assertEqual(self.manager._fetch_single_flight(force=True)[0], 'peer')
+        self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch('mpesa.services.auth.get_session')
+    def test_token_near_expiry_refreshes_in_background(self, mock_session):
+        mock_get = mock_session.return_value.get
+        mock_get.side_effect = [_token_response('old', '30'), _token_response('new')]
+
+        self.assertEqual(self.manager.get_token(), 'Bearer old')
+        # Still valid, so served immediately while the refresh runs
+        self.assertEqual(self.manager.get_token(), 'Bearer old')
+
+        deadline = time.time() + 2
+        while self.manager.get_token() != 'Bearer new' and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.manager.get_token(), 'Bearer new')
+        self.assertEqual(mock_get.call_count, 2)
+
+
+class AsyncInitiationViewTests(TestCase):
+    url = '/mpesa/async/stk-push/'
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.post(self.url, {'phone': '254700000000', 'amount': 10},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    @mock.patch('mpesa.async_views.STKPushService')
+    async def test_stk_push_awaits_service(self, mock_service):
+        mock_service.return_value.ainitiate_payment = mock.AsyncMock(return_value={
+            'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1', 'MerchantRequestID': 'mr-1',
+            'CustomerMessage': 'Success',
+        })
+        user = await get_user_model().objects.acreate(username='payer')
+        await self.async_client.aforce_login(user)
+
+        response = await self.async_client.post(self.url, {'phone': '254700000000', 'amount': 10},
+                                                content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['checkout_request_id'], 'ws_CO_1')
+        kwargs = mock_service.return_value.ainitiate_payment.await_args.kwargs
+        self.assertEqual(kwargs['user_id'], user.id)
+
+
+class BulkB2CPayoutTests(TestCase):
+    def test_validation_flags_bad_and_duplicate_rows(self):
+        rows = load_rows(
+            b"Phone,Amount,Reference\n254700000001,100,r1\n0700000002,50,r2\n254700000003,0,r3\n"
+            b"254700000004,20,r1\n+254700000005,30,\n"
+        )
+        valid, errors = validate_rows(rows)
+
+        self.assertEqual([(r.row, r.phone, r.amount) for r in valid],
+                         [(1, '254700000001', 100), (5, '254700000005', 30)])
+        self.assertEqual([e['row'] for e in errors], [2, 3, 4])
+
+    def _service(self):
+        service = mock.Mock()
+        service.get_access_token.return_value = 'Bearer tok'
+        service._base_host.return_value = 'https://daraja.test'
+        service._build_request.side_effect = lambda token, phone, *args: ({'PartyB': phone}, {})
+        service._transaction_fields.side_effect = lambda data, phone, amount, occasion, remarks, command_id, user_id, reference: dict(
+            conversation_id=data['ConversationID'], originator_conversation_id='o', response_code='0',
+            response_description='ok', amount=amount, phone_number=phone, command_id=command_id,
+            remarks=remarks, occasion=occasion, user_id=user_id, reference=reference,
+        )
+        return service
+
+    def _post(self, url, json, **kwargs):
+        response = mock.Mock(status_code=200)
+        if json['PartyB'].endswith('3'):
+            response.json.return_value = {'ResponseCode': '1', 'ResponseDescription': 'Insufficient funds'}
+        else:
+            response.json.return_value = {'ResponseCode': '0', 'ConversationID': f"conv-{json['PartyB']}"}
+        return response
+
+    def test_run_bulk_creates_accepted_transfers(self):
+        payout = BulkB2CPayout(service=self._service(), workers=4, rate=0)
+        rows = [{'phone': f'25470000000{i}', 'amount': 10, 'reference': f'r{i}'} for i in range(1, 6)]
+        rows.append({'phone': 'bad', 'amount': 10})
+        batch, valid = payout.create_batch(rows, command_id='SalaryPayment')
+        self.assertEqual(batch.rows.filter(status=MpesaB2CBatchRow.QUEUED).count(), 5)
+
+        with mock.patch('mpesa.services.bulk_b2c.get_session') as get_session, \
+                mock.patch('mpesa.services.bulk_b2c.rollups') as rollups, \
+                mock.patch('mpesa.services.bulk_b2c.ledger') as ledger:
+            get_session.return_value.post.side_effect = self._post
+            payout.run_next()
+        self.assertEqual(rollups.record.call_count, 4)
+        self.assertEqual(ledger.record.call_count, 4)
+
+        batch = MpesaB2CBatch.objects.get(pk=batch.pk)
+        self.assertEqual((batch.status, batch.total_count, batch.processed_count), ('completed', 6, 6))
+        self.assertEqual((batch.accepted_count, batch.failed_count), (4, 2))
+        self.assertEqual([e['row'] for e in batch.row_errors()], [3, 6])
+        self.assertEqual(MpesaB2CTransaction.objects.filter(batch=batch, command_id='SalaryPayment').count(), 4)
+        self.assertEqual(batch.rows.get(row=1).transaction.conversation_id, 'conv-254700000001')
+        self.assertEqual(batch.rows.get(row=3).status, MpesaB2CBatchRow.FAILED)
+
+    def test_resumed_batch_does_not_resend_in_flight_rows(self):
+        payout = BulkB2CPayout(service=self._service(), workers=2, rate=0)
+        batch, _ = payout.create_batch([{'phone': f'25470000000{i}', 'amount': 10} for i in (1, 2, 4)])
+        # A worker died after sending row 1 and before Daraja's answer was stored
+        batch.rows.filter(row=1).update(status=MpesaB2CBatchRow.SENDING)
+        MpesaB2CBatch.objects.filter(pk=batch.pk).update(status='processing')
+
+        with mock.patch('mpesa.services.bulk_b2c.get_session') as get_session, \
+                mock.patch('mpesa.services.bulk_b2c.rollups'), mock.patch('mpesa.services.bulk_b2c.ledger'):
+            get_session.return_value.post.side_effect = self._post
+            # Its heartbeat is fresh: the batch still belongs to the worker running it
+            self.assertIsNone(payout.run_next())
+            self.assertEqual(payout.run_next(batch.pk).status, 'processing')
+            self.assertFalse(get_session.return_value.post.called)
+
+            MpesaB2CBatch.objects.filter(pk=batch.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+            batch = payout.run_next()
+
+        sent = [c.kwargs['json']['PartyB'] for c in get_session.return_value.post.call_args_list]
+        self.assertEqual(sorted(sent), ['254700000002', '254700000004'])
+        self.assertEqual((batch.status, batch.accepted_count, batch.failed_count, batch.in_doubt_count),
+                         ('completed', 2, 0, 1))
+        self.assertEqual(batch.row_errors(), [{'row': 1, 'error': BulkB2CPayout.INTERRUPTED, 'status': 'in_doubt'}])
+
+    def test_unanswered_rows_stay_in_doubt_until_their_result_arrives(self):
+        self.addCleanup(idempotency.recent.clear)
+        payout = BulkB2CPayout(service=self._service(), workers=2, rate=0)
+        batch, _ = payout.create_batch([{'phone': f'25470000000{i}', 'amount': 10} for i in (1, 2, 4)], claimed=True)
+        self.assertIsNone(payout.run_next())  # already owned by this caller
+
+        def post(url, json, **kwargs):
+            if json['PartyB'] == '254700000001':
+                raise requests.ReadTimeout('read timed out')
+            if json['PartyB'] == '254700000002':
+                return mock.Mock(status_code=503)
+            return self._post(url, json, **kwargs)
+
+        with mock.patch('mpesa.services.bulk_b2c.get_session') as get_session, \
+                mock.patch('mpesa.services.bulk_b2c.rollups'), mock.patch('mpesa.services.bulk_b2c.ledger'):
+            get_session.return_value.post.side_effect = post
+            batch = payout.run(batch)
+        self.assertEqual((batch.processed_count, batch.accepted_count, batch.failed_count, batch.in_doubt_count),
+                         (3, 1, 0, 2))
+
+        result = {'Result': {'ResultCode': 0, 'ResultDesc': 'ok', 'ConversationID': 'AG_late',
+                             'ResultParameters': {'ResultParameter': [
+                                 {'Key': 'TransactionAmount', 'Value': 10},
+                                 {'Key': 'TransactionReceipt', 'Value': 'RCPT1'},
+                                 {'Key': 'ReceiverPartyPublicName', 'Value': '254700000001 - Jane Doe'},
+                             ]}}}
+        self.assertEqual(CallbackService().handle_b2c_result(result)['status'], 'success')
+
+        row = batch.rows.get(row=1)
+        self.assertEqual((row.status, row.transaction.mpesa_receipt_number), (MpesaB2CBatchRow.ACCEPTED, 'RCPT1'))
+        batch.refresh_from_db()
+        self.assertEqual((batch.accepted_count, batch.in_doubt_count), (2, 1))
+        self.assertEqual(LedgerEntry.objects.filter(source_id=row.transaction_id).latest('id').status, LedgerStatus.SUCCESS)
+
+
+class TransactionSummaryTests(TestCase):
+    def _stk(self, n, result_code, amount, days_ago=0):
+        txn = MpesaTransaction.objects.create(
+            merchant_request_id=f'mr-{n}', checkout_request_id=f'ws-{n}', result_code=result_code,
+            result_desc='', amount=amount, user_id=7,
+        )
+        MpesaTransaction.objects.filter(pk=txn.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def test_summary_reads_daily_rollups(self):
+        self._stk(1, 0, Decimal('100.10'))
+        self._stk(2, 0, Decimal('0.20'), days_ago=1)
+        self._stk(3, 1032, Decimal('50.00'), days_ago=1)
+        self._stk(4, None, Decimal('5.00'))
+        self._stk(5, 0, Decimal('999.00'), days_ago=40)  # outside the window
+        MpesaB2CTransaction.objects.create(
+            conversation_id='c-1', originator_conversation_id='o-1', response_code='0', response_description='',
+            amount=Decimal('30.05'), phone_number='254700000000', command_id='BusinessPayment', remarks='',
+            occasion='', result_code=0, user_id=7,
+        )
+
+        backfill()
+
+        with self.assertNumQueries(1):
+            summary = TransactionService().get_transaction_summary(user_id=7, days=30)
+
+        stk = summary['stk_push']
+        self.assertEqual((stk['total_transactions'], stk['successful_transactions']), (4, 2))
+        self.assertEqual(stk['total_amount'], Decimal('100.30'))
+        self.assertEqual(stk['by_status'], {'success': 2, 'failed': 1, 'pending': 1})
+        self.assertEqual(stk['success_rate'], 50.0)
+        self.assertEqual(summary['overall']['net_amount'], Decimal('70.25'))
+        self.assertEqual(len(summary['daily']), 2)
+        yesterday = summary['daily'][0]
+        self.assertEqual(yesterday['stk_push']['by_status'], {'success': 1, 'failed': 1, 'pending': 0})
+        self.assertNotIn('b2c_transfer', yesterday)
+        self.assertEqual(summary['daily'][1]['b2c_transfer']['total_amount'], Decimal('30.05'))
+
+
+class TransactionFeedTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for n in range(5):
+            txn = MpesaTransaction.objects.create(
+                merchant_request_id=f'mr-{n}', checkout_request_id=f'ws-{n}', result_desc='', amount=10, user_id=7,
+            )
+            MpesaTransaction.objects.filter(pk=txn.pk).update(created_at=now - timedelta(minutes=n // 2))
+        for n in range(4):
+            txn = MpesaB2CTransaction.objects.create(
+                conversation_id=f'c-{n}', originator_conversation_id=f'o-{n}', response_code='0',
+                response_description='', amount=5, phone_number='254700000000', command_id='BusinessPayment',
+                remarks='', occasion='', user_id=7,
+            )
+            # Shares timestamps with STK rows so the cross-feed tie-break is exercised
+            MpesaB2CTransaction.objects.filter(pk=txn.pk).update(created_at=now - timedelta(minutes=n))
+
+    def test_pages_cover_history_once_in_order(self):
+        service = TransactionService()
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(2):
+                page = service.get_user_transactions_page(7, limit=4, cursor=cursor)
+            seen += page['transactions']
+            if not page['has_more']:
+                break
+            cursor = page['next_cursor']
+
+        self.assertEqual(len(seen), 9)
+        self.assertEqual(len({(t['type'], t['id']) for t in seen}), 9)
+        self.assertEqual([t['created_at'] for t in seen], sorted((t['created_at'] for t in seen), reverse=True))
+        self.assertEqual(service.get_user_transactions(7, 'b2c_transfer', limit=2),
+                         [t for t in seen if t['type'] == 'b2c_transfer'][:2])
+
+    def test_rejects_tampered_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            TransactionService().get_user_transactions_page(7, cursor='not-a-cursor')
+
+
+class TransactionSearchTests(TestCase):
+    def setUp(self):
+        MpesaTransaction.objects.create(
+            merchant_request_id='mr-1', checkout_request_id='ws-1', result_code=0, result_desc='', amount=10,
+            phone_number='254712345678', mpesa_receipt_number='NLJ7RT61SV', account_reference='Invoice-42',
+            user_id=7,
+        )
+        MpesaB2CTransaction.objects.create(
+            conversation_id='c-1', originator_conversation_id='o-1', response_code='0', response_description='',
+            amount=5, phone_number='254798765432', command_id='BusinessPayment', remarks='June payout 2024',
+            occasion='', reference='payroll', user_id=7,
+        )
+
+    def test_classify(self):
+        self.assertEqual(classify('nlj7rt61sv'), (RECEIPT, 'NLJ7RT61SV'))
+        self.assertEqual(classify('+254 712 345'), (PHONE_PREFIX, '254712345'))
+        self.assertEqual(classify('0712345678'), (PHONE_PREFIX, '254712345678'))
+        self.assertEqual(classify('5678'), (PHONE_SUFFIX, '8765'))
+        self.assertEqual(classify('invoice'), (TEXT, 'invoice'))
+
+    def test_each_query_type_finds_its_rows(self):
+        service = TransactionService()
+        found = lambda q: [(t['type'], t['id']) for t in service.search_transactions(q, user_id=7)]
+        stk, b2c = MpesaTransaction.objects.get().id, MpesaB2CTransaction.objects.get().id
+
+        self.assertEqual(found('NLJ7RT61SV'), [('stk_push', stk)])
+        self.assertEqual(found('0712345678'), [('stk_push', stk)])
+        self.assertEqual(found('65432'), [('b2c_transfer', b2c)])
+        self.assertEqual(found('PAYOUT'), [('b2c_transfer', b2c)])
+        self.assertEqual(found('invoice-4'), [('stk_push', stk)])
+        self.assertEqual(found('2024'), [('b2c_transfer', b2c)])  # numeric remark, not a phone fragment
+        self.assertEqual(found('42'), [])
+        self.assertEqual(found('ab'), [])
+        self.assertEqual(service.search_transactions('NLJ7RT61SV', user_id=8), [])
+
+
+class BatchCallbackTests(TestCase):
+    def setUp(self):
+        self.addCleanup(idempotency.recent.clear)
+
+    def _payload(self, n, result_code=0):
+        return {'Body': {'stkCallback': {
+            'MerchantRequestID': f'mr-{n}', 'CheckoutRequestID': f'ws-{n}', 'ResultCode': result_code,
+            'ResultDesc': 'done', 'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': f'R{n:09d}'}]},
+        }}}
+
+    def _apply(self, numbers):
+        for n in numbers:
+            MpesaTransaction.objects.create(merchant_request_id=f'mr-{n}', checkout_request_id=f'ws-{n}',
+                                            result_desc='Payment request initiated', amount=10, user_id=7)
+        payloads = [self._payload(n, result_code=n % 2) for n in numbers]
+        with CaptureQueriesContext(connection) as queries:
+            results = CallbackService().apply_stk_callbacks(payloads)
+        return results, len(queries)
+
+    def test_round_trips_do_not_grow_with_batch_size(self):
+        self._apply(range(0, 2))  # creates the rollup buckets
+        small, small_queries = self._apply(range(10, 14))
+        large, large_queries = self._apply(range(100, 140))
+
+        self.assertEqual({r['status'] for r in small + large}, {'success'})
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(MpesaTransaction.objects.filter(result_code=0).count(), 23)
+        self.assertEqual(MpesaTransaction.objects.get(checkout_request_id='ws-100').mpesa_receipt_number,
+                         'R000000100')
+
+    def test_b2c_paths_lock_their_rows(self):
+        for n in (1, 2):
+            MpesaB2CTransaction.objects.create(
+                conversation_id=f'c-{n}', originator_conversation_id='o', response_code='0', response_description='',
+                amount=5, phone_number='254798765432', command_id='BusinessPayment', remarks='', occasion='',
+            )
+        result = lambda n, code: {'Result': {'ConversationID': f'c-{n}', 'ResultCode': code, 'ResultDesc': 'done'}}
+        locking = mock.patch.object(MpesaB2CTransaction.objects, 'select_for_update',
+                                    wraps=MpesaB2CTransaction.objects.select_for_update)
+        with locking as lock:
+            self.assertEqual(CallbackService().apply_b2c_results([result(1, 0)])[0]['status'], 'success')
+            self.assertEqual(CallbackService().handle_b2c_result(result(2, 0))['status'], 'success')
+            self.assertEqual(CallbackService().handle_b2c_timeout(result(2, 1))['status'], 'success')
+        self.assertEqual(lock.call_count, 3)
+
+    def test_duplicates_and_unknown_rows_in_a_batch(self):
+        MpesaTransaction.objects.create(merchant_request_id='mr-1', checkout_request_id='ws-1',
+                                        result_desc='Payment request initiated', amount=10)
+        results = CallbackService().apply_stk_callbacks(
+            [self._payload(1), self._payload(1), self._payload(2), {'Body': {}}]
+        )
+        self.assertEqual([r['status'] for r in results], ['success', 'duplicate', 'error', 'error'])
+        self.assertEqual(results[2]['message'], 'Transaction not found')
+        self.assertEqual(CallbackService().apply_stk_callbacks([self._payload(1)])[0]['status'], 'duplicate')
+
+
+class _QueryService:
+    """Stands in for STKPushService.query_status with canned Daraja answers."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.queried = []
+
+    def query_status(self, checkout_request_id):
+        self.queried.append(checkout_request_id)
+        return self.answers[checkout_request_id]
+
+
+class STKPendingSweeperTests(TestCase):
+    def _pending(self, n, age):
+        txn = MpesaTransaction.objects.create(merchant_request_id=f'mr-{n}', checkout_request_id=f'ws-{n}',
+                                              result_desc='Payment request initiated', amount=10, user_id=7)
+        MpesaTransaction.objects.filter(pk=txn.pk).update(created_at=timezone.now() - age)
+        return txn
+
+    def test_finalizes_answered_and_expired_rows(self):
+        self._pending(1, timedelta(minutes=10))
+        self._pending(2, timedelta(minutes=10))
+        self._pending(3, timedelta(minutes=10))
+        self._pending(4, timedelta(days=2))
+        self._pending(5, timedelta(seconds=10))  # too recent to query
+        service = _QueryService({
+            'ws-1': {'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'},
+            'ws-2': {'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user'},
+            'ws-3': {'errorCode': STILL_PROCESSING, 'errorMessage': 'The transaction is being processed'},
+            'ws-4': {'errorCode': STILL_PROCESSING, 'errorMessage': 'The transaction is being processed'},
+        })
+        sweeper = STKPendingSweeper(workers=2, rate=1000, service=service)
+
+        with mock.patch.object(CallbackService, '_handle_successful_subscription_payment') as activate:
+            self.assertEqual(sweeper.run_once(), 4)
+
+        codes = dict(MpesaTransaction.objects.values_list('checkout_request_id', 'result_code'))
+        self.assertEqual(codes, {'ws-1': 0, 'ws-2': 1032, 'ws-3': None, 'ws-4': EXPIRED_RESULT_CODE, 'ws-5': None})
+        self.assertEqual(sorted(service.queried), ['ws-1', 'ws-2', 'ws-3', 'ws-4'])
+        activate.assert_called_once()
+        self.assertEqual(activate.call_args[0][0].checkout_request_id, 'ws-1')
+        self.assertEqual(sorted(LedgerEntry.objects.values_list('reference', 'status')),
+                         [('ws-1', LedgerStatus.SUCCESS), ('ws-2', LedgerStatus.FAILED),
+                          ('ws-4', LedgerStatus.FAILED)])
+
+    def test_callback_during_finalize_is_not_double_counted(self):
+        self.addCleanup(idempotency.recent.clear)
+        txn = self._pending(1, timedelta(minutes=10))
+        sweeper = STKPendingSweeper(rate=1000, service=_QueryService({}))
+        callback = {'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1', 'CheckoutRequestID': 'ws-1', 'ResultCode': 0, 'ResultDesc': 'done',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'R000000001'}]},
+        }}}
+        sweep_ledger = ledger.transitions
+
+        def deliver_callback(*args):
+            # The callback arrives while the sweeper holds the row: it must see the swept status
+            sweep_ledger(*args)
+            self.assertEqual(CallbackService().handle_stk_callback(callback)['status'], 'success')
+
+        locking = mock.patch.object(MpesaTransaction.objects, 'select_for_update',
+                                    wraps=MpesaTransaction.objects.select_for_update)
+        with mock.patch('mpesa.services.stk_sweeper.ledger', mock.Mock(transitions=deliver_callback)), locking as lock, \
+                mock.patch.object(CallbackService, '_handle_successful_subscription_payment'):
+            sweeper.finalize([txn], {txn.pk: (0, 'The service request is processed successfully.')})
+
+        self.assertEqual(lock.call_count, 2)  # the sweeper and the callback both lock the row
+        txn.refresh_from_db()
+        self.assertEqual((txn.result_code, txn.mpesa_receipt_number), (0, 'R000000001'))
+        self.assertEqual(LedgerEntry.objects.filter(source_id=txn.pk, status=LedgerStatus.SUCCESS).count(), 1)
+        self.assertEqual(DailyRollup.objects.get(provider=Provider.MPESA_STK, status=RollupStatus.SUCCESS,
+                                                 user_id=ALL_USERS).count, 1)
+
+    def test_callback_that_lands_first_wins(self):
+        txn = self._pending(1, timedelta(minutes=10))
+        sweeper = STKPendingSweeper(rate=1000, service=_QueryService({}))
+        MpesaTransaction.objects.filter(pk=txn.pk).update(result_code=0, result_desc='Callback')
+
+        self.assertEqual(sweeper.finalize([txn], {txn.pk: (1032, 'Request cancelled by user')}), 0)
+        txn.refresh_from_db()
+        self.assertEqual((txn.result_code, txn.result_desc), (0, 'Callback'))
+        self.assertFalse(LedgerEntry.objects.exists())
+
+
+class SubscriptionReferenceTests(SimpleTestCase):
+    def test_subscription_id_from_reference(self):
+        self.assertEqual(subscription_id_from_reference('Skyfield_premium_Sub_42'), '42')
+        self.assertIsNone(subscription_id_from_reference('Skyfield'))
+        self.assertIsNone(subscription_id_from_reference('Sub_'))
+        self.assertIsNone(subscription_id_from_reference(None))
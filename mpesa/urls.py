@@ -2,7 +2,7 @@
 M-Pesa URL patterns - Clean consolidated version
 """
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     # Main page
@@ -13,9 +13,18 @@ urlpatterns = [
     path('send-money/', views.send_money, name='send_money'),
     path('payment-status/', views.payment_status, name='payment_status'),
     
+    # Bulk B2C payouts
+    path('b2c/batches/', views.bulk_send_money, name='bulk_send_money'),
+    path('b2c/batches/<int:batch_id>/', views.bulk_payout_status, name='bulk_payout_status'),
+    
+    # Async (ASGI) payment endpoints
+    path('async/stk-push/', async_views.stk_push_payment, name='async_stk_push_payment'),
+    path('async/send-money/', async_views.send_money, name='async_send_money'),
+    
     # Transaction management
     path('transactions/', views.user_transactions, name='user_transactions'),
     path('transactions/summary/', views.transaction_summary, name='transaction_summary'),
+    path('transactions/search/', views.search_transactions, name='search_transactions'),
     
     # Callback endpoints (Safaricom webhooks)
     path('stk-callback/', views.mpesa_callback, name='stk_callback'),
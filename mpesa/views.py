@@ -7,7 +7,7 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
@@ -144,6 +144,91 @@ def send_money(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def bulk_send_money(request):
+    """
+    Start a bulk B2C payout (salaries, refunds, commissions)
+    Accepts a CSV/JSON upload in 'file' or a JSON body with 'rows'; returns the
+    batch record immediately and leaves dispatch to the process_b2c_batches worker
+    """
+    from .services.bulk_b2c import BulkB2CPayout, load_rows
+    
+    try:
+        upload = request.FILES.get('file')
+        if upload:
+            fmt = 'json' if upload.name.lower().endswith('.json') else 'csv'
+            rows = load_rows(upload.read(), fmt)
+        else:
+            rows = request.data.get('rows')
+        
+        if not rows:
+            return Response({
+                'error': 'Provide payout rows as a CSV/JSON file or a rows list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        payout = BulkB2CPayout()
+        batch, valid_rows = payout.create_batch(
+            rows,
+            command_id=request.data.get('command_id', 'BusinessPayment'),
+            occasion=request.data.get('occasion', 'Bulk payout'),
+            remarks=request.data.get('remarks', 'Payment from Skyfield'),
+            name=request.data.get('name', ''),
+            user_id=request.user.id
+        )
+        if not valid_rows:
+            batch.status = 'failed'
+            batch.save(update_fields=['status', 'updated_at'])
+        
+        return Response({
+            'success': True,
+            'message': f'{len(valid_rows)} transfer(s) queued',
+            'data': _batch_data(batch)
+        }, status=status.HTTP_202_ACCEPTED)
+        
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': f'Bulk payout failed: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def bulk_payout_status(request, batch_id):
+    """Get progress of a bulk B2C payout"""
+    from .models import MpesaB2CBatch
+    
+    try:
+        batch = MpesaB2CBatch.objects.get(pk=batch_id)
+    except MpesaB2CBatch.DoesNotExist:
+        return Response({'error': 'Batch not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'success': True,
+        'data': _batch_data(batch, include_errors=True)
+    }, status=status.HTTP_200_OK)
+
+
+def _batch_data(batch, include_errors=False):
+    data = {
+        'batch_id': batch.id,
+        'status': batch.status,
+        'total_count': batch.total_count,
+        'total_amount': str(batch.total_amount),
+        'processed_count': batch.processed_count,
+        'accepted_count': batch.accepted_count,
+        'failed_count': batch.failed_count,
+        'in_doubt_count': batch.in_doubt_count,
+        'created_at': batch.created_at,
+        'completed_at': batch.completed_at,
+    }
+    if include_errors:
+        data['errors'] = batch.row_errors()
+    return data
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def payment_status(request):
@@ -179,20 +264,55 @@ def payment_status(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_transactions(request):
-    """Get user's transaction history"""
-    from .services.transaction import TransactionService
+    """Get user's transaction history, one cursor-paginated page at a time"""
+    from .services.transaction import InvalidCursor, TransactionService
     
     try:
         transaction_service = TransactionService()
         transaction_type = request.GET.get('type')  # stk_push, b2c_transfer, or None for all
         limit = int(request.GET.get('limit', 50))
         
-        transactions = transaction_service.get_user_transactions(
+        page = transaction_service.get_user_transactions_page(
             user_id=request.user.id,
             transaction_type=transaction_type,
-            limit=limit
+            limit=limit,
+            cursor=request.GET.get('cursor')
         )
         
+        return Response({
+            'success': True,
+            'data': {
+                'transactions': page['transactions'],
+                'count': len(page['transactions']),
+                'next_cursor': page['next_cursor'],
+                'has_more': page['has_more']
+            }
+        }, status=status.HTTP_200_OK)
+        
+    except (InvalidCursor, ValueError) as e:
+        return Response({
+            'error': str(e) if isinstance(e, InvalidCursor) else 'limit must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': f'Failed to get transactions: {str(e)}'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_transactions(request):
+    """Search user's transactions by receipt number, phone number or reference"""
+    from .services.transaction import MAX_PAGE_SIZE, TransactionService
+    
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), MAX_PAGE_SIZE))
+        transactions = TransactionService().search_transactions(query, user_id=request.user.id, limit=limit)
+        
         return Response({
             'success': True,
             'data': {
@@ -203,7 +323,7 @@ def user_transactions(request):
         
     except Exception as e:
         return Response({
-            'error': f'Failed to get transactions: {str(e)}'
+            'error': f'Failed to search transactions: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -1,9 +1,10 @@
 from django.contrib import admin
-from .models import CollectionTransaction, DisbursementTransaction, CollectionCallback, DisbursementCallback
+from .models import CollectionTransaction, DisbursementTransaction, CollectionCallback, DisbursementCallback, DisbursementBatch
 
 
 admin.site.register(CollectionTransaction)
 admin.site.register(DisbursementTransaction)
+admin.site.register(DisbursementBatch)
 
 admin.site.register(CollectionCallback)
 # class CollectionCallbackAdmin(admin.ModelAdmin):
@@ -1,6 +1,22 @@
+import threading
+
 from django.apps import AppConfig
+from decouple import config
 
 
 class MtnmoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mtnmo'
+
+    def ready(self):
+        from core import inbox
+        from .collection_views import COLLECTION_CALLBACK, apply_collection_callback
+        from .disbursement_views import DISBURSEMENT_CALLBACK, apply_disbursement_callback
+
+        inbox.register(COLLECTION_CALLBACK, apply_collection_callback)
+        inbox.register(DISBURSEMENT_CALLBACK, apply_disbursement_callback)
+
+        # Optionally provision MoMo clients at startup instead of on the first payment
+        if config('MTNMO_EAGER_PROVISIONING', default=False, cast=bool):
+            from .clients import warm_up
+            threading.Thread(target=warm_up, name='mtnmo-warm-up', daemon=True).start()
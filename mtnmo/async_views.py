@@ -0,0 +1,69 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework import status
+
+from core.async_views import async_api_view
+from .clients import get_collection, get_disbursement
+from .collection_views import store_pending_collection
+from .disbursement_views import store_disbursement
+
+logger = logging.getLogger(__name__)
+
+
+# Async collection API; same contract as collection_views.collection
+@async_api_view(['POST'], permission_classes=[AllowAny])
+async def collection(request):
+    try:
+        # First use provisions the API user upstream, keep that off the event loop
+        coll = await sync_to_async(get_collection, thread_sensitive=False)()
+        amount = request.data.get('amount')
+        phone_number = request.data.get('phone')
+        external_id = request.data.get('external_id')
+        currency = request.data.get('currency')
+
+        response = await coll.arequestToPay(amount, phone_number, external_id, currency)
+
+        if 'error' in response:
+            return Response({"error": response['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        await sync_to_async(store_pending_collection)(response['ref'], amount, phone_number, external_id, currency)
+
+        return Response({"status": "success", "response": response}, status=status.HTTP_200_OK)
+    except KeyError as e:
+        logger.error(f"KeyError in collection: {e}")
+        return Response({"error": f"Key '{e}' not found in the response."}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Unexpected error in collection: {e}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Async disbursement API; same contract as disbursement_views.disbursement
+@async_api_view(['POST'], permission_classes=[AllowAny])
+async def disbursement(request):
+    try:
+        disbur = await sync_to_async(get_disbursement, thread_sensitive=False)()
+        amount = request.data.get('amount')
+        phone_number = request.data.get('phone')
+        external_id = request.data.get('external_id')
+        # Default to USD if not provided
+        currency = request.data.get('currency', 'USD')
+
+        result = await disbur.atransfer(amount, phone_number, external_id, currency)
+
+        if 'error' in result:
+            return Response({"error": result['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        transfer_status_res = await sync_to_async(disbur.getTransactionStatus, thread_sensitive=False)(
+            result.get('ref', ''))
+        await sync_to_async(store_disbursement)(transfer_status_res)
+
+        return Response({"status": "success", "response": result}, status=status.HTTP_200_OK)
+    except KeyError as e:
+        logger.error(f"KeyError in disbursement: {e}")
+        return Response({"error": f"Key '{e}' not found in the response."}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Unexpected error in disbursement: {e}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,240 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal, InvalidOperation
+
+from decouple import config
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.ratelimit import RateLimiter
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from reporting.rollups import mtn_status
+from .clients import get_disbursement
+from .models import DisbursementBatch, DisbursementCallback, DisbursementTransaction
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'PENDING'
+SUCCESSFUL = 'SUCCESSFUL'
+REJECTED = 'REJECTED'  # transfer was never accepted by MTN
+
+
+def validate_payees(payees):
+    """Validate payee rows up front; returns (clean rows, [{"row": n, "error": "..."}])."""
+    valid, errors = [], []
+    seen = set()
+    for index, payee in enumerate(payees, start=1):
+        if not isinstance(payee, dict):
+            errors.append({"row": index, "error": "Row must be an object"})
+            continue
+        phone = str(payee.get('phone') or '').strip().lstrip('+')
+        external_id = str(payee.get('external_id') or '').strip()
+        try:
+            amount = Decimal(str(payee.get('amount')))
+        except (InvalidOperation, ValueError):
+            amount = None
+
+        if not phone.isdigit() or not 8 <= len(phone) <= 15:
+            errors.append({"row": index, "error": "Invalid phone number"})
+        elif amount is None or not amount.is_finite() or amount <= 0:
+            errors.append({"row": index, "error": "Invalid amount"})
+        elif not external_id:
+            errors.append({"row": index, "error": "Missing external_id"})
+        elif external_id in seen:
+            errors.append({"row": index, "error": f"Duplicate external_id {external_id}"})
+        else:
+            seen.add(external_id)
+            valid.append({"row": index, "phone": phone, "amount": amount, "external_id": external_id})
+    return valid, errors
+
+
+class BulkDisbursement:
+    """Fans a batch of transfers out over a thread pool.
+
+    All workers share the registry Disbursement client, so one bearer token
+    (fetched before dispatch) and one pooled session serve the whole batch.
+    Every payee gets its X-Reference-Id when the batch is created, so a batch
+    interrupted before its rows were written can simply be run again: MTN
+    answers 409 for a ref it already accepted. Transfer rows are written with
+    bulk_create as results come in, and the batch is completed by
+    settle_from_callback as DisbursementCallbacks land. Batches are run by
+    process_disbursement_batches, not by the request that created them.
+    """
+
+    def __init__(self, workers=None, rate=None, flush_every=200, client=None):
+        self.workers = workers or config('MTNMO_BULK_WORKERS', default=16, cast=int)
+        self.rate = rate if rate is not None else config('MTNMO_BULK_RATE', default=20, cast=float)
+        self.flush_every = flush_every
+        self.client = client
+
+    def create_batch(self, payees, currency='USD', payer_message='Teeket disbursement', payee_note='Teeket'):
+        valid, errors = validate_payees(payees)
+        batch = DisbursementBatch.objects.create(
+            currency=currency,
+            payer_message=payer_message,
+            payee_note=payee_note,
+            total_count=len(valid),
+            total_amount=sum((p['amount'] for p in valid), Decimal(0)),
+            errors=errors,
+            payees=[{**p, 'amount': str(p['amount']), 'ref': str(uuid.uuid4())} for p in valid],
+            # Nothing to send: there is no transfer left to wait for
+            **({} if valid else {'status': 'COMPLETED', 'completed_at': timezone.now()}),
+        )
+        return batch, valid
+
+    def run(self, batch):
+        client = self.client or get_disbursement()
+        limiter = RateLimiter(self.rate)
+        client.authToken()  # one token for the whole fan-out
+
+        DisbursementBatch.objects.filter(pk=batch.pk).update(status='PROCESSING', updated_at=timezone.now())
+
+        def send(payee):
+            limiter.acquire()
+            return client.transfer(payee['amount'], payee['phone'], payee['external_id'], batch.currency,
+                                   batch.payer_message, batch.payee_note, ref=payee['ref'])
+
+        # Rows already written by an earlier, interrupted run are not sent again
+        written = {str(ref) for ref in batch.transactions.values_list('ref', flat=True)}
+        payees = [p for p in batch.payees if p['ref'] not in written]
+        rows = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(send, payee): payee for payee in payees}
+            for future in as_completed(futures):
+                payee = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": str(e)}
+                rows.append(self._row(batch, payee, result))
+                if len(rows) >= self.flush_every:
+                    self._flush(batch, rows)
+        self._flush(batch, rows)
+
+        DisbursementBatch.objects.filter(pk=batch.pk).update(status='SUBMITTED', updated_at=timezone.now())
+        complete_if_done(batch.pk)
+        batch.refresh_from_db()
+        return batch
+
+    def _row(self, batch, payee, result):
+        code = result.get('response')
+        if 'error' not in result or code == 409:
+            status = PENDING  # accepted now, or by an earlier run of this batch (duplicate ref)
+        elif code and 400 <= code < 500:
+            status = REJECTED  # MTN refused the transfer; nothing was sent
+        else:
+            # Timeout, connection error or 5xx: MTN may have accepted it. Left PENDING so the
+            # callback or the reconciler (reporting/reconcile.py) settles it by ref.
+            logger.warning(f"Transfer {payee['ref']} of batch {batch.pk} is in doubt: {result['error']}")
+            status = PENDING
+        return DisbursementTransaction(
+            batch=batch,
+            response=code,
+            ref=payee['ref'],
+            amount=Decimal(payee['amount']),
+            currency=batch.currency,
+            financial_transaction_id='',
+            external_id=payee['external_id'],
+            party_id_type='MSISDN',
+            party_id=payee['phone'],
+            payer_message=batch.payer_message,
+            payee_note=batch.payee_note,
+            status=status,
+        )
+
+    def _flush(self, batch, rows):
+        if not rows:
+            return
+        DisbursementTransaction.objects.bulk_create(rows)
+        rollups.record_many(Provider.MTN_DISBURSEMENT, (
+            (r.created_at, None, mtn_status(r.status), r.amount) for r in rows
+        ))
+        ledger.record_many(LedgerProvider.MTN_DISBURSEMENT, rows)
+        submitted = sum(1 for r in rows if r.status == PENDING)
+        DisbursementBatch.objects.filter(pk=batch.pk).update(
+            submitted_count=F('submitted_count') + submitted,
+            rejected_count=F('rejected_count') + (len(rows) - submitted),
+            updated_at=timezone.now(),
+        )
+        # Callbacks that raced ahead of the insert found no row; apply them now
+        refs = [str(r.ref) for r in rows if r.status == PENDING]
+        for callback in DisbursementCallback.objects.filter(ref__in=refs).values(
+                'ref', 'external_id', 'status', 'financial_transaction_id'):
+            settle_from_callback(callback['ref'], callback['external_id'], callback['status'],
+                                 callback['financial_transaction_id'])
+        rows.clear()
+
+    def run_next(self, batch_id=None):
+        """Claim and run the oldest PENDING batch (or the given one, to rerun it); returns it or None."""
+        batches = DisbursementBatch.objects.filter(pk=batch_id) if batch_id else \
+            DisbursementBatch.objects.filter(status='PENDING').order_by('created_at', 'id')
+        batch = batches.first()
+        if batch is None or batch.status in ('SUBMITTED', 'COMPLETED'):
+            return batch
+        if batch.status == 'PENDING':
+            # Another worker may have claimed it since the read
+            claimed = DisbursementBatch.objects.filter(pk=batch.pk, status='PENDING').update(
+                status='PROCESSING', updated_at=timezone.now()
+            )
+            if not claimed:
+                return batch
+        return self.run(batch)
+
+    def run_forever(self, interval=5, stop_event=None):
+        """Daemon loop: run pending batches one after another, sleeping when there are none."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                batch = self.run_next()
+            except Exception as e:
+                logger.error(f"Error running disbursement batches: {e}")
+                batch = None
+            if batch is None:
+                stop_event.wait(interval)
+
+
+def complete_if_done(batch_id):
+    """Mark a submitted batch COMPLETED once every transfer has a final status."""
+    return (
+        DisbursementBatch.objects
+        .filter(pk=batch_id, status='SUBMITTED')
+        .alias(done=F('successful_count') + F('failed_count') + F('rejected_count'))
+        .filter(done__gte=F('total_count'))
+        .update(status='COMPLETED', completed_at=timezone.now(), updated_at=timezone.now())
+    )
+
+
+def settle_from_callback(ref, external_id, status, financial_transaction_id=None):
+    """Apply a DisbursementCallback to its batch transfer and the batch counters."""
+    if not status or status == PENDING:
+        return 0
+    pending = DisbursementTransaction.objects.filter(status=PENDING, batch__isnull=False)
+    try:
+        pending = pending.filter(ref=uuid.UUID(str(ref)))
+    except ValueError:
+        if not external_id:
+            return 0
+        pending = pending.filter(external_id=external_id)
+
+    with transaction.atomic():
+        txn = pending.select_for_update().first()
+        if txn is None:
+            return 0
+        txn.status = status
+        txn.financial_transaction_id = financial_transaction_id or txn.financial_transaction_id
+        txn.save(update_fields=['status', 'financial_transaction_id'])
+        rollups.transition(Provider.MTN_DISBURSEMENT, txn.created_at, RollupStatus.PENDING, mtn_status(status),
+                           txn.amount)
+        ledger.transition(LedgerProvider.MTN_DISBURSEMENT, txn, RollupStatus.PENDING)
+        counter = 'successful_count' if status == SUCCESSFUL else 'failed_count'
+        DisbursementBatch.objects.filter(pk=txn.batch_id).update(
+            **{counter: F(counter) + 1, 'updated_at': timezone.now()}
+        )
+    complete_if_done(txn.batch_id)
+    return 1
+
@@ -0,0 +1,55 @@
+import logging
+import threading
+
+from .collection import Collection
+from .disbursement import Disbursement
+
+logger = logging.getLogger(__name__)
+
+# Per-process registry of MoMo clients.
+# Constructing a client provisions the API user/key upstream, so each client is
+# built once (lazily, or at startup via warm_up) and shared by every request
+# thread. The shared instance also keeps its cached bearer token across requests.
+# A client whose provisioning failed is not kept: the next call tries again.
+_clients = {}
+_lock = threading.Lock()
+
+
+class ProvisioningError(RuntimeError):
+    pass
+
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                if not client.provisioned:
+                    raise ProvisioningError(f"MoMo {name} API user/key could not be provisioned")
+                _clients[name] = client
+    return client
+
+
+def get_collection() -> Collection:
+    return _get_client('collection', Collection)
+
+
+def get_disbursement() -> Disbursement:
+    return _get_client('disbursement', Disbursement)
+
+
+def warm_up() -> None:
+    """Provision both clients and fetch their first tokens ahead of traffic."""
+    for getter in (get_collection, get_disbursement):
+        try:
+            getter().authToken()
+        except Exception as e:
+            logger.error(f"Error warming up MoMo client: {e}")
+
+
+def reset() -> None:
+    """Drop cached clients (tests, credential rotation)."""
+    with _lock:
+        _clients.clear()
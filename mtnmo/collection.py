@@ -1,10 +1,16 @@
-import requests
 import json
 import uuid
 import time
 import base64
+import threading
+import httpx
+from asgiref.sync import sync_to_async
+from decouple import config
 from requests.exceptions import RequestException
 
+from core.aio_transport import get_async_client
+from core.transport import get_session
+
 
 class Collection:
     def __init__(self):
@@ -13,19 +19,23 @@ class Collection:
         self.api_user = '22a08097-1b1b-479c-9a05-99eb0b3c1ad2'
         self.environment = 'mtnliberia'
         self.callback_host = 'https://teeket-payments-e225a1f9edcf.herokuapp.com/mtnmo/collection/callback/'
-        self.base_url = 'https://proxy.momoapi.mtn.com'
+        self.base_url = config('MTN_MOMO_BASE_URL', default='https://proxy.momoapi.mtn.com')
         self.auth_token = None  # Store token to reuse it
         self.token_expiry = None  # Track when token expires
+        self._token_lock = threading.Lock()  # One token fetch at a time across threads
         
         # If sandbox environment, use the sandbox URL
         if self.environment == "sandbox":
             self.base_url = "https://sandbox.momodeveloper.mtn.com"
             self.api_user = str(uuid.uuid4())  # Auto-generate user in sandbox mode
 
-        # Create API user
-        self.create_api_user()
-        # Create API key
-        self.create_api_key()
+        # Pooled keep-alive connection shared by every MoMo call to this host
+        self.session = get_session(self.base_url)
+
+        # Create API user and key. Outside the sandbox both are fixed credentials, so the
+        # client is usable even when these calls fail; in the sandbox it is not.
+        provisioned = self.create_api_user() and self.create_api_key()
+        self.provisioned = provisioned or self.environment != "sandbox"
 
         # Create basic auth key for Collections
         self.username, self.password = self.api_user, self.api_key
@@ -44,10 +54,14 @@ class Collection:
             'Ocp-Apim-Subscription-Key': self.collections_primary_key
         }
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = self.session.post(url, headers=headers, data=payload)
+            if response.status_code == 409:  # API user already exists
+                return True
             response.raise_for_status()  # Raise an error for non-200 responses
+            return True
         except RequestException as e:
             print(f"Error creating API user: {str(e)}")
+            return False
 
     def create_api_key(self):
         url = f"{self.base_url}/v1_0/apiuser/{self.api_user}/apikey"
@@ -55,7 +69,7 @@ class Collection:
             'Ocp-Apim-Subscription-Key': self.collections_primary_key
         }
         try:
-            response = requests.post(url, headers=headers)
+            response = self.session.post(url, headers=headers)
             response.raise_for_status()
             response_data = response.json()
             # Auto-generate key in sandbox mode
@@ -63,26 +77,37 @@ class Collection:
                 self.api_key = response_data.get("apiKey", None)
                 if not self.api_key:
                     print("Error: API key not found in response")
+                    return False
+            return True
         except RequestException as e:
             print(f"Error creating API key: {str(e)}")
+            return False
 
     def authToken(self):
         # Check if we have a valid token and it's not expired
         if self.auth_token and self.token_expiry and self.token_expiry > time.time():
             return self.auth_token
 
+        with self._token_lock:
+            # Another thread may have refreshed the token while we waited
+            if self.auth_token and self.token_expiry and self.token_expiry > time.time():
+                return self.auth_token
+            return self._fetch_auth_token()
+
+    def _fetch_auth_token(self):
         url = f"{self.base_url}/collection/token/"
         headers = {
             'Ocp-Apim-Subscription-Key': self.collections_primary_key,
             'Authorization': f"Basic {self.basic_authorisation_collections}"
         }
         try:
-            response = requests.post(url, headers=headers)
+            response = self.session.post(url, headers=headers)
             response.raise_for_status()
             token_data = response.json()
             self.auth_token = token_data.get("access_token", None)
             expires_in = token_data.get("expires_in", 3600)  # Default to 1 hour if not specified
-            self.token_expiry = time.time() + expires_in
+            # Renew a minute early so in-flight requests never carry an expired token
+            self.token_expiry = time.time() + max(int(expires_in) - 60, 0)
 
             if not self.auth_token:
                 print("Error: Access token not found in response")
@@ -93,7 +118,7 @@ class Collection:
             print(f"Error obtaining auth token: {str(e)}")
             return None
 
-    def requestToPay(self, amount, phone_number, external_id, currency, payernote="Teeket", payermessage="Ticket Purchase"):
+    def _request_to_pay_request(self, token, amount, phone_number, external_id, currency, payernote, payermessage):
         uuidgen = str(uuid.uuid4())
         url = f"{self.base_url}/collection/v1_0/requesttopay"
         payload = json.dumps({
@@ -113,17 +138,36 @@ class Collection:
             'X-Callback-Url': self.callback_host,
             'Ocp-Apim-Subscription-Key': self.collections_primary_key,
             'Content-Type': 'application/json',
-            'Authorization': f"Bearer {self.authToken()}"
+            'Authorization': f"Bearer {token}"
         }
+        return uuidgen, url, payload, headers
+
+    def requestToPay(self, amount, phone_number, external_id, currency, payernote="Teeket", payermessage="Ticket Purchase"):
+        uuidgen, url, payload, headers = self._request_to_pay_request(
+            self.authToken(), amount, phone_number, external_id, currency, payernote, payermessage)
 
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = self.session.post(url, headers=headers, data=payload)
             response.raise_for_status()
             return {"status_code": response.status_code, "ref": uuidgen}
         except RequestException as e:
             print(f"Error requesting payment: {str(e)}")
             return {"error": str(e)}
 
+    async def arequestToPay(self, amount, phone_number, external_id, currency, payernote="Teeket", payermessage="Ticket Purchase"):
+        # Async variant for the ASGI request path; token refreshes run off the event loop
+        token = await sync_to_async(self.authToken, thread_sensitive=False)()
+        uuidgen, url, payload, headers = self._request_to_pay_request(
+            token, amount, phone_number, external_id, currency, payernote, payermessage)
+
+        try:
+            response = await get_async_client(self.base_url).post(url, headers=headers, content=payload)
+            response.raise_for_status()
+            return {"status_code": response.status_code, "ref": uuidgen}
+        except httpx.HTTPError as e:
+            print(f"Error requesting payment: {str(e)}")
+            return {"error": str(e)}
+
     def getTransactionStatus(self, txn):
         url = f"{self.base_url}/collection/v1_0/requesttopay/{txn}"
         headers = {
@@ -133,7 +177,7 @@ class Collection:
         }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
@@ -149,7 +193,7 @@ class Collection:
         }
 
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
@@ -1,5 +1,5 @@
 from django.shortcuts import get_object_or_404
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
@@ -7,28 +7,36 @@ from rest_framework import status
 import logging
 from django.views.decorators.csrf import csrf_exempt
 
+from core import idempotency, inbox
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+
 from .models import CollectionTransaction, CollectionCallback
-from .collection import Collection
+from . import listing
+from .clients import get_collection
+from .status_resolver import PENDING, first_poll_at, settle_from_callback
 
 logger = logging.getLogger(__name__)
 
 # Utility functions to store collection transactions
-def store_collection(status_response: dict) -> None:
+def store_pending_collection(ref, amount, phone_number, external_id, currency) -> None:
     try:
-        transaction = CollectionTransaction(
-            financial_transaction_id=status_response.get('financialTransactionId', ''),
-            external_id=status_response.get('externalId', ''),
-            amount=status_response.get('amount', 0),
-            currency=status_response.get('currency', ''),
-            party_id_type=status_response.get('payer', {}).get('partyIdType', ''),
-            party_id=status_response.get('payer', {}).get('partyId', ''),
-            payer_message=status_response.get('payerMessage', ''),
-            payee_note=status_response.get('payeeNote', ''),
-            status=status_response.get('status', ''),
+        transaction = CollectionTransaction.objects.create(
+            ref=ref,
+            external_id=external_id,
+            amount=amount,
+            currency=currency,
+            party_id_type='MSISDN',
+            party_id=phone_number,
+            payer_message="Ticket Purchase",
+            payee_note="Teeket",
+            status=PENDING,
+            next_poll_at=first_poll_at(),
         )
-        transaction.save()
+        rollups.record(Provider.MTN_COLLECTION, transaction.created_at, RollupStatus.PENDING, transaction.amount)
+        ledger.record(LedgerProvider.MTN_COLLECTION, transaction)
     except Exception as e:
-        logger.error(f"Error storing collection transaction: {e}")
+        logger.error(f"Error storing pending collection transaction: {e}")
         raise
 
 # Collection API with secure CSRF handling
@@ -37,7 +45,7 @@ def store_collection(status_response: dict) -> None:
 @permission_classes([AllowAny])
 def collection(request):
     try:
-        coll = Collection()
+        coll = get_collection()
         amount = request.data.get('amount')
         phone_number = request.data.get('phone')
         external_id = request.data.get('external_id')
@@ -47,9 +55,11 @@ def collection(request):
         response = coll.requestToPay(amount, phone_number, external_id, currency)
         # response["Access-Control-Allow-Credentials"] = "true"
 
-        # Fetch the transaction status and store it
-        status_response = coll.getTransactionStatus(response.get('ref', ''))
-        store_collection(status_response)
+        if 'error' in response:
+            return Response({"error": response['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Store as pending; the status resolver polls MTN until the callback or a final status arrives
+        store_pending_collection(response['ref'], amount, phone_number, external_id, currency)
 
         return Response({"status": "success", "response": response}, status=status.HTTP_200_OK)
     except KeyError as e:
@@ -60,28 +70,44 @@ def collection(request):
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # Collection callback handler
+COLLECTION_CALLBACK = 'mtnmo.collection'  # callback inbox kind (core/inbox.py)
+
+
+def apply_collection_callback(data: dict) -> dict:
+    callback = CollectionCallback(
+        financial_transaction_id=data.get('financialTransactionId', ''),
+        external_id=data.get('externalId', ''),
+        amount=data.get('amount', 0),
+        currency=data.get('currency', ''),
+        party_id_type=data.get('payer', {}).get('partyIdType', ''),
+        party_id=data.get('payer', {}).get('partyId', ''),
+        payer_message=data.get('payerMessage', ''),
+        payee_note=data.get('payeeNote', ''),
+        status=data.get('status', ''),
+    )
+    try:
+        with transaction.atomic():
+            if not idempotency.claim(COLLECTION_CALLBACK, callback.external_id):
+                raise IntegrityError('Callback already processed')
+            callback.save()
+            # Same transaction as the claim: if settling fails, MTN's retry is not dropped as a duplicate
+            settle_from_callback(callback.external_id, callback.status, callback.financial_transaction_id)
+    except IntegrityError:
+        logger.info("Duplicate callback received and ignored.")
+        return {"status": "ignored"}
+    return {"status": "success"}
+
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def collection_callback(request):
     try:
-        data = request.data
-        callback = CollectionCallback(
-            financial_transaction_id=data.get('financialTransactionId', ''),
-            external_id=data.get('externalId', ''),
-            amount=data.get('amount', 0),
-            currency=data.get('currency', ''),
-            party_id_type=data.get('payer', {}).get('partyIdType', ''),
-            party_id=data.get('payer', {}).get('partyId', ''),
-            payer_message=data.get('payerMessage', ''),
-            payee_note=data.get('payeeNote', ''),
-            status=data.get('status', ''),
-        )
-        callback.save()
-        return Response({"status": "success"})
-    except IntegrityError:
-        logger.info("Duplicate callback received and ignored.")
-        return Response({"status": "ignored"}, status=status.HTTP_200_OK)
+        if inbox.enabled():
+            # Acknowledge right away; drain_callback_inbox applies it
+            inbox.enqueue(COLLECTION_CALLBACK, request.data)
+            return Response({"status": "accepted"})
+        return Response(apply_collection_callback(request.data))
     except KeyError as e:
         logger.error(f"KeyError in collection callback: {e}")
         return Response({"error": f"Key '{e}' not found in the callback data."}, status=status.HTTP_400_BAD_REQUEST)
@@ -120,22 +146,15 @@ def get_collection_callback(request):
 @permission_classes([AllowAny])
 def get_all_collection_callbacks(request):
     try:
-        callbacks = CollectionCallback.objects.all()
-        callback_list = [
-            {
-                'id': callback.id,
-                'financial_transaction_id': callback.financial_transaction_id,
-                'external_id': callback.external_id,
-                'amount': callback.amount,
-                'currency': callback.currency,
-                'party_id_type': callback.party_id_type,
-                'party_id': callback.party_id,
-                'payer_message': callback.payer_message,
-                'payee_note': callback.payee_note,
-                'status': callback.status,
-            } for callback in callbacks
-        ]
-        return Response({"status": "success", "callbacks": callback_list}, status=status.HTTP_200_OK)
+        params = request.query_params
+        if listing.wants_stream(params):
+            return listing.stream(CollectionCallback.objects.all(), params, 'received_at',
+                                  filename='collection_callbacks.ndjson')
+        result = listing.page(CollectionCallback.objects.all(), params, 'received_at')
+        return Response({"status": "success", "callbacks": result['rows'], "next_cursor": result['next_cursor'],
+                         "has_more": result['has_more']}, status=status.HTTP_200_OK)
+    except listing.InvalidListQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Unexpected error in get_all_collection_callbacks: {e}")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -206,22 +225,15 @@ def get_collection_transaction(request):
 @permission_classes([AllowAny])
 def get_all_collection_transactions(request):
     try:
-        transactions = CollectionTransaction.objects.all()
-        transaction_list = [
-            {
-                'id': transaction.id,
-                'financial_transaction_id': transaction.financial_transaction_id,
-                'external_id': transaction.external_id,
-                'amount': transaction.amount,
-                'currency': transaction.currency,
-                'party_id_type': transaction.party_id_type,
-                'party_id': transaction.party_id,
-                'payer_message': transaction.payer_message,
-                'payee_note': transaction.payee_note,
-                'status': transaction.status,
-            } for transaction in transactions
-        ]
-        return Response({"status": "success", "transactions": transaction_list}, status=status.HTTP_200_OK)
+        params = request.query_params
+        if listing.wants_stream(params):
+            return listing.stream(CollectionTransaction.objects.all(), params, 'created_at',
+                                  filename='collection_transactions.ndjson')
+        result = listing.page(CollectionTransaction.objects.all(), params, 'created_at')
+        return Response({"status": "success", "transactions": result['rows'], "next_cursor": result['next_cursor'],
+                         "has_more": result['has_more']}, status=status.HTTP_200_OK)
+    except listing.InvalidListQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Unexpected error in get_all_collection_transactions: {e}")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1,10 +1,16 @@
 import json
-import requests
 import uuid
 import time
 import base64
+import threading
+import httpx
+from asgiref.sync import sync_to_async
+from decouple import config
 from requests.exceptions import RequestException
 
+from core.aio_transport import get_async_client
+from core.transport import get_session
+
 class Disbursement:
     def __init__(self):
         self.disbursements_primary_key = '6ca46276a5564541a814ef94f364c102'
@@ -12,16 +18,21 @@ class Disbursement:
         self.disbursements_apiuser = '5da52180-5ff2-4090-a6b3-ac194b920fcf'
         self.environment_mode = 'mtnliberia'
         self.callback_url = 'https://teeket-payments-e225a1f9edcf.herokuapp.com/mtnmo/disbursement/callback/'
-        self.base_url = 'https://proxy.momoapi.mtn.com'
+        self.base_url = config('MTN_MOMO_BASE_URL', default='https://proxy.momoapi.mtn.com')
         self.auth_token = None
         self.token_expiry = None
+        self._token_lock = threading.Lock()
 
         if self.environment_mode == "sandbox":
             self.base_url = "https://sandbox.momodeveloper.mtn.com"
             self.disbursements_apiuser = str(uuid.uuid4())
 
-        self.create_api_user()
-        self.create_api_key()
+        self.session = get_session(self.base_url)
+
+        # Outside the sandbox the API user and key are fixed credentials, so the client is
+        # usable even when these calls fail; in the sandbox it is not.
+        provisioned = self.create_api_user() and self.create_api_key()
+        self.provisioned = provisioned or self.environment_mode != "sandbox"
 
         self.username, self.password = self.disbursements_apiuser, self.api_key_disbursements
         self.basic_authorisation_disbursements = base64.b64encode(
@@ -39,10 +50,14 @@ class Disbursement:
             'Ocp-Apim-Subscription-Key': self.disbursements_primary_key
         }
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = self.session.post(url, headers=headers, data=payload)
+            if response.status_code == 409:  # API user already exists
+                return True
             response.raise_for_status()
+            return True
         except RequestException as e:
             print(f"Error creating API user: {str(e)}")
+            return False
 
     def create_api_key(self):
         url = f"{self.base_url}/v1_0/apiuser/{self.disbursements_apiuser}/apikey"
@@ -50,32 +65,41 @@ class Disbursement:
             'Ocp-Apim-Subscription-Key': self.disbursements_primary_key
         }
         try:
-            response = requests.post(url, headers=headers)
+            response = self.session.post(url, headers=headers)
             response.raise_for_status()
             response_data = response.json()
             if self.environment_mode == "sandbox":
                 self.api_key_disbursements = response_data.get("apiKey", None)
                 if not self.api_key_disbursements:
                     print("Error: API key not found in response")
+                    return False
+            return True
         except RequestException as e:
             print(f"Error creating API key: {str(e)}")
+            return False
 
     def authToken(self):
         if self.auth_token and self.token_expiry and self.token_expiry > time.time():
             return self.auth_token
 
+        with self._token_lock:
+            if self.auth_token and self.token_expiry and self.token_expiry > time.time():
+                return self.auth_token
+            return self._fetch_auth_token()
+
+    def _fetch_auth_token(self):
         url = f"{self.base_url}/disbursement/token/"
         headers = {
             'Ocp-Apim-Subscription-Key': self.disbursements_primary_key,
             'Authorization': f"Basic {self.basic_authorisation_disbursements}"
         }
         try:
-            response = requests.post(url, headers=headers)
+            response = self.session.post(url, headers=headers)
             response.raise_for_status()
             token_data = response.json()
             self.auth_token = token_data.get("access_token", None)
             expires_in = token_data.get("expires_in", 3600)
-            self.token_expiry = time.time() + expires_in
+            self.token_expiry = time.time() + max(int(expires_in) - 60, 0)
 
             if not self.auth_token:
                 print("Error: Access token not found in response")
@@ -93,15 +117,16 @@ class Disbursement:
             'X-Target-Environment': self.environment_mode,
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
             print(f"Error getting balance: {str(e)}")
             return {"error": str(e)}
 
-    def transfer(self, amount, phone_number, external_id, currency="USD", payermessage="Teeket disbursement", payernote="Teeket"):
-        uuidgen = str(uuid.uuid4())
+    def _transfer_request(self, token, amount, phone_number, external_id, currency, payermessage, payernote,
+                          ref=None):
+        uuidgen = str(ref or uuid.uuid4())
         url = f"{self.base_url}/disbursement/v1_0/transfer"
         payload = json.dumps({
             "amount": amount,
@@ -120,15 +145,38 @@ class Disbursement:
             'X-Callback-Url': self.callback_url,
             'Ocp-Apim-Subscription-Key': self.disbursements_primary_key,
             'Content-Type': 'application/json',
-            'Authorization': f"Bearer {self.authToken()}"
+            'Authorization': f"Bearer {token}"
         }
+        return uuidgen, url, payload, headers
+
+    def transfer(self, amount, phone_number, external_id, currency="USD", payermessage="Teeket disbursement", payernote="Teeket",
+                 ref=None):
+        # ref (X-Reference-Id) may be chosen by the caller so a retried transfer is recognised by MTN (409)
+        uuidgen, url, payload, headers = self._transfer_request(
+            self.authToken(), amount, phone_number, external_id, currency, payermessage, payernote, ref)
         try:
-            response = requests.post(url, headers=headers, data=payload)
+            response = self.session.post(url, headers=headers, data=payload)
             response.raise_for_status()
             return {"response": response.status_code, "ref": uuidgen}
         except RequestException as e:
             print(f"Error requesting transfer: {str(e)}")
-            return {"error": str(e)}
+            # The ref is kept: after a timeout or 5xx MTN may still have accepted the transfer
+            return {"error": str(e), "ref": uuidgen,
+                    "response": e.response.status_code if e.response is not None else None}
+
+    async def atransfer(self, amount, phone_number, external_id, currency="USD", payermessage="Teeket disbursement", payernote="Teeket",
+                        ref=None):
+        token = await sync_to_async(self.authToken, thread_sensitive=False)()
+        uuidgen, url, payload, headers = self._transfer_request(
+            token, amount, phone_number, external_id, currency, payermessage, payernote, ref)
+        try:
+            response = await get_async_client(self.base_url).post(url, headers=headers, content=payload)
+            response.raise_for_status()
+            return {"response": response.status_code, "ref": uuidgen}
+        except httpx.HTTPError as e:
+            print(f"Error requesting transfer: {str(e)}")
+            status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            return {"error": str(e), "ref": uuidgen, "response": status_code}
 
     def getTransactionStatus(self, txn_ref):
         url = f"{self.base_url}/disbursement/v1_0/transfer/{txn_ref}"
@@ -138,7 +186,7 @@ class Disbursement:
             'X-Target-Environment': self.environment_mode
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
             returneddata = response.json()
             return {
@@ -1,14 +1,22 @@
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 import logging
 import json
 import uuid
 
-from .models import DisbursementTransaction, DisbursementCallback
-from .disbursement import Disbursement
+from core import idempotency, inbox
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider
+from reporting.rollups import mtn_status
+
+from .models import DisbursementTransaction, DisbursementCallback, DisbursementBatch
+from . import listing
+from .clients import get_disbursement
+from .bulk_disbursement import BulkDisbursement, settle_from_callback
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +41,9 @@ def store_disbursement(response_data: dict) -> None:
             status=data.get('status', ''),
         )
         disbursement.save()
+        rollups.record(Provider.MTN_DISBURSEMENT, disbursement.created_at, mtn_status(disbursement.status),
+                       disbursement.amount)
+        ledger.record(LedgerProvider.MTN_DISBURSEMENT, disbursement)
     except Exception as e:
         logger.error(f"Error storing disbursement transaction: {e}")
         raise
@@ -44,7 +55,7 @@ def store_disbursement(response_data: dict) -> None:
 @permission_classes([AllowAny])
 def disbursement(request):
     try:
-        disbur = Disbursement()
+        disbur = get_disbursement()
         amount = request.data.get('amount')
         phone_number = request.data.get('phone')
         external_id = request.data.get('external_id')
@@ -70,31 +81,102 @@ def disbursement(request):
         logger.error(f"Unexpected error in disbursement: {e}")
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Bulk disbursement: validate payees and answer with the batch; process_disbursement_batches sends it
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def disbursement_batch(request):
+    try:
+        payees = request.data.get('payees')
+        if not isinstance(payees, list) or not payees:
+            return Response({"error": "'payees' must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch, _ = BulkDisbursement().create_batch(
+            payees,
+            currency=request.data.get('currency', 'USD'),
+            payer_message=request.data.get('payer_message', 'Teeket disbursement'),
+            payee_note=request.data.get('payee_note', 'Teeket'),
+        )
+
+        return Response({"status": "accepted", "batch": batch_data(batch)}, status=status.HTTP_202_ACCEPTED)
+    except Exception as e:
+        logger.error(f"Unexpected error in disbursement batch: {e}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_disbursement_batch(request, id):
+    batch = get_object_or_404(DisbursementBatch, id=id)
+    return Response(batch_data(batch), status=status.HTTP_200_OK)
+
+
+def batch_data(batch):
+    return {
+        'id': batch.id,
+        'status': batch.status,
+        'currency': batch.currency,
+        'total_count': batch.total_count,
+        'total_amount': str(batch.total_amount),
+        'submitted_count': batch.submitted_count,
+        'rejected_count': batch.rejected_count,
+        'successful_count': batch.successful_count,
+        'failed_count': batch.failed_count,
+        'errors': batch.errors,
+        'created_at': batch.created_at,
+        'completed_at': batch.completed_at,
+    }
+
 # Disbursement callback handler
 
 
+DISBURSEMENT_CALLBACK = 'mtnmo.disbursement'  # callback inbox kind (core/inbox.py)
+
+
+def disbursement_callback_key(data: dict) -> str:
+    """Dedup key for a delivery: MTN's financialTransactionId, or ref + status when it has none (failures)."""
+    body = data.get('data', {})
+    return body.get('financialTransactionId') or f"{data.get('ref', '')}:{body.get('status', '')}"
+
+
+def apply_disbursement_callback(data: dict) -> dict:
+    with transaction.atomic():
+        if not idempotency.claim(DISBURSEMENT_CALLBACK, disbursement_callback_key(data)):
+            logger.info("Duplicate disbursement callback received and ignored.")
+            return {"status": "ignored"}
+        return _store_disbursement_callback(data)
+
+
+def _store_disbursement_callback(data: dict) -> dict:
+    callback = DisbursementCallback(
+        response=data.get('response', ''),
+        ref=data.get('ref', ''),
+        amount=data.get('data', {}).get('amount', 0),
+        currency=data.get('data', {}).get('currency', ''),
+        financial_transaction_id=data.get(
+            'data', {}).get('financialTransactionId', ''),
+        external_id=data.get('data', {}).get('externalId', ''),
+        party_id_type=data.get('data', {}).get(
+            'payee', {}).get('partyIdType', ''),
+        party_id=data.get('data', {}).get('payee', {}).get('partyId', ''),
+        payer_message=data.get('data', {}).get('payerMessage', ''),
+        payee_note=data.get('data', {}).get('payeeNote', ''),
+        status=data.get('data', {}).get('status', ''),
+    )
+    callback.save()
+    # Batch transfers are settled (and their batch completed) from the callback
+    settle_from_callback(callback.ref, callback.external_id, callback.status, callback.financial_transaction_id)
+    return {"status": "success"}
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def disbursement_callback(request):
     try:
-        data = request.data
-        callback = DisbursementCallback(
-            response=data.get('response', ''),
-            ref=data.get('ref', ''),
-            amount=data.get('data', {}).get('amount', 0),
-            currency=data.get('data', {}).get('currency', ''),
-            financial_transaction_id=data.get(
-                'data', {}).get('financialTransactionId', ''),
-            external_id=data.get('data', {}).get('externalId', ''),
-            party_id_type=data.get('data', {}).get(
-                'payee', {}).get('partyIdType', ''),
-            party_id=data.get('data', {}).get('payee', {}).get('partyId', ''),
-            payer_message=data.get('data', {}).get('payerMessage', ''),
-            payee_note=data.get('data', {}).get('payeeNote', ''),
-            status=data.get('data', {}).get('status', ''),
-        )
-        callback.save()
-        return Response({"status": "success"})
+        if inbox.enabled():
+            # Acknowledge right away; drain_callback_inbox applies it
+            inbox.enqueue(DISBURSEMENT_CALLBACK, request.data)
+            return Response({"status": "accepted"})
+        return Response(apply_disbursement_callback(request.data))
     except KeyError as e:
         logger.error(f"KeyError in disbursement callback: {e}")
         return Response({"error": f"Key '{e}' not found in the callback data."}, status=status.HTTP_400_BAD_REQUEST)
@@ -138,22 +220,15 @@ def get_disbursement_callback(request):
 @permission_classes([AllowAny])
 def get_all_disbursement_callbacks(request):
     try:
-        callbacks = DisbursementCallback.objects.all()
-        callback_list = [
-            {
-                'id': callback.id,
-                'financial_transaction_id': callback.financial_transaction_id,
-                'external_id': callback.external_id,
-                'amount': callback.amount,
-                'currency': callback.currency,
-                'party_id_type': callback.party_id_type,
-                'party_id': callback.party_id,
-                'payer_message': callback.payer_message,
-                'payee_note': callback.payee_note,
-                'status': callback.status,
-            } for callback in callbacks
-        ]
-        return Response({"status": "success", "callbacks": callback_list}, status=status.HTTP_200_OK)
+        params = request.query_params
+        if listing.wants_stream(params):
+            return listing.stream(DisbursementCallback.objects.all(), params, 'received_at',
+                                  filename='disbursement_callbacks.ndjson')
+        result = listing.page(DisbursementCallback.objects.all(), params, 'received_at')
+        return Response({"status": "success", "callbacks": result['rows'], "next_cursor": result['next_cursor'],
+                         "has_more": result['has_more']}, status=status.HTTP_200_OK)
+    except listing.InvalidListQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(
             f"Unexpected error in get_all_disbursement_callbacks: {e}")
@@ -239,22 +314,15 @@ def get_disbursement_transaction(request):
 @permission_classes([AllowAny])
 def get_all_disbursement_transactions(request):
     try:
-        transactions = DisbursementTransaction.objects.all()
-        transaction_list = [
-            {
-                'id': transaction.id,
-                'financial_transaction_id': transaction.financial_transaction_id,
-                'external_id': transaction.external_id,
-                'amount': transaction.amount,
-                'currency': transaction.currency,
-                'party_id_type': transaction.party_id_type,
-                'party_id': transaction.party_id,
-                'payer_message': transaction.payer_message,
-                'payee_note': transaction.payee_note,
-                'status': transaction.status,
-            } for transaction in transactions
-        ]
-        return Response({"status": "success", "transactions": transaction_list}, status=status.HTTP_200_OK)
+        params = request.query_params
+        if listing.wants_stream(params):
+            return listing.stream(DisbursementTransaction.objects.all(), params, 'created_at',
+                                  filename='disbursement_transactions.ndjson')
+        result = listing.page(DisbursementTransaction.objects.all(), params, 'created_at')
+        return Response({"status": "success", "transactions": result['rows'], "next_cursor": result['next_cursor'],
+                         "has_more": result['has_more']}, status=status.HTTP_200_OK)
+    except listing.InvalidListQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(
             f"Unexpected error in get_all_disbursement_transactions: {e}")
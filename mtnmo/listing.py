@@ -0,0 +1,95 @@
+"""
+Paginated and streaming lists of MoMo transactions and callbacks
+
+Rows are read newest first with a keyset filter on id (cursor = the last id
+of the previous page), projected with .values() so no model instances are
+built, and either returned a page at a time or streamed as NDJSON from a
+server-side cursor (.iterator(chunk_size)) for full exports. Memory stays
+flat either way, however large the table.
+
+Query parameters shared by every list endpoint:
+
+    status      exact status, e.g. SUCCESSFUL
+    party_id    payer / payee MSISDN
+    from, to    date or datetime bounds on created_at (received_at for callbacks), inclusive
+    limit       page size, default 100, at most MAX_PAGE_SIZE
+    cursor      next_cursor from the previous page
+    stream=1    NDJSON export of every matching row (limit is ignored)
+"""
+from datetime import datetime, time
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 2000
+
+LIST_FIELDS = ('id', 'financial_transaction_id', 'external_id', 'amount', 'currency', 'party_id_type', 'party_id',
+               'payer_message', 'payee_note', 'status')
+
+
+class InvalidListQuery(ValueError):
+    pass
+
+
+def _bound(value, end_of_day):
+    """Aware datetime from a from/to parameter; a bare date covers the whole day."""
+    try:
+        day = parse_date(value)
+        moment = datetime.combine(day, time.max if end_of_day else time.min) if day else parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise InvalidListQuery(f"Invalid date '{value}'")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filtered(queryset, params, date_field):
+    """Apply the status / party_id / from / to filters; raises InvalidListQuery."""
+    filters = {}
+    if params.get('status'):
+        filters['status'] = params['status']
+    if params.get('party_id'):
+        filters['party_id'] = params['party_id']
+    if params.get('from'):
+        filters[f'{date_field}__gte'] = _bound(params['from'], end_of_day=False)
+    if params.get('to'):
+        filters[f'{date_field}__lte'] = _bound(params['to'], end_of_day=True)
+    if params.get('cursor'):
+        try:
+            filters['id__lt'] = int(params['cursor'])
+        except ValueError:
+            raise InvalidListQuery('Invalid cursor')
+    return queryset.filter(**filters).order_by('-id')
+
+
+def page(queryset, params, date_field, fields=LIST_FIELDS):
+    """One page of rows plus next_cursor / has_more."""
+    try:
+        limit = max(1, min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        raise InvalidListQuery('limit must be an integer')
+    rows = list(filtered(queryset, params, date_field).values(*fields)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {'rows': rows, 'next_cursor': str(rows[-1]['id']) if has_more else None, 'has_more': has_more}
+
+
+def stream(queryset, params, date_field, fields=LIST_FIELDS, filename='export.ndjson'):
+    """StreamingHttpResponse with one JSON object per matching row."""
+    rows = filtered(queryset, params, date_field).values(*fields).iterator(chunk_size=STREAM_CHUNK_SIZE)
+    encoder = JSONEncoder()  # same encoding as the paged JSON responses
+    response = StreamingHttpResponse((encoder.encode(row) + '\n' for row in rows),
+                                     content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def wants_stream(params):
+    return params.get('stream') in ('1', 'true', 'ndjson')
+
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from mtnmo.bulk_disbursement import BulkDisbursement
+
+
+class Command(BaseCommand):
+    help = 'Send the transfers of bulk disbursement batches queued through the API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep when no batch is pending')
+        parser.add_argument('--batch-id', type=int, help='Run (or rerun an interrupted) batch by id. Transfers '
+                                                         'MTN already accepted are recognised by their ref')
+        parser.add_argument('--workers', type=int, help='Concurrent transfers (MTNMO_BULK_WORKERS)')
+        parser.add_argument('--rate', type=float, help='Max transfers per second (MTNMO_BULK_RATE)')
+
+    def handle(self, *args, **options):
+        bulk = BulkDisbursement(workers=options['workers'], rate=options['rate'])
+        if options['daemon']:
+            self.stdout.write('Processing disbursement batches (Ctrl+C to stop)...')
+            try:
+                bulk.run_forever(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        batch = bulk.run_next(options['batch_id'])
+        if batch is None:
+            self.stdout.write('No pending disbursement batch')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Batch {batch.pk} {batch.status}: {batch.submitted_count} submitted, {batch.rejected_count} rejected'
+        ))
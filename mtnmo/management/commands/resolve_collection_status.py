@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from mtnmo.status_resolver import CollectionStatusResolver
+
+
+class Command(BaseCommand):
+    help = 'Poll MTN for pending collections with exponential backoff until a final status or callback arrives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--daemon', action='store_true', help='Keep running instead of processing one batch')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to sleep when no rows are due')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent status requests per batch')
+        parser.add_argument('--max-attempts', type=int, default=12)
+
+    def handle(self, *args, **options):
+        resolver = CollectionStatusResolver(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            max_attempts=options['max_attempts'],
+        )
+        if options['daemon']:
+            self.stdout.write('Resolving pending collections (Ctrl+C to stop)...')
+            try:
+                resolver.run_forever(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        processed = resolver.run_once()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} pending collection(s)'))
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.4 on 2026-10-17 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collectiontransaction',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='collectiontransaction',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='collectiontransaction',
+            name='poll_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='collectiontransaction',
+            name='ref',
+            field=models.CharField(blank=True, max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name='collectiontransaction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='collectiontransaction',
+            index=models.Index(fields=['status', 'next_poll_at'], name='mtnmo_colle_status_2576da_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.4 on 2026-10-17 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0003_disbursement_batches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='collectiontransaction',
+            name='external_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='collectiontransaction',
+            name='financial_transaction_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='collectiontransaction',
+            name='ref',
+            field=models.CharField(blank=True, max_length=36, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='disbursementcallback',
+            name='external_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='disbursementcallback',
+            name='ref',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='disbursementtransaction',
+            name='external_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='disbursementtransaction',
+            name='financial_transaction_id',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='disbursementtransaction',
+            name='ref',
+            field=models.UUIDField(unique=True),
+        ),
+    ]
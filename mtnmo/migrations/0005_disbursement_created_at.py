@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0004_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disbursementtransaction',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
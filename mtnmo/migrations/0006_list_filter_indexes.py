@@ -0,0 +1,45 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0005_disbursement_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectioncallback',
+            index=models.Index(fields=['status', '-id'], name='mtnmo_colcb_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectioncallback',
+            index=models.Index(fields=['party_id', '-id'], name='mtnmo_colcb_party_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectiontransaction',
+            index=models.Index(fields=['status', '-id'], name='mtnmo_coltx_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='collectiontransaction',
+            index=models.Index(fields=['party_id', '-id'], name='mtnmo_coltx_party_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementcallback',
+            index=models.Index(fields=['status', '-id'], name='mtnmo_discb_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementcallback',
+            index=models.Index(fields=['party_id', '-id'], name='mtnmo_discb_party_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementtransaction',
+            index=models.Index(fields=['status', '-id'], name='mtnmo_distx_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementtransaction',
+            index=models.Index(fields=['party_id', '-id'], name='mtnmo_distx_party_idx'),
+        ),
+    ]
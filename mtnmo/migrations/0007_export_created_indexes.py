@@ -0,0 +1,21 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0006_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='collectiontransaction',
+            index=models.Index(fields=['created_at', 'id'], name='mtnmo_coltx_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='disbursementtransaction',
+            index=models.Index(fields=['created_at', 'id'], name='mtnmo_distx_created_idx'),
+        ),
+    ]
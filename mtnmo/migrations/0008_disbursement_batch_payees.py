@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mtnmo', '0007_export_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disbursementbatch',
+            name='payees',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,8 +1,8 @@
 from django.db import models
 
 class CollectionTransaction(models.Model):
-    financial_transaction_id = models.CharField(max_length=100, blank=True, null=True)
-    external_id = models.CharField(max_length=100, blank=True, null=True)
+    financial_transaction_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    external_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, blank=True, null=True)
     party_id_type = models.CharField(max_length=50, blank=True, null=True)
@@ -11,18 +11,81 @@ class CollectionTransaction(models.Model):
     payee_note = models.TextField(blank=True, null=True)
     status = models.CharField(max_length=50, blank=True, null=True)
 
+    # Background status resolution (see status_resolver.py)
+    ref = models.CharField(max_length=36, blank=True, null=True, unique=True)  # X-Reference-Id sent with requestToPay
+    poll_attempts = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField(blank=True, null=True)  # None once resolved or given up
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_poll_at']),
+            # Keyset-paginated list filters (listing.py)
+            models.Index(fields=['status', '-id'], name='mtnmo_coltx_status_idx'),
+            models.Index(fields=['party_id', '-id'], name='mtnmo_coltx_party_idx'),
+            # Date-windowed ledger export (reporting/export.py)
+            models.Index(fields=['created_at', 'id'], name='mtnmo_coltx_created_idx'),
+        ]
+
+class DisbursementBatch(models.Model):
+    """Progress of a bulk disbursement (see bulk_disbursement.py).
+
+    submitted/rejected are counted at dispatch; successful/failed as
+    DisbursementCallbacks arrive. The batch is COMPLETED once every transfer
+    is accounted for. payees holds the validated rows, each with the
+    X-Reference-Id it is sent with, so an interrupted batch can be rerun.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('SUBMITTED', 'Submitted'),
+        ('COMPLETED', 'Completed'),
+    ]
+
+    currency = models.CharField(max_length=3)
+    payer_message = models.CharField(max_length=100, blank=True, null=True)
+    payee_note = models.CharField(max_length=100, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    submitted_count = models.PositiveIntegerField(default=0)
+    rejected_count = models.PositiveIntegerField(default=0)
+    successful_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    payees = models.JSONField(default=list, blank=True)  # [{row, phone, amount, external_id, ref}]
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Batch {self.pk} - {self.status}"
+
 class DisbursementTransaction(models.Model):
     response = models.IntegerField(blank=True, null=True)
-    ref = models.UUIDField()
+    ref = models.UUIDField(unique=True)  # X-Reference-Id sent with transfer
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, blank=True, null=True)
-    financial_transaction_id = models.CharField(max_length=100)
-    external_id = models.CharField(max_length=100)
+    financial_transaction_id = models.CharField(max_length=100, db_index=True)
+    external_id = models.CharField(max_length=100, db_index=True)
     party_id_type = models.CharField(max_length=50, blank=True, null=True)
     party_id = models.CharField(max_length=50)
     payer_message = models.CharField(max_length=100, blank=True, null=True)
     payee_note = models.CharField(max_length=100, blank=True, null=True)
     status = models.CharField(max_length=50)
+    batch = models.ForeignKey(DisbursementBatch, blank=True, null=True, on_delete=models.SET_NULL,
+                              related_name='transactions')
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Keyset-paginated list filters (listing.py)
+            models.Index(fields=['status', '-id'], name='mtnmo_distx_status_idx'),
+            models.Index(fields=['party_id', '-id'], name='mtnmo_distx_party_idx'),
+            # Date-windowed ledger export (reporting/export.py)
+            models.Index(fields=['created_at', 'id'], name='mtnmo_distx_created_idx'),
+        ]
 
 class CollectionCallback(models.Model):
     financial_transaction_id = models.CharField(max_length=255)
@@ -36,16 +99,23 @@ class CollectionCallback(models.Model):
     status = models.CharField(max_length=50)
     received_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset-paginated list filters (listing.py)
+            models.Index(fields=['status', '-id'], name='mtnmo_colcb_status_idx'),
+            models.Index(fields=['party_id', '-id'], name='mtnmo_colcb_party_idx'),
+        ]
+
     def __str__(self):
         return f"{self.financial_transaction_id} - {self.status}"
 
 class DisbursementCallback(models.Model):
     response = models.CharField(max_length=255)
-    ref = models.CharField(max_length=255)
+    ref = models.CharField(max_length=255, db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10)
     financial_transaction_id = models.CharField(max_length=255)
-    external_id = models.CharField(max_length=255)
+    external_id = models.CharField(max_length=255, db_index=True)
     party_id_type = models.CharField(max_length=50)
     party_id = models.CharField(max_length=255)
     payer_message = models.TextField(blank=True)
@@ -53,5 +123,12 @@ class DisbursementCallback(models.Model):
     status = models.CharField(max_length=50)
     received_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset-paginated list filters (listing.py)
+            models.Index(fields=['status', '-id'], name='mtnmo_discb_status_idx'),
+            models.Index(fields=['party_id', '-id'], name='mtnmo_discb_party_idx'),
+        ]
+
     def __str__(self):
         return f"{self.ref} - {self.status}"
@@ -0,0 +1,165 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from reporting import ledger, rollups
+from reporting.models import LedgerProvider, Provider, RollupStatus
+from reporting.rollups import mtn_status
+
+from .clients import get_collection
+from .models import CollectionTransaction, CollectionCallback
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'PENDING'
+INITIAL_POLL_DELAY = 5  # seconds between requestToPay acceptance and the first status check
+
+
+def first_poll_at():
+    """When a freshly accepted requestToPay should first be polled."""
+    return timezone.now() + timedelta(seconds=INITIAL_POLL_DELAY)
+
+
+class CollectionStatusResolver:
+    """Resolves pending collections outside the request path.
+
+    Each pass picks due PENDING rows, settles the ones whose CollectionCallback has
+    already arrived, polls MTN for the rest on a small thread pool, and writes all
+    changes back with a single bulk_update, skipping rows a callback settled in the
+    meantime (settle_from_callback). Rows still pending are rescheduled with
+    exponential backoff until max_attempts, after which polling stops.
+    """
+
+    UPDATE_FIELDS = ['status', 'financial_transaction_id', 'poll_attempts', 'next_poll_at', 'updated_at']
+
+    def __init__(self, batch_size=100, workers=8, base_delay=INITIAL_POLL_DELAY, max_delay=600, max_attempts=12,
+                 client=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.client = client
+
+    def backoff(self, attempts):
+        return timedelta(seconds=min(self.base_delay * (2 ** attempts), self.max_delay))
+
+    def due(self):
+        return (
+            CollectionTransaction.objects
+            .filter(status=PENDING, next_poll_at__lte=timezone.now())
+            .exclude(ref__isnull=True)
+            .order_by('next_poll_at')[:self.batch_size]
+        )
+
+    def run_once(self):
+        """Process one batch; returns the number of rows examined."""
+        transactions = list(self.due())
+        if not transactions:
+            return 0
+
+        now = timezone.now()
+        previous = {txn.pk: txn.status for txn in transactions}
+        callbacks = {
+            cb['external_id']: cb
+            for cb in CollectionCallback.objects.filter(
+                external_id__in=[t.external_id for t in transactions if t.external_id]
+            ).values('external_id', 'status', 'financial_transaction_id')
+        }
+
+        to_poll = []
+        for txn in transactions:
+            callback = callbacks.get(txn.external_id)
+            if callback:
+                # Callback already landed: it is the source of truth, stop polling
+                txn.status = callback['status'] or txn.status
+                txn.financial_transaction_id = callback['financial_transaction_id'] or txn.financial_transaction_id
+                txn.next_poll_at = None
+            else:
+                to_poll.append(txn)
+
+        if to_poll:
+            client = self.client or get_collection()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(lambda t: client.getTransactionStatus(t.ref), to_poll))
+            for txn, result in zip(to_poll, results):
+                self._apply(txn, result, now)
+
+        with transaction.atomic():
+            # A callback may have settled rows while MTN was being polled; those are left as it wrote them
+            pending = set(
+                CollectionTransaction.objects.select_for_update()
+                .filter(pk__in=[t.pk for t in transactions], status=PENDING)
+                .values_list('pk', flat=True)
+            )
+            updated = [t for t in transactions if t.pk in pending]
+            for txn in updated:
+                txn.updated_at = now
+            CollectionTransaction.objects.bulk_update(updated, self.UPDATE_FIELDS)
+            rollups.transitions(Provider.MTN_COLLECTION, (
+                (t.created_at, None, mtn_status(previous[t.pk]), mtn_status(t.status), t.amount, None)
+                for t in updated
+            ))
+            ledger.transitions(LedgerProvider.MTN_COLLECTION, ((t, mtn_status(previous[t.pk])) for t in updated))
+        return len(transactions)
+
+    def _apply(self, txn, result, now):
+        remote_status = (result or {}).get('status')
+        if remote_status and remote_status != PENDING:
+            txn.status = remote_status
+            txn.financial_transaction_id = result.get('financialTransactionId') or txn.financial_transaction_id
+            txn.next_poll_at = None
+            return
+
+        if 'error' in (result or {}):
+            logger.warning(f"Status check failed for collection {txn.ref}: {result['error']}")
+
+        txn.poll_attempts += 1
+        if txn.poll_attempts >= self.max_attempts:
+            logger.info(f"Giving up polling collection {txn.ref} after {txn.poll_attempts} attempts")
+            txn.next_poll_at = None
+        else:
+            txn.next_poll_at = now + self.backoff(txn.poll_attempts)
+
+    def run_forever(self, interval=2, stop_event=None):
+        """Daemon loop: drain due rows, then sleep until the next tick."""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                processed = self.run_once()
+            except Exception as e:
+                logger.error(f"Error resolving collection statuses: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                stop_event.wait(interval)
+
+
+def settle_from_callback(external_id, status, financial_transaction_id=None):
+    """Apply a CollectionCallback to its pending transaction and stop polling it."""
+    if not external_id:
+        return 0
+    fields = {'status': status, 'next_poll_at': None, 'updated_at': timezone.now()}
+    if financial_transaction_id:
+        fields['financial_transaction_id'] = financial_transaction_id
+    with transaction.atomic():
+        settled = list(
+            CollectionTransaction.objects.select_for_update()
+            .filter(external_id=external_id, status=PENDING)
+            .values('pk', 'created_at', 'amount', 'currency', 'external_id')
+        )
+        if not settled:
+            return 0
+        CollectionTransaction.objects.filter(pk__in=[row['pk'] for row in settled]).update(**fields)
+        rollups.transitions(Provider.MTN_COLLECTION, (
+            (row['created_at'], None, RollupStatus.PENDING, mtn_status(status), row['amount'], None)
+            for row in settled
+        ))
+        ledger.transitions(LedgerProvider.MTN_COLLECTION, (
+            ({**row, 'id': row['pk'], 'status': status}, RollupStatus.PENDING) for row in settled
+        ))
+    return len(settled)
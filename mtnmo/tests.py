@@ -1,3 +1,250 @@
-from django.test import TestCase
+import json
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from core import idempotency
+from . import clients
+from .collection_views import apply_collection_callback
+from .collection import Collection
+from .bulk_disbursement import BulkDisbursement, settle_from_callback
+from .models import CollectionTransaction, CollectionCallback, DisbursementBatch, DisbursementCallback
+from .status_resolver import PENDING, CollectionStatusResolver, settle_from_callback as settle_collection
+from reporting.models import DailyRollup, LedgerEntry, LedgerStatus, RollupStatus
+
+
+@mock.patch.object(Collection, 'create_api_key')
+@mock.patch.object(Collection, 'create_api_user')
+class ClientRegistryTests(SimpleTestCase):
+    def setUp(self):
+        clients.reset()
+
+    def tearDown(self):
+        clients.reset()
+
+    def test_collection_is_provisioned_once(self, create_user, create_key):
+        instances = []
+        threads = [threading.Thread(target=lambda: instances.append(clients.get_collection())) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len({id(i) for i in instances}), 1)
+        self.assertEqual(create_user.call_count, 1)
+        self.assertEqual(create_key.call_count, 1)
+
+    def test_failed_provisioning_is_not_cached(self, create_user, create_key):
+        outcomes = [False, True]
+        factory = lambda: mock.Mock(provisioned=outcomes.pop(0))
+
+        with self.assertRaises(clients.ProvisioningError):
+            clients._get_client('stub', factory)
+        client = clients._get_client('stub', factory)  # retried, then kept
+        self.assertTrue(client.provisioned)
+        self.assertIs(clients._get_client('stub', factory), client)
+
+    def test_token_is_fetched_once_and_reused(self, create_user, create_key):
+        coll = clients.get_collection()
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'access_token': 'momo-token', 'expires_in': 3600}
+
+        def slow_post(*args, **kwargs):
+            time.sleep(0.05)
+            return response
+
+        with mock.patch.object(coll, 'session') as session:
+            session.post.side_effect = slow_post
+            tokens = []
+            threads = [threading.Thread(target=lambda: tokens.append(coll.authToken())) for _ in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # Later requests reuse the registry instance and its token
+            self.assertEqual(clients.get_collection().authToken(), 'momo-token')
+
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(set(tokens), {'momo-token'})
+
+
+class CollectionStatusResolverTests(TestCase):
+    def _pending(self, ref, external_id):
+        return CollectionTransaction.objects.create(
+            ref=ref, external_id=external_id, amount=10, currency='LRD', party_id='231770000000',
+            status=PENDING, next_poll_at=timezone.now() - timedelta(seconds=1),
+        )
+
+    def test_run_once_resolves_and_reschedules_in_bulk(self):
+        done = self._pending('ref-done', 'ext-done')
+        waiting = self._pending('ref-wait', 'ext-wait')
+        called_back = self._pending('ref-cb', 'ext-cb')
+        CollectionCallback.objects.create(
+            financial_transaction_id='ft-cb', external_id='ext-cb', amount=10, currency='LRD',
+            party_id_type='MSISDN', party_id='231770000000', status='SUCCESSFUL',
+        )
+        client = mock.Mock()
+        client.getTransactionStatus.side_effect = lambda ref: (
+            {'status': 'SUCCESSFUL', 'financialTransactionId': 'ft-done'} if ref == 'ref-done' else {'status': 'PENDING'}
+        )
+
+        processed = CollectionStatusResolver(client=client).run_once()
+
+        self.assertEqual(processed, 3)
+        # The callback settled its row without an upstream call
+        polled = sorted(c.args[0] for c in client.getTransactionStatus.call_args_list)
+        self.assertEqual(polled, ['ref-done', 'ref-wait'])
+
+        done.refresh_from_db()
+        waiting.refresh_from_db()
+        called_back.refresh_from_db()
+        self.assertEqual((done.status, done.financial_transaction_id, done.next_poll_at), ('SUCCESSFUL', 'ft-done', None))
+        self.assertEqual((called_back.status, called_back.next_poll_at), ('SUCCESSFUL', None))
+        self.assertEqual(waiting.status, PENDING)
+        self.assertEqual(waiting.poll_attempts, 1)
+        self.assertGreater(waiting.next_poll_at, timezone.now())
+
+
+    def test_callback_during_poll_is_not_overwritten(self):
+        txn = self._pending('ref-race', 'ext-race')
+        due = CollectionStatusResolver.due
+
+        def due_then_callback(resolver):
+            rows = list(due(resolver))
+            settle_collection('ext-race', 'SUCCESSFUL', 'ft-race')  # lands while MTN is being polled
+            return rows
+
+        client = mock.Mock()
+        client.getTransactionStatus.return_value = {'status': 'PENDING'}
+        with mock.patch.object(CollectionStatusResolver, 'due', due_then_callback):
+            CollectionStatusResolver(client=client).run_once()
+
+        txn.refresh_from_db()
+        self.assertEqual((txn.status, txn.financial_transaction_id, txn.next_poll_at), ('SUCCESSFUL', 'ft-race', None))
+        self.assertEqual(LedgerEntry.objects.filter(source_id=txn.pk, status=LedgerStatus.SUCCESS).count(), 1)
+        self.assertEqual(sum(DailyRollup.objects.filter(status=RollupStatus.SUCCESS).values_list('count', flat=True)), 1)
+
+    def test_failed_settle_does_not_swallow_the_retry(self):
+        self.addCleanup(idempotency.recent.clear)
+        txn = self._pending('ref-retry', 'ext-retry')
+        payload = {'financialTransactionId': 'ft-retry', 'externalId': 'ext-retry', 'amount': '10',
+                   'currency': 'LRD', 'payer': {'partyIdType': 'MSISDN', 'partyId': '231770000000'},
+                   'status': 'SUCCESSFUL'}
+
+        with mock.patch('mtnmo.collection_views.settle_from_callback', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                apply_collection_callback(payload)
+        self.assertFalse(CollectionCallback.objects.exists())
+
+        self.assertEqual(apply_collection_callback(payload), {'status': 'success'})  # MTN's retry
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'SUCCESSFUL')
+
+class BulkDisbursementTests(TestCase):
+    def _callback(self, ref, status):
+        return DisbursementCallback.objects.create(
+            response='202', ref=ref, amount=5, currency='USD', financial_transaction_id=f'ft-{ref[:8]}',
+            external_id='', party_id_type='MSISDN', party_id='231770000001', status=status,
+        )
+
+    def test_batch_is_completed_from_callbacks(self):
+        answers = {'ext-4': {'response': 400}, 'ext-5': {'response': None}}  # refused / timed out
+        client = mock.Mock()
+        client.transfer.side_effect = lambda amount, phone, external_id, *args, ref: (
+            {'error': 'failed', 'ref': ref, **answers[external_id]} if external_id in answers
+            else {'response': 202, 'ref': ref}
+        )
+        payees = [{'phone': f'23177000000{i}', 'amount': '5', 'external_id': f'ext-{i}'} for i in range(1, 6)]
+        payees.append({'phone': 'nope', 'amount': '5', 'external_id': 'ext-6'})
+
+        bulk = BulkDisbursement(workers=4, rate=0, client=client)
+        batch, valid = bulk.create_batch(payees)
+        refs = {p['external_id']: p['ref'] for p in batch.payees}
+        # This callback lands before the batch rows are written
+        self._callback(refs['ext-1'], 'SUCCESSFUL')
+        batch = bulk.run_next()
+
+        client.authToken.assert_called_once()
+        self.assertEqual(batch.transactions.count(), 5)
+        self.assertEqual({str(t.ref) for t in batch.transactions.all()}, set(refs.values()))
+        self.assertEqual((batch.status, batch.total_count, batch.submitted_count, batch.rejected_count),
+                         ('SUBMITTED', 5, 4, 1))
+        self.assertEqual(batch.successful_count, 1)
+        self.assertEqual([e['row'] for e in batch.errors], [6])
+
+        # The timed-out transfer stays PENDING under its own ref, so its callback still matches
+        for external_id, status in (('ext-2', 'SUCCESSFUL'), ('ext-3', 'FAILED'), ('ext-5', 'SUCCESSFUL')):
+            cb = self._callback(refs[external_id], status)
+            self.assertEqual(settle_from_callback(cb.ref, cb.external_id, cb.status, cb.financial_transaction_id), 1)
+        # Duplicate deliveries are not double counted
+        self.assertEqual(settle_from_callback(refs['ext-3'], '', 'FAILED'), 0)
+
+        batch = DisbursementBatch.objects.get(pk=batch.pk)
+        self.assertEqual((batch.status, batch.successful_count, batch.failed_count), ('COMPLETED', 3, 1))
+        self.assertIsNotNone(batch.completed_at)
+
+    def test_interrupted_batch_is_rerun_with_the_same_refs(self):
+        client = mock.Mock()
+        client.transfer.side_effect = lambda amount, phone, external_id, *args, ref: (
+            {'error': '409 Conflict', 'ref': ref, 'response': 409} if external_id == 'ext-2'
+            else {'response': 202, 'ref': ref}
+        )
+        bulk = BulkDisbursement(workers=2, rate=0, client=client)
+        batch, _ = bulk.create_batch(
+            [{'phone': f'23177000000{i}', 'amount': '5', 'external_id': f'ext-{i}'} for i in range(1, 4)]
+        )
+        # The previous run wrote ext-1 and sent ext-2, then died
+        bulk._flush(batch, [bulk._row(batch, batch.payees[0], {'response': 202})])
+        DisbursementBatch.objects.filter(pk=batch.pk).update(status='PROCESSING')
+
+        self.assertIsNone(bulk.run_next())
+        batch = bulk.run_next(batch.pk)
+
+        sent = sorted(c.args[2] for c in client.transfer.call_args_list)
+        self.assertEqual(sent, ['ext-2', 'ext-3'])
+        refs = {p['external_id']: p['ref'] for p in batch.payees}
+        self.assertTrue(all(c.kwargs['ref'] == refs[c.args[2]] for c in client.transfer.call_args_list))
+        self.assertEqual((batch.submitted_count, batch.rejected_count), (3, 0))
+
+    def test_batch_without_valid_payees_is_completed(self):
+        batch, valid = BulkDisbursement(workers=1, rate=0, client=mock.Mock()).create_batch([{'phone': 'nope'}])
+        self.assertEqual((valid, batch.status), ([], 'COMPLETED'))
+        self.assertIsNotNone(batch.completed_at)
+
+
+class ListEndpointTests(TestCase):
+    def setUp(self):
+        CollectionTransaction.objects.bulk_create([
+            CollectionTransaction(external_id=f'ext-{i}', amount=i, currency='LRD', party_id=f'23177000000{i % 2}',
+                                  status='SUCCESSFUL' if i % 3 else 'FAILED')
+            for i in range(1, 8)
+        ])
+
+    def test_keyset_pages_with_filters(self):
+        url = '/mtnmo/collection/transactions/'
+        first = self.client.get(url, {'status': 'SUCCESSFUL', 'limit': 2}).json()
+        self.assertEqual([row['external_id'] for row in first['transactions']], ['ext-7', 'ext-5'])
+        self.assertTrue(first['has_more'])
+        second = self.client.get(url, {'status': 'SUCCESSFUL', 'limit': 2, 'cursor': first['next_cursor']}).json()
+        self.assertEqual([row['external_id'] for row in second['transactions']], ['ext-4', 'ext-2'])
+
+        third = self.client.get(url, {'status': 'SUCCESSFUL', 'limit': 2, 'cursor': second['next_cursor']}).json()
+        self.assertEqual([row['external_id'] for row in third['transactions']], ['ext-1'])
+        self.assertEqual((third['has_more'], third['next_cursor']), (False, None))
+
+        party = self.client.get(url, {'party_id': '231770000000'}).json()['transactions']
+        self.assertEqual([row['external_id'] for row in party], ['ext-6', 'ext-4', 'ext-2'])
+        today = timezone.localdate().isoformat()
+        self.assertEqual(len(self.client.get(url, {'from': today, 'to': today}).json()['transactions']), 7)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/mtnmo/collection/transactions/', {'stream': '1', 'status': 'FAILED'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['external_id'] for row in rows], ['ext-6', 'ext-3'])
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views, collection_views, disbursement_views
+from . import views, collection_views, disbursement_views, async_views
 
 urlpatterns = [
     # Views
@@ -8,6 +8,7 @@ urlpatterns = [
 
     # Collection URLs
     path('collect/', collection_views.collection, name='collect'),
+    path('async/collect/', async_views.collection, name='async_collect'),
     path('collection/callback/', collection_views.collection_callback, name='collection_callback'),
     path('collection/callback/<int:id>/', collection_views.edit_collection_callback, name='edit_collection_callback'),
     path('collection/callback/<int:id>/delete/', collection_views.delete_collection_callback, name='delete_collection_callback'),
@@ -20,6 +21,9 @@ urlpatterns = [
 
     # Disbursement URLs
     path('disburse/', disbursement_views.disbursement, name='disburse'),
+    path('async/disburse/', async_views.disbursement, name='async_disburse'),
+    path('disbursement/batch/', disbursement_views.disbursement_batch, name='disbursement_batch'),
+    path('disbursement/batch/<int:id>/', disbursement_views.get_disbursement_batch, name='get_disbursement_batch'),
     path('disbursement/callback/', disbursement_views.disbursement_callback, name='disbursement_callback'),
     path('disbursement/callback/<int:id>/', disbursement_views.edit_disbursement_callback, name='edit_disbursement_callback'),
     path('disbursement/callback/<int:id>/delete/', disbursement_views.delete_disbursement_callback, name='delete_disbursement_callback'),
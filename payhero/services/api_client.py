@@ -1,8 +1,11 @@
 import base64
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
+import httpx
 import requests
+from core.aio_transport import get_async_client
+from core.transport import get_session
 from ..config import PayHeroSettings
 from ..exceptions import (
     PayHeroAPIError,
@@ -20,6 +23,7 @@ class PayHeroApiClient:
     def __init__(self, settings: Optional[PayHeroSettings] = None):
         self.settings = settings or PayHeroSettings.load()
         self.logger = logging.getLogger(__name__)
+        self.session = get_session(self.settings.base_url)
 
     def _basic_auth_header(self) -> Optional[str]:
         if self.settings.api_key and self.settings.api_secret:
@@ -47,11 +51,14 @@ class PayHeroApiClient:
                 headers["Authorization"] = auth
         return headers
 
+    def _url(self, path: str) -> str:
+        return f"{self.settings.base_url.rstrip('/')}/{path.lstrip('/')}"
+
     def request(self, method: str, path: str, *, params: Dict[str, Any] | None = None,
                 json: Dict[str, Any] | None = None, basic: bool | None = None, bearer: bool | None = None) -> Dict[str, Any]:
-        url = f"{self.settings.base_url.rstrip('/')}/{path.lstrip('/')}"
+        url = self._url(path)
         try:
-            resp = requests.request(
+            resp = self.session.request(
                 method.upper(),
                 url,
                 headers=self._headers(use_basic=bool(basic), use_bearer=bool(bearer), has_json=bool(json is not None)),
@@ -69,28 +76,57 @@ class PayHeroApiClient:
             self.logger.exception("PayHero request error on %s %s", method, url)
             raise PayHeroAPIError("Upstream request error", status_code=502) from exc
 
-        if not resp.ok:
+        return self._parse_response(method, url, resp.status_code, resp.ok, resp.text, resp.json)
+
+    async def arequest(self, method: str, path: str, *, params: Dict[str, Any] | None = None,
+                       json: Dict[str, Any] | None = None, basic: bool | None = None, bearer: bool | None = None) -> Dict[str, Any]:
+        """Async variant of request(); same error mapping, pooled httpx client."""
+        url = self._url(path)
+        try:
+            resp = await get_async_client(self.settings.base_url).request(
+                method.upper(),
+                url,
+                headers=self._headers(use_basic=bool(basic), use_bearer=bool(bearer), has_json=bool(json is not None)),
+                params=params,
+                json=json,
+                timeout=self.settings.timeout,
+            )
+        except httpx.TimeoutException as exc:
+            self.logger.warning("PayHero timeout on %s %s: %s", method, url, exc)
+            raise PayHeroTimeoutError("Upstream timeout", status_code=504) from exc
+        except httpx.TransportError as exc:
+            self.logger.error("PayHero connection error on %s %s: %s", method, url, exc)
+            raise PayHeroConnectionError("Upstream connection error", status_code=502) from exc
+        except httpx.HTTPError as exc:
+            self.logger.exception("PayHero request error on %s %s", method, url)
+            raise PayHeroAPIError("Upstream request error", status_code=502) from exc
+
+        return self._parse_response(method, url, resp.status_code, resp.is_success, resp.text, resp.json)
+
+    def _parse_response(self, method: str, url: str, status_code: int, ok: bool, text: str,
+                        load_json: Callable[[], Any]) -> Dict[str, Any]:
+        if not ok:
             # Try parse JSON error details
             parsed: Dict[str, Any] | None = None
             try:
-                parsed = resp.json()
+                parsed = load_json()
             except ValueError:
                 parsed = None
             self.logger.info(
                 "PayHero non-2xx response %s for %s %s: %s",
-                resp.status_code,
+                status_code,
                 method,
                 url,
-                parsed if parsed is not None else resp.text,
+                parsed if parsed is not None else text,
             )
             raise PayHeroAPIError(
-                message=f"PayHero API error {resp.status_code}",
-                status_code=resp.status_code,
-                raw_body=resp.text,
+                message=f"PayHero API error {status_code}",
+                status_code=status_code,
+                raw_body=text,
                 data=parsed,
             )
         try:
-            return resp.json()
+            return load_json()
         except ValueError as e:  # pragma: no cover
             self.logger.error("Invalid JSON from PayHero for %s %s: %s", method, url, e)
-            raise PayHeroAPIError("Invalid JSON response", status_code=502, raw_body=resp.text)
+            raise PayHeroAPIError("Invalid JSON response", status_code=502, raw_body=text)
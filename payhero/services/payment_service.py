@@ -5,7 +5,11 @@ Pure orchestration lives here; HTTP specifics are in PayHeroApiClient.
 """
 
 from typing import Dict, Any, List, Optional
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from reporting import ledger
+from reporting.export import payhero_status
+from reporting.models import LedgerProvider
 from ..models import PayHeroTransaction
 from .api_client import PayHeroApiClient
 from ..exceptions import PayHeroConfigurationError
@@ -61,18 +65,12 @@ class PaymentService:
             status=resp.get("status", PayHeroTransaction.Status.QUEUED),
             metadata={"topup_response": resp},
         )
+        ledger.record(LedgerProvider.PAYHERO, txn)
         return {"reference": txn.reference, "status": txn.status, "raw": resp}
 
-    @transaction.atomic
-    def initiate_payment(self, *, amount: int, phone_number: str, channel_id: Optional[int] = None, provider: str,
-                        reference: str | None = None, external_reference: str | None = None,
-                        customer_name: str | None = None, callback_url: str | None = None,
-                        credential_id: str | None = None, network_code: str | None = None) -> Dict[str, Any]:
-        """Initiate a customer payment.
-
-        Required: amount, phone_number, channel_id, provider.
-        Optional metadata fields are passed through to the upstream API when provided.
-        """
+    def _payment_payload(self, *, amount: int, phone_number: str, channel_id: Optional[int], provider: str,
+                         external_reference: str | None, customer_name: str | None, callback_url: str | None,
+                         credential_id: str | None, network_code: str | None) -> Dict[str, Any]:
         # For payments, prefer an explicit payments_channel_id, then default
         settings = self.client.settings
         channel = channel_id if channel_id is not None else (settings.payments_channel_id or settings.default_channel_id)
@@ -90,21 +88,57 @@ class PaymentService:
         if callback_url: payload["callback_url"] = callback_url
         if credential_id: payload["credential_id"] = credential_id
         if network_code: payload["network_code"] = network_code
-        resp = self.client.request("POST", PAYMENTS_PATH, json=payload, basic=True)
+        return payload
+
+    def _record_payment(self, payload: Dict[str, Any], resp: Dict[str, Any], reference: str | None) -> Dict[str, Any]:
+        channel, amount = payload["channel_id"], payload["amount"]
+        external_reference = payload.get("external_reference")
         ref = reference or resp.get("reference") or external_reference or f"pay-{channel}-{amount}"
         txn = PayHeroTransaction.objects.create(
             reference=ref,
-            provider=provider,
+            provider=payload["provider"],
             channel_id=channel,
             amount=amount,
-            phone_number=phone_number,
+            phone_number=payload["phone_number"],
             description=external_reference,
             operation_type="payment",
             status=resp.get("status", PayHeroTransaction.Status.QUEUED),
             metadata={"initiate_response": resp},
         )
+        ledger.record(LedgerProvider.PAYHERO, txn)
         return {"reference": txn.reference, "status": txn.status, "raw": resp}
 
+    @transaction.atomic
+    def initiate_payment(self, *, amount: int, phone_number: str, channel_id: Optional[int] = None, provider: str,
+                        reference: str | None = None, external_reference: str | None = None,
+                        customer_name: str | None = None, callback_url: str | None = None,
+                        credential_id: str | None = None, network_code: str | None = None) -> Dict[str, Any]:
+        """Initiate a customer payment.
+
+        Required: amount, phone_number, channel_id, provider.
+        Optional metadata fields are passed through to the upstream API when provided.
+        """
+        payload = self._payment_payload(
+            amount=amount, phone_number=phone_number, channel_id=channel_id, provider=provider,
+            external_reference=external_reference, customer_name=customer_name, callback_url=callback_url,
+            credential_id=credential_id, network_code=network_code,
+        )
+        resp = self.client.request("POST", PAYMENTS_PATH, json=payload, basic=True)
+        return self._record_payment(payload, resp, reference)
+
+    async def ainitiate_payment(self, *, amount: int, phone_number: str, channel_id: Optional[int] = None, provider: str,
+                                reference: str | None = None, external_reference: str | None = None,
+                                customer_name: str | None = None, callback_url: str | None = None,
+                                credential_id: str | None = None, network_code: str | None = None) -> Dict[str, Any]:
+        """Async variant of initiate_payment; the upstream call does not hold a DB transaction open."""
+        payload = self._payment_payload(
+            amount=amount, phone_number=phone_number, channel_id=channel_id, provider=provider,
+            external_reference=external_reference, customer_name=customer_name, callback_url=callback_url,
+            credential_id=credential_id, network_code=network_code,
+        )
+        resp = await self.client.arequest("POST", PAYMENTS_PATH, json=payload, basic=True)
+        return await sync_to_async(self._record_payment)(payload, resp, reference)
+
     @transaction.atomic
     def withdraw_mobile(self, *, amount: int, phone_number: str, network_code: str, channel_id: Optional[int] = None,
                         provider: str, external_reference: str | None = None, callback_url: str | None = None) -> Dict[str, Any]:
@@ -137,6 +171,7 @@ class PaymentService:
             status=resp.get("status", PayHeroTransaction.Status.QUEUED),
             metadata={"withdraw_response": resp},
         )
+        ledger.record(LedgerProvider.PAYHERO, txn)
         return {"reference": txn.reference, "status": txn.status, "raw": resp}
 
     def list_transactions(self, *, page: int = 1, per: int = 20) -> Dict[str, Any]:
@@ -150,10 +185,12 @@ class PaymentService:
         resp = self.client.request("GET", TRANSACTION_STATUS_PATH, params={"reference": reference}, basic=True)
         remote_status = resp.get("status") or resp.get("Status")
         if remote_status and remote_status != txn.status:
+            previous_status = payhero_status(txn.status)
             txn.status = remote_status
             txn.last_status_payload = resp
             txn.metadata.update({"last_status_response": resp})
             txn.save(update_fields=["status", "last_status_payload", "metadata", "updated_at"])
+            ledger.transition(LedgerProvider.PAYHERO, txn, previous_status)
         return {"reference": txn.reference, "current_status": txn.status, "raw": resp}
 
     # ------------------ Global (Bearer) ------------------
@@ -191,4 +228,5 @@ class PaymentService:
             status=resp.get("status") or resp.get("Status") or PayHeroTransaction.Status.QUEUED,
             metadata={"global_payment_response": resp},
         )
+        ledger.record(LedgerProvider.PAYHERO, txn)
         return {"reference": txn.reference, "status": txn.status, "raw": resp}
@@ -4,6 +4,7 @@ from .views import (
     PaymentChannelBalanceView,
     TopupServiceWalletView,
     InitiatePaymentView,
+    initiate_payment_async,
     WithdrawMobileView,
     TransactionsListView,
     TransactionStatusView,
@@ -20,6 +21,7 @@ urlpatterns = [
     path("wallets/channel/<int:channel_id>/", PaymentChannelBalanceView.as_view(), name="channel-wallet"),
     path("topup/", TopupServiceWalletView.as_view(), name="topup"),
     path("payments/initiate/", InitiatePaymentView.as_view(), name="initiate-payment"),
+    path("payments/initiate/async/", initiate_payment_async, name="initiate-payment-async"),
     path("withdraw/mobile/", WithdrawMobileView.as_view(), name="withdraw-mobile"),
     path("transactions/", TransactionsListView.as_view(), name="transactions"),
     path("transaction-status/", TransactionStatusView.as_view(), name="transaction-status"),
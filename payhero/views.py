@@ -3,6 +3,10 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.db import transaction
+
+from core import idempotency
+from core.async_views import async_api_view
 
 from .services.payment_service import PaymentService
 from .models import PayHeroTransaction, PayHeroWebhookEvent
@@ -14,7 +18,7 @@ from .serializers import (
 	TransactionStatusQuerySerializer,
 	GlobalPaymentSerializer,
 )
-from .http import safe_call, error_payload
+from .http import safe_call, error_payload, handle_exception
 
 
 class ServiceWalletBalanceView(APIView):
@@ -47,6 +51,19 @@ class InitiatePaymentView(APIView):
 		return safe_call(lambda: service.initiate_payment(**serializer.validated_data), status_code=status.HTTP_201_CREATED)
 
 
+@async_api_view(["POST"])
+async def initiate_payment_async(request):
+	"""Async counterpart of InitiatePaymentView for ASGI deployments."""
+	serializer = InitiatePaymentSerializer(data=request.data)
+	if not serializer.is_valid():
+		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+	try:
+		result = await PaymentService().ainitiate_payment(**serializer.validated_data)
+		return Response(result, status=status.HTTP_201_CREATED)
+	except Exception as exc:  # noqa: BLE001
+		return handle_exception(exc)
+
+
 class WithdrawMobileView(APIView):
 	def post(self, request):
 		serializer = WithdrawMobileSerializer(data=request.data)
@@ -100,6 +117,12 @@ class WebhookReceiverView(APIView):
 	def post(self, request):
 		payload = request.data
 		# TODO: verify signature header when provider docs supplied
+		# PayHero callbacks carry the M-Pesa CheckoutRequestID; use it to drop redeliveries
+		event_id = (payload.get("response") or {}).get("CheckoutRequestID") or payload.get("event_id")
 		def _save():
-			return {"status": "accepted", "event_id": PayHeroWebhookEvent.objects.create(raw_payload=payload).pk}
+			with transaction.atomic():
+				if not idempotency.claim("payhero", event_id):
+					return {"status": "duplicate", "event_id": event_id}
+				event = PayHeroWebhookEvent.objects.create(raw_payload=payload, event_id=event_id)
+			return {"status": "accepted", "event_id": event.pk}
 		return safe_call(_save, status_code=200)
@@ -1,9 +1,10 @@
-import requests
 from decouple import config
 
+from core.transport import get_session
+
 class Paystack:
 	PAYSTACK_SK = config('PAYSTACK_SECRET_KEY')
-	base_url = "https://api.paystack.co/"
+	base_url = config('PAYSTACK_BASE_URL', default="https://api.paystack.co/")
 
 	def verify_payment(self, ref, *args, **kwargs):
 		path = f'transaction/verify/{ref}'
@@ -12,7 +13,7 @@ class Paystack:
 			"Content-Type": "application/json",
 		}
 		url = self.base_url + path
-		response = requests.get(url, headers=headers)
+		response = get_session(self.base_url).get(url, headers=headers)
 
 		print(
 			f"\n\nTransaction with ref: {ref} has a response {response} and status_code of {response.status_code}\n\n")
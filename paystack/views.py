@@ -1,4 +1,6 @@
 from django.shortcuts import render
+from reporting import ledger
+from reporting.models import LedgerProvider, RollupStatus
 from .models import Payment, UserWallet
 from decouple import config
 
@@ -11,6 +13,7 @@ def initiate_payment(request):
 
 		payment = Payment.objects.create(amount=amount, email=email, user=request.user)
 		payment.save()
+		ledger.record(LedgerProvider.PAYSTACK, payment)
 
 		context = {
 			'payment': payment,
@@ -26,7 +29,10 @@ def initiate_payment(request):
 def verify_payment(request, ref):
 	if request.user.is_authenticated:
 		payment = Payment.objects.get(ref=ref)
+		previously_verified = payment.verified
 		verified = payment.verify_payment()
+		if not previously_verified:
+			ledger.transition(LedgerProvider.PAYSTACK, payment, RollupStatus.PENDING)
 
 		if verified:
 			user_wallet, created = UserWallet.objects.get_or_create(user=request.user)
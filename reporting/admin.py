@@ -0,0 +1,23 @@
+from django.contrib import admin
+from .models import DailyRollup, LedgerEntry
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'provider', 'status', 'user_id', 'count', 'amount')
+    list_filter = ('provider', 'status')
+    date_hierarchy = 'day'
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('occurred_at', 'provider', 'status', 'amount_minor', 'currency', 'reference', 'user_id')
+    list_filter = ('provider', 'status')
+    search_fields = ('reference',)
+    date_hierarchy = 'occurred_at'
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,86 @@
+"""
+Rebuild DailyRollup buckets from the raw transaction tables.
+
+Used to seed rollups for history and to repair drift: each provider/day range
+is recomputed with grouped aggregates and replaced in one transaction.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from mpesa.models import MpesaB2CTransaction, MpesaTransaction
+from mtnmo.models import CollectionTransaction, DisbursementTransaction
+from .models import ALL_USERS, DailyRollup, Provider, RollupStatus
+
+
+def _mpesa_bucket():
+    return Case(
+        When(result_code__isnull=True, then=Value(RollupStatus.PENDING)),
+        When(result_code=0, then=Value(RollupStatus.SUCCESS)),
+        default=Value(RollupStatus.FAILED),
+    )
+
+
+def _mtn_bucket():
+    return Case(
+        When(Q(status__isnull=True) | Q(status='') | Q(status='PENDING'), then=Value(RollupStatus.PENDING)),
+        When(status='SUCCESSFUL', then=Value(RollupStatus.SUCCESS)),
+        default=Value(RollupStatus.FAILED),
+    )
+
+
+# provider -> (model, status bucket expression, has user_id)
+SOURCES = {
+    Provider.MPESA_STK: (MpesaTransaction, _mpesa_bucket, True),
+    Provider.MPESA_B2C: (MpesaB2CTransaction, _mpesa_bucket, True),
+    Provider.MTN_COLLECTION: (CollectionTransaction, _mtn_bucket, False),
+    Provider.MTN_DISBURSEMENT: (DisbursementTransaction, _mtn_bucket, False),
+}
+
+
+def _bounds(start_day, end_day):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_day, time.min), tz) if start_day else None
+    end = timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min), tz) if end_day else None
+    return start, end
+
+
+def backfill(start_day=None, end_day=None, providers=None):
+    """Recompute rollups for [start_day, end_day] (open-ended when None); returns buckets written."""
+    start, end = _bounds(start_day, end_day)
+    written = 0
+    for provider in providers or SOURCES:
+        model, bucket, has_user = SOURCES[provider]
+        rows = model.objects.filter(created_at__isnull=False)
+        if start:
+            rows = rows.filter(created_at__gte=start)
+        if end:
+            rows = rows.filter(created_at__lt=end)
+        grouped = rows.order_by().annotate(day=TruncDate('created_at'), bucket=bucket())
+
+        buckets = [
+            DailyRollup(day=r['day'], provider=provider, status=r['bucket'], user_id=ALL_USERS,
+                        count=r['count'], amount=r['amount'] or 0)
+            for r in grouped.values('day', 'bucket').annotate(count=Count('id'), amount=Sum('amount'))
+        ]
+        if has_user:
+            buckets += [
+                DailyRollup(day=r['day'], provider=provider, status=r['bucket'], user_id=r['user_id'],
+                            count=r['count'], amount=r['amount'] or 0)
+                for r in grouped.filter(user_id__isnull=False).exclude(user_id=ALL_USERS)
+                .values('day', 'bucket', 'user_id').annotate(count=Count('id'), amount=Sum('amount'))
+            ]
+
+        with transaction.atomic():
+            existing = DailyRollup.objects.filter(provider=provider)
+            if start_day:
+                existing = existing.filter(day__gte=start_day)
+            if end_day:
+                existing = existing.filter(day__lte=end_day)
+            existing.delete()
+            DailyRollup.objects.bulk_create(buckets, batch_size=1000)
+        written += len(buckets)
+    return written
@@ -0,0 +1,187 @@
+"""
+Streaming ledger export across every payment provider
+
+Each source table is mapped onto one row schema (COLUMNS) and read a date
+window at a time (one day by default), ordered by (date, id), with
+.values().iterator(chunk_size) so the database streams rows through a
+server-side cursor instead of materialising the window. Rows are written as
+CSV or NDJSON into small buffers, optionally gzipped on the fly, and yielded
+as bytes. Memory stays constant however many rows a month holds.
+
+PayHero, Paystack and Stripe rows are only exported when those apps are in
+INSTALLED_APPS.
+"""
+import csv
+import json
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Callable, Optional
+
+from django.apps import apps
+from django.utils import timezone
+
+from .models import RollupStatus
+from .rollups import mpesa_status, mtn_status
+
+COLUMNS = ('provider', 'id', 'reference', 'provider_reference', 'amount', 'currency', 'party', 'status',
+           'raw_status', 'created_at')
+
+CSV, NDJSON = 'csv', 'ndjson'
+FORMATS = (CSV, NDJSON)
+CONTENT_TYPES = {CSV: 'text/csv', NDJSON: 'application/x-ndjson'}
+
+CHUNK_SIZE = 2000  # rows fetched per round trip from the server-side cursor
+FLUSH_BYTES = 64 * 1024  # encoded bytes buffered before each yield
+
+
+def payhero_status(status):
+    if status == 'SUCCESS':
+        return RollupStatus.SUCCESS
+    return RollupStatus.FAILED if status in ('FAILED', 'cancelled') else RollupStatus.PENDING
+
+
+def paystack_status(verified):
+    return RollupStatus.SUCCESS if verified else RollupStatus.PENDING
+
+
+def stripe_status(payment_status):
+    if payment_status in ('paid', 'no_payment_required'):
+        return RollupStatus.SUCCESS
+    return RollupStatus.FAILED if payment_status == 'unpaid' else RollupStatus.PENDING
+
+
+@dataclass(frozen=True)
+class Source:
+    """How one transaction table maps onto COLUMNS."""
+    provider: str
+    model: str  # app_label.ModelName
+    date_field: str
+    reference: str
+    provider_reference: Optional[str]
+    amount: str
+    party: str
+    raw_status: str
+    status: Callable
+    currency_field: Optional[str] = None
+    currency: str = ''  # used when the table has no currency column
+    user_field: Optional[str] = None  # not exported; used by the ledger (ledger.py)
+
+    def available(self):
+        try:
+            apps.get_model(self.model)
+        except LookupError:  # app not in INSTALLED_APPS
+            return False
+        return True
+
+    def fields(self):
+        named = (self.reference, self.provider_reference, self.amount, self.currency_field, self.party,
+                 self.raw_status)
+        return ('id', self.date_field) + tuple(f for f in named if f)
+
+    def rows(self, start, end):
+        """Normalized rows created in [start, end), oldest first."""
+        queryset = apps.get_model(self.model).objects.filter(**{
+            f'{self.date_field}__gte': start, f'{self.date_field}__lt': end,
+        }).order_by(self.date_field, 'id').values(*self.fields())
+        for r in queryset.iterator(chunk_size=CHUNK_SIZE):
+            raw = r[self.raw_status]
+            yield (
+                self.provider, r['id'], r[self.reference],
+                r[self.provider_reference] if self.provider_reference else None,
+                r[self.amount],
+                (r[self.currency_field] if self.currency_field else None) or self.currency,
+                r[self.party], self.status(raw), raw, r[self.date_field],
+            )
+
+
+SOURCES = (
+    Source('mpesa_stk', 'mpesa.MpesaTransaction', 'created_at', 'checkout_request_id', 'mpesa_receipt_number',
+           'amount', 'phone_number', 'result_code', mpesa_status, currency='KES', user_field='user_id'),
+    Source('mpesa_b2c', 'mpesa.MpesaB2CTransaction', 'created_at', 'conversation_id', 'mpesa_receipt_number',
+           'amount', 'phone_number', 'result_code', mpesa_status, currency='KES', user_field='user_id'),
+    Source('mtn_collection', 'mtnmo.CollectionTransaction', 'created_at', 'external_id',
+           'financial_transaction_id', 'amount', 'party_id', 'status', mtn_status, currency_field='currency'),
+    Source('mtn_disbursement', 'mtnmo.DisbursementTransaction', 'created_at', 'external_id',
+           'financial_transaction_id', 'amount', 'party_id', 'status', mtn_status, currency_field='currency'),
+    Source('payhero', 'payhero.PayHeroTransaction', 'created_at', 'reference', 'provider_txn_id', 'amount',
+           'phone_number', 'status', payhero_status, currency_field='currency'),
+    # Paystack amounts are stored in major units (see Payment.amount_value)
+    Source('paystack', 'paystack.Payment', 'date_created', 'ref', None, 'amount', 'email', 'verified',
+           paystack_status, currency='GHS', user_field='user_id'),
+    Source('stripe', 'stripe_pay.StripeTransaction', 'timestamp', 'payment_id', 'payment_intent', 'amount_total',
+           'customer_email', 'payment_status', stripe_status, currency_field='currency'),
+)
+
+
+def available_providers():
+    return [source.provider for source in SOURCES if source.available()]
+
+
+def windows(start_day, end_day, days=1):
+    """Aware [start, end) datetime pairs covering start_day..end_day inclusive, `days` at a time."""
+    tz = timezone.get_current_timezone()
+    day = start_day
+    while day <= end_day:
+        upto = min(day + timedelta(days=days), end_day + timedelta(days=1))
+        yield (timezone.make_aware(datetime.combine(day, time.min), tz),
+               timezone.make_aware(datetime.combine(upto, time.min), tz))
+        day = upto
+
+
+def rows(start_day, end_day, providers=None, window_days=1):
+    """Every normalized row in the range: window by window, provider by provider within a window."""
+    sources = [s for s in SOURCES if s.available() and (not providers or s.provider in providers)]
+    for start, end in windows(start_day, end_day, window_days):
+        for source in sources:
+            yield from source.rows(start, end)
+
+
+class _Line:
+    """File-like sink for csv.writer that hands back what was written."""
+
+    def write(self, value):
+        return value
+
+
+def _plain(row):
+    """Amount as an exact decimal string and created_at as ISO 8601, the same in both formats."""
+    amount = row[4]
+    return row[:4] + (None if amount is None else str(amount),) + row[5:-1] + (row[-1].isoformat(),)
+
+
+def _encode(rows, fmt):
+    if fmt == CSV:
+        writer = csv.writer(_Line())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow(_plain(row))
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(COLUMNS, _plain(row))), default=str) + '\n'
+
+
+def export(rows, fmt=CSV, compress=False):
+    """Encoded rows as a stream of byte chunks of roughly FLUSH_BYTES each."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'")
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer, size = [], 0
+    for line in _encode(rows, fmt):
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            chunk = ''.join(buffer).encode()
+            buffer, size = [], 0
+            chunk = gzip.compress(chunk) if gzip else chunk
+            if chunk:
+                yield chunk
+    chunk = ''.join(buffer).encode()
+    if gzip:
+        chunk = gzip.compress(chunk) + gzip.flush()
+    if chunk:
+        yield chunk
+
+
+def filename(start_day, end_day, fmt, compress):
+    return f"ledger-{start_day.isoformat()}-{end_day.isoformat()}.{fmt}{'.gz' if compress else ''}"
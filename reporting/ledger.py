@@ -0,0 +1,146 @@
+"""
+Append-only, cross-provider ledger of money movements (LedgerEntry)
+
+Every initiation and callback path appends here next to its rollups call:
+record() when a provider row is created, transition() when its status
+changes. Entries are normalized through the same per-provider mapping as
+the ledger export (export.SOURCES): integer minor units signed by
+direction, a small-int provider and status, the provider row's id and its
+reference. A SUCCESS that later turns into anything else gets a REVERSED
+entry, so balance() over settled entries stays correct without rewriting
+history.
+
+Like rollups, a ledger write never fails a payment: errors are logged and
+backfill_ledger fills in rows that have no ledger history.
+"""
+import logging
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from . import export
+from .models import LedgerEntry, LedgerProvider, LedgerStatus, RollupStatus
+
+logger = logging.getLogger(__name__)
+
+SOURCES = {LedgerProvider[source.provider.upper()]: source for source in export.SOURCES}
+
+OUTBOUND = {LedgerProvider.MPESA_B2C, LedgerProvider.MTN_DISBURSEMENT}
+
+STATUSES = {
+    RollupStatus.PENDING: LedgerStatus.PENDING,
+    RollupStatus.SUCCESS: LedgerStatus.SUCCESS,
+    RollupStatus.FAILED: LedgerStatus.FAILED,
+}
+
+
+def to_minor(amount):
+    """Integer minor units (cents) of a decimal major-unit amount."""
+    if amount is None:
+        return 0
+    return int((Decimal(str(amount)) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def _outbound(provider, row):
+    if provider == LedgerProvider.PAYHERO:
+        return row.get('operation_type') == 'withdraw'
+    return provider in OUTBOUND
+
+
+def _fields(provider):
+    """Columns an entry is built from, for .values() reads."""
+    source = SOURCES[provider]
+    fields = source.fields() + ((source.user_field,) if source.user_field else ())
+    return fields + (('operation_type',) if provider == LedgerProvider.PAYHERO else ())
+
+
+def _row(item):
+    """Field values of a model instance or a .values() dict."""
+    return item if isinstance(item, dict) else vars(item)
+
+
+def _entry(provider, row, status=None, occurred_at=None, sign=1):
+    source = SOURCES[provider]
+    if status is None:
+        status = STATUSES[source.status(row[source.raw_status])]
+    currency = (row.get(source.currency_field) if source.currency_field else None) or source.currency
+    return LedgerEntry(
+        occurred_at=occurred_at or timezone.now(),
+        provider=provider,
+        status=status,
+        amount_minor=sign * (-1 if _outbound(provider, row) else 1) * to_minor(row[source.amount]),
+        currency=currency[:3].upper(),
+        source_id=row['id'],
+        reference=(row.get(source.reference) or '')[:200],
+        user_id=row.get(source.user_field) if source.user_field else None,
+    )
+
+
+def _append(entries):
+    try:
+        entries = list(entries)
+        if entries:
+            with transaction.atomic():
+                LedgerEntry.objects.bulk_create(entries)
+    except Exception as e:
+        # The ledger must never fail a payment; backfill_ledger catches up
+        logger.error(f"Error appending ledger entries: {e}")
+
+
+def record(provider, item):
+    """Append the current state of a newly stored provider row."""
+    record_many(provider, [item])
+
+
+def record_many(provider, items):
+    _append(_entry(provider, _row(item)) for item in items)
+
+
+def transition(provider, item, previous_status):
+    """Append the row's new status if it differs from previous_status (a RollupStatus)."""
+    transitions(provider, [(item, previous_status)])
+
+
+def transitions(provider, items):
+    """Batch form of transition: iterable of (instance or values dict, previous RollupStatus)."""
+    def entries():
+        source = SOURCES[provider]
+        for item, previous in items:
+            row = _row(item)
+            status = source.status(row[source.raw_status])
+            if status == previous:
+                continue
+            if previous == RollupStatus.SUCCESS:
+                yield _entry(provider, row, LedgerStatus.REVERSED, sign=-1)
+            yield _entry(provider, row, STATUSES[status])
+    _append(entries())
+
+
+def backfill(providers=None, batch_size=1000):
+    """One entry, dated at creation, for every provider row with no ledger history yet. Safe to rerun."""
+    written = 0
+    for provider, source in SOURCES.items():
+        if (providers and provider not in providers) or not source.available():
+            continue
+        rows = (apps.get_model(source.model).objects.order_by('id').values(*_fields(provider))
+                .iterator(chunk_size=batch_size))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                written += _backfill_batch(provider, source, batch)
+                batch = []
+        written += _backfill_batch(provider, source, batch)
+    return written
+
+
+def _backfill_batch(provider, source, rows):
+    if not rows:
+        return 0
+    seen = set(LedgerEntry.objects.filter(provider=provider, source_id__in=[row['id'] for row in rows])
+               .values_list('source_id', flat=True))
+    entries = [_entry(provider, row, occurred_at=row[source.date_field]) for row in rows if row['id'] not in seen]
+    LedgerEntry.objects.bulk_create(entries)
+    return len(entries)
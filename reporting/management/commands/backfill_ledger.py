@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from reporting.ledger import SOURCES, backfill
+from reporting.models import LedgerProvider
+
+
+class Command(BaseCommand):
+    help = 'Add a ledger entry for every provider transaction that has none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', action='append', choices=[p.name.lower() for p in SOURCES],
+                            help='Limit to a provider (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        providers = [LedgerProvider[name.upper()] for name in options['provider'] or ()]
+        written = backfill(providers=providers, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Appended {written} ledger entr{"y" if written == 1 else "ies"}'))
@@ -0,0 +1,29 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reporting.backfill import SOURCES, backfill
+
+
+class Command(BaseCommand):
+    help = 'Rebuild daily reporting rollups from raw M-Pesa and MTN transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only rebuild the last N days (default: all history)')
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--provider', action='append', choices=[p.value for p in SOURCES],
+                            help='Limit to a provider (repeatable)')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+            until = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'] - 1)
+
+        written = backfill(start_day=since, end_day=until, providers=options['provider'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup bucket(s)'))
@@ -0,0 +1,45 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reporting import export
+
+
+class Command(BaseCommand):
+    help = 'Stream every provider\'s transactions in one normalized CSV/NDJSON ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to export (YYYY-MM-DD, default: today)')
+        parser.add_argument('--until', help='Last day to export (YYYY-MM-DD, default: --since)')
+        parser.add_argument('--format', dest='fmt', choices=export.FORMATS, default=export.CSV)
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--provider', action='append', choices=[s.provider for s in export.SOURCES],
+                            help='Limit to a provider (repeatable)')
+        parser.add_argument('--window-days', type=int, default=1, help='Days read per query')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else timezone.localdate()
+            until = date.fromisoformat(options['until']) if options['until'] else since
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if until < since:
+            raise CommandError('--until is before --since')
+        missing = set(options['provider'] or ()) - set(export.available_providers())
+        if missing:
+            raise CommandError(f"Not installed: {', '.join(sorted(missing))}")
+
+        rows = export.rows(since, until, options['provider'], max(1, options['window_days']))
+        chunks = export.export(rows, options['fmt'], options['gzip'])
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
@@ -0,0 +1,52 @@
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from reporting.reconcile import PROVIDERS, Reconciler, Report
+
+
+class Command(BaseCommand):
+    help = 'Compare local transactions with provider statements and repair status drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', action='append', choices=PROVIDERS, help='Limit to a provider (repeatable)')
+        parser.add_argument('--since', help='Only check rows created on or after this day (YYYY-MM-DD)')
+        parser.add_argument('--older-than', type=int, default=10,
+                            help='Minutes a row must have been pending before it is checked')
+        parser.add_argument('--dry-run', action='store_true', help='Report mismatches without repairing them')
+        parser.add_argument('--report', help='Write every mismatch to this file as NDJSON')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--rate', type=float, default=10, help='Provider calls per second (0 = unlimited)')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        out = open(options['report'], 'w') if options['report'] else None
+        try:
+            report = Report(sink=(lambda m: out.write(json.dumps(m) + '\n')) if out else None)
+            Reconciler(
+                report=report,
+                repair=not options['dry_run'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                rate=options['rate'],
+                older_than=timedelta(minutes=options['older_than']),
+                since=timezone.make_aware(datetime.combine(since, time.min)) if since else None,
+            ).run(options['provider'])
+        finally:
+            if out:
+                out.close()
+
+        self.stdout.write(f"{'provider':<18}{'checked':>9}{'matched':>9}{'repaired':>10}  mismatches")
+        for provider, totals in report.summary().items():
+            kinds = ', '.join(f'{kind}={n}' for kind, n in totals['mismatches'].items()) or '-'
+            self.stdout.write(f"{provider:<18}{totals['checked']:>9}{totals['matched']:>9}{totals['repaired']:>10}"
+                              f"  {kinds}")
+        if options['dry_run']:
+            self.stdout.write('Dry run: nothing was repaired')
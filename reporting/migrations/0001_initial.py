@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('provider', models.CharField(choices=[('mpesa_stk', 'M-Pesa STK Push'), ('mpesa_b2c', 'M-Pesa B2C'), ('mtn_collection', 'MTN Collection'), ('mtn_disbursement', 'MTN Disbursement')], max_length=20)),
+                ('status', models.CharField(choices=[('success', 'Success'), ('failed', 'Failed'), ('pending', 'Pending')], max_length=10)),
+                ('user_id', models.IntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('user_id', 'provider', 'day', 'status'), name='reporting_rollup_key'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.4 on 2026-10-17 12:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('provider', models.PositiveSmallIntegerField(choices=[(1, 'M-Pesa STK Push'), (2, 'M-Pesa B2C'), (3, 'MTN Collection'), (4, 'MTN Disbursement'), (5, 'PayHero'), (6, 'Paystack'), (7, 'Stripe')])),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Success'), (2, 'Failed'), (3, 'Reversed')])),
+                ('amount_minor', models.BigIntegerField()),
+                ('currency', models.CharField(max_length=3)),
+                ('source_id', models.BigIntegerField()),
+                ('reference', models.CharField(blank=True, max_length=200)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['occurred_at'], name='reporting_ledger_time_idx'), models.Index(fields=['provider', 'occurred_at'], name='reporting_ledger_provider_idx'), models.Index(fields=['user_id', 'occurred_at'], name='reporting_ledger_user_idx'), models.Index(fields=['provider', 'source_id'], name='reporting_ledger_source_idx')],
+            },
+        ),
+    ]
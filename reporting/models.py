@@ -0,0 +1,118 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Provider(models.TextChoices):
+    MPESA_STK = 'mpesa_stk', 'M-Pesa STK Push'
+    MPESA_B2C = 'mpesa_b2c', 'M-Pesa B2C'
+    MTN_COLLECTION = 'mtn_collection', 'MTN Collection'
+    MTN_DISBURSEMENT = 'mtn_disbursement', 'MTN Disbursement'
+
+
+class RollupStatus(models.TextChoices):
+    SUCCESS = 'success', 'Success'
+    FAILED = 'failed', 'Failed'
+    PENDING = 'pending', 'Pending'
+
+
+# user_id of the row that aggregates every user (MTN rows only have this one)
+ALL_USERS = 0
+
+
+class DailyRollup(models.Model):
+    """Per-day, per-provider, per-status count and amount (see rollups.py)."""
+    day = models.DateField()
+    provider = models.CharField(max_length=20, choices=Provider.choices)
+    status = models.CharField(max_length=10, choices=RollupStatus.choices)
+    user_id = models.IntegerField(default=ALL_USERS)
+    count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'provider', 'day', 'status'], name='reporting_rollup_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.provider} {self.status}: {self.count}"
+
+
+class LedgerProvider(models.IntegerChoices):
+    MPESA_STK = 1, 'M-Pesa STK Push'
+    MPESA_B2C = 2, 'M-Pesa B2C'
+    MTN_COLLECTION = 3, 'MTN Collection'
+    MTN_DISBURSEMENT = 4, 'MTN Disbursement'
+    PAYHERO = 5, 'PayHero'
+    PAYSTACK = 6, 'Paystack'
+    STRIPE = 7, 'Stripe'
+
+
+class LedgerStatus(models.IntegerChoices):
+    PENDING = 0, 'Pending'
+    SUCCESS = 1, 'Success'
+    FAILED = 2, 'Failed'
+    REVERSED = 3, 'Reversed'  # undoes an earlier SUCCESS entry
+
+
+class AppendOnlyError(Exception):
+    pass
+
+
+class LedgerQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise AppendOnlyError('Ledger entries cannot be updated; append a new entry instead')
+
+    def delete(self):
+        raise AppendOnlyError('Ledger entries cannot be deleted')
+
+    def purge(self):
+        """Really delete: for benchmark fixtures only, never for payments."""
+        return super().delete()
+
+    def settled(self):
+        return self.filter(status__in=(LedgerStatus.SUCCESS, LedgerStatus.REVERSED))
+
+    def balance(self):
+        """Net settled amount in minor units (money in minus money out)."""
+        return self.settled().aggregate(total=models.Sum('amount_minor'))['total'] or 0
+
+
+class LedgerEntry(models.Model):
+    """One money movement event from any provider (see ledger.py).
+
+    Rows are only ever inserted: a status change appends a new entry for the
+    same (provider, source_id). amount_minor is signed, positive for money
+    in and negative for money out. Entries are stamped when appended, so
+    occurred_at follows insertion order and the table can be range-partitioned
+    on it; only backfill_ledger writes past dates.
+    """
+    occurred_at = models.DateTimeField(default=timezone.now)
+    provider = models.PositiveSmallIntegerField(choices=LedgerProvider.choices)
+    status = models.PositiveSmallIntegerField(choices=LedgerStatus.choices)
+    amount_minor = models.BigIntegerField()
+    currency = models.CharField(max_length=3)
+    source_id = models.BigIntegerField()  # pk in the provider's own transaction table
+    reference = models.CharField(max_length=200, blank=True)
+    user_id = models.IntegerField(null=True, blank=True)
+
+    objects = LedgerQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['occurred_at'], name='reporting_ledger_time_idx'),
+            models.Index(fields=['provider', 'occurred_at'], name='reporting_ledger_provider_idx'),
+            models.Index(fields=['user_id', 'occurred_at'], name='reporting_ledger_user_idx'),
+            models.Index(fields=['provider', 'source_id'], name='reporting_ledger_source_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise AppendOnlyError('Ledger entries cannot be updated; append a new entry instead')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise AppendOnlyError('Ledger entries cannot be deleted')
+
+    def __str__(self):
+        return f"{self.get_provider_display()} #{self.source_id} {self.get_status_display()}: {self.amount_minor}"
@@ -0,0 +1,329 @@
+"""
+Reconciliation of local transaction rows against provider truth
+
+    payhero          pages through the api/v2/transactions statement
+    mtn_collection   status check for every collection still PENDING
+    mtn_disbursement status check for every transfer still PENDING
+    paystack         verify for every unverified payment
+
+Each side is handled a bounded batch at a time. A statement page (or a
+keyset batch of local rows) becomes a hash index on its reference key.
+The other side is fetched for exactly those keys with one query (or one
+rate-limited status call per row on a small thread pool), and the two are
+diffed in one pass. Work is O(n) and memory is O(batch), however long the
+statement.
+
+Differences go to a Report: counters and a bounded sample, with every
+mismatch handed to an optional sink (the command writes them as NDJSON).
+Status drift, where the local row is still pending and the provider has
+a final answer, is repaired in place through the same settle paths the
+callbacks use, so rollups and the ledger follow. Anything else (unknown
+references, amount differences, final local statuses the provider
+disagrees with) is only reported.
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Optional
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from core.ratelimit import RateLimiter
+from . import ledger, rollups
+from .export import payhero_status, paystack_status
+from .models import LedgerProvider, Provider, RollupStatus
+from .rollups import mtn_status
+
+logger = logging.getLogger(__name__)
+
+PAYHERO, MTN_COLLECTION, MTN_DISBURSEMENT, PAYSTACK = 'payhero', 'mtn_collection', 'mtn_disbursement', 'paystack'
+PROVIDERS = (PAYHERO, MTN_COLLECTION, MTN_DISBURSEMENT, PAYSTACK)
+
+# Mismatch kinds
+MISSING_LOCAL = 'missing_local'  # on the provider's statement, not in our tables
+STATUS = 'status'
+AMOUNT = 'amount'
+UNCHECKED = 'unchecked'  # the provider call failed; try again next run
+
+
+@dataclass
+class Mismatch:
+    provider: str
+    reference: str
+    kind: str
+    local_status: Optional[str] = None
+    remote_status: Optional[str] = None
+    local_amount: Optional[str] = None
+    remote_amount: Optional[str] = None
+    repaired: bool = False
+
+
+class Report:
+    """Running totals of one reconciliation run; keeps at most `keep` mismatches in memory."""
+
+    def __init__(self, sink=None, keep=100):
+        self.sink = sink
+        self.keep = keep
+        self.checked = Counter()
+        self.matched = Counter()
+        self.repaired = Counter()
+        self.kinds = Counter()
+        self.sample = []
+
+    def match(self, provider):
+        self.checked[provider] += 1
+        self.matched[provider] += 1
+
+    def mismatch(self, mismatch):
+        self.checked[mismatch.provider] += 1
+        self.kinds[(mismatch.provider, mismatch.kind)] += 1
+        if mismatch.repaired:
+            self.repaired[mismatch.provider] += 1
+        if len(self.sample) < self.keep:
+            self.sample.append(mismatch)
+        if self.sink:
+            self.sink(asdict(mismatch))
+
+    def summary(self):
+        return {
+            provider: {
+                'checked': self.checked[provider], 'matched': self.matched[provider],
+                'repaired': self.repaired[provider],
+                'mismatches': {kind: n for (p, kind), n in sorted(self.kinds.items()) if p == provider},
+            }
+            for provider in self.checked
+        }
+
+
+def _amount_differs(local, remote):
+    return remote is not None and ledger.to_minor(local) != ledger.to_minor(remote)
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+class Reconciler:
+    def __init__(self, report=None, repair=True, batch_size=200, workers=8, rate=10, older_than=timedelta(minutes=10),
+                 since=None, clients=None):
+        self.report = report or Report()
+        self.repair = repair
+        self.batch_size = batch_size
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.older_than = older_than  # leave fresh rows to callbacks and the status resolver
+        self.since = since
+        self.clients = clients or {}
+
+    def run(self, providers=None):
+        for provider in providers or PROVIDERS:
+            if not self.available(provider):
+                logger.info(f"Skipping {provider} reconciliation: app not installed")
+                continue
+            getattr(self, f'reconcile_{provider}')()
+        return self.report
+
+    @staticmethod
+    def available(provider):
+        app = {PAYHERO: 'payhero', PAYSTACK: 'paystack'}.get(provider)
+        return app is None or apps.is_installed(app)
+
+    # ---- helpers ----
+
+    def _stale(self, queryset, date_field):
+        """Keyset batches (by id) of rows created in [since, now - older_than)."""
+        queryset = queryset.filter(**{f'{date_field}__lt': timezone.now() - self.older_than})
+        if self.since:
+            queryset = queryset.filter(**{f'{date_field}__gte': self.since})
+        last = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last).order_by('id')[:self.batch_size])
+            if not batch:
+                return
+            yield batch
+            last = batch[-1].id
+
+    def _client(self, provider, factory):
+        """Injected client, else the shared one; fetched per batch so a run with no work never provisions one."""
+        return self.clients.get(provider) or factory()
+
+    def _fan_out(self, call, items):
+        """call(item) for every item on the thread pool, at most `rate` calls per second."""
+        def limited(item):
+            self.limiter.acquire()
+            try:
+                return call(item)
+            except Exception as e:
+                return {'error': str(e)}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(limited, items))
+
+    # ---- PayHero: statement pages against PayHeroTransaction ----
+
+    def reconcile_payhero(self, max_pages=10000):
+        from payhero.models import PayHeroTransaction
+        from payhero.services.payment_service import PaymentService
+
+        service = self.clients.get(PAYHERO) or PaymentService()
+        for page in range(1, max_pages + 1):
+            response = service.list_transactions(page=page, per=self.batch_size)
+            rows = response.get('transactions') or response.get('data') or []
+            remote = {row['reference']: row for row in rows if row.get('reference')}
+            local = PayHeroTransaction.objects.in_bulk(list(remote), field_name='reference')
+            repairs = []
+            for reference, row in remote.items():
+                txn = local.get(reference)
+                if txn is None:
+                    self.report.mismatch(Mismatch(PAYHERO, reference, MISSING_LOCAL, remote_status=row.get('status'),
+                                                  remote_amount=_text(row.get('amount'))))
+                    continue
+                mismatch = self._compare(PAYHERO, reference, payhero_status(txn.status), txn.status, txn.amount,
+                                         payhero_status(row.get('status')), row.get('status'), row.get('amount'))
+                if mismatch and mismatch.kind == STATUS and mismatch.repaired:
+                    repairs.append((txn, row))
+            if repairs:
+                self._repair_payhero(repairs)
+            if len(rows) < self.batch_size:
+                return
+
+    def _repair_payhero(self, repairs):
+        from payhero.models import PayHeroTransaction
+
+        with transaction.atomic():
+            # The webhook may have settled some rows since they were read; only still-pending ones are repaired
+            current = dict(PayHeroTransaction.objects.select_for_update()
+                           .filter(pk__in=[txn.pk for txn, _ in repairs]).values_list('pk', 'status'))
+            repairs = [(txn, row) for txn, row in repairs
+                       if txn.pk in current and payhero_status(current[txn.pk]) == RollupStatus.PENDING]
+            for txn, row in repairs:
+                txn.status = row['status']
+                txn.last_status_payload = row
+                txn.updated_at = timezone.now()
+            PayHeroTransaction.objects.bulk_update([txn for txn, _ in repairs],
+                                                   ['status', 'last_status_payload', 'updated_at'])
+            ledger.transitions(LedgerProvider.PAYHERO, ((txn, RollupStatus.PENDING) for txn, _ in repairs))
+
+    # ---- MTN: status checks for rows still PENDING ----
+
+    def reconcile_mtn_collection(self):
+        from mtnmo.clients import get_collection
+        from mtnmo.models import CollectionTransaction
+        from mtnmo.status_resolver import PENDING, settle_from_callback
+
+        pending = CollectionTransaction.objects.filter(status=PENDING).exclude(ref__isnull=True)
+        for batch in self._stale(pending, 'created_at'):
+            client = self._client(MTN_COLLECTION, get_collection)
+            results = self._fan_out(lambda txn: client.getTransactionStatus(txn.ref), batch)
+            for txn, result in zip(batch, results):
+                mismatch = self._check_mtn(MTN_COLLECTION, txn, result)
+                if mismatch and mismatch.repaired:
+                    settle_from_callback(txn.external_id, result['status'], result.get('financialTransactionId'))
+
+    def reconcile_mtn_disbursement(self):
+        from mtnmo.bulk_disbursement import settle_from_callback
+        from mtnmo.clients import get_disbursement
+        from mtnmo.models import DisbursementTransaction
+        from mtnmo.status_resolver import PENDING
+
+        pending = DisbursementTransaction.objects.filter(status=PENDING)
+        for batch in self._stale(pending, 'created_at'):
+            client = self._client(MTN_DISBURSEMENT, get_disbursement)
+            results = self._fan_out(lambda txn: client.getTransactionStatus(str(txn.ref)), batch)
+            for txn, result in zip(batch, results):
+                data = result if 'error' in result else result.get('data') or {}
+                mismatch = self._check_mtn(MTN_DISBURSEMENT, txn, data)
+                if not (mismatch and mismatch.repaired):
+                    continue
+                if txn.batch_id:
+                    settle_from_callback(txn.ref, txn.external_id, data['status'], data.get('financialTransactionId'))
+                else:
+                    self._settle_disbursement(txn, data)
+
+    def _check_mtn(self, provider, txn, result):
+        if 'error' in result or not result.get('status'):
+            self.report.mismatch(Mismatch(provider, str(txn.ref), UNCHECKED, local_status=txn.status))
+            return None
+        return self._compare(provider, str(txn.ref), mtn_status(txn.status), txn.status, txn.amount,
+                             mtn_status(result['status']), result['status'], result.get('amount'))
+
+    def _settle_disbursement(self, txn, data):
+        from mtnmo.models import DisbursementTransaction
+        from mtnmo.status_resolver import PENDING
+
+        with transaction.atomic():
+            updated = DisbursementTransaction.objects.filter(pk=txn.pk, status=PENDING).update(
+                status=data['status'],
+                financial_transaction_id=data.get('financialTransactionId') or txn.financial_transaction_id,
+            )
+            if updated:
+                rollups.transition(Provider.MTN_DISBURSEMENT, txn.created_at, RollupStatus.PENDING,
+                                   mtn_status(data['status']), txn.amount)
+                txn.status = data['status']
+                ledger.transition(LedgerProvider.MTN_DISBURSEMENT, txn, RollupStatus.PENDING)
+
+    # ---- Paystack: verify unverified payments ----
+
+    def reconcile_paystack(self):
+        from paystack.models import Payment
+        from paystack.paystack import Paystack
+
+        client = self.clients.get(PAYSTACK) or Paystack()
+
+        def verify(payment):
+            ok, data = client.verify_payment(payment.ref)
+            return data if ok and isinstance(data, dict) else {'error': data}
+
+        for batch in self._stale(Payment.objects.filter(verified=False), 'date_created'):
+            results = self._fan_out(verify, batch)
+            repaired = []
+            for payment, data in zip(batch, results):
+                if 'error' in data:
+                    self.report.mismatch(Mismatch(PAYSTACK, payment.ref, UNCHECKED, local_status='unverified'))
+                    continue
+                remote = data.get('status')
+                remote_bucket = {'success': RollupStatus.SUCCESS, 'failed': RollupStatus.FAILED,
+                                 'reversed': RollupStatus.FAILED}.get(remote, RollupStatus.PENDING)
+                remote_amount = data['amount'] / 100 if data.get('amount') is not None else None
+                mismatch = self._compare(PAYSTACK, payment.ref, paystack_status(payment.verified), 'unverified',
+                                         payment.amount, remote_bucket, remote, remote_amount,
+                                         repairable=remote_bucket == RollupStatus.SUCCESS)
+                if mismatch and mismatch.repaired:
+                    repaired.append(payment)
+            if repaired:
+                with transaction.atomic():
+                    # Payments the webhook verified meanwhile already have their ledger entry
+                    unverified = set(Payment.objects.select_for_update()
+                                     .filter(pk__in=[p.pk for p in repaired], verified=False)
+                                     .values_list('pk', flat=True))
+                    repaired = [p for p in repaired if p.pk in unverified]
+                    Payment.objects.filter(pk__in=unverified).update(verified=True)
+                    for payment in repaired:
+                        payment.verified = True
+                    ledger.transitions(LedgerProvider.PAYSTACK, ((p, RollupStatus.PENDING) for p in repaired))
+
+    # ---- diff ----
+
+    def _compare(self, provider, reference, local_bucket, local_status, local_amount, remote_bucket, remote_status,
+                 remote_amount, repairable=True):
+        """Record the outcome for one reference; returns the Mismatch, or None when both sides agree.
+
+        Amount differences are never repaired. A status difference is, when
+        the local row is still pending and the provider's answer is final.
+        """
+        if _amount_differs(local_amount, remote_amount):
+            mismatch = Mismatch(provider, reference, AMOUNT, local_status, remote_status, _text(local_amount),
+                                _text(remote_amount))
+        elif local_bucket != remote_bucket:
+            mismatch = Mismatch(provider, reference, STATUS, local_status, remote_status, _text(local_amount),
+                                _text(remote_amount))
+            mismatch.repaired = (self.repair and repairable and local_bucket == RollupStatus.PENDING
+                                 and remote_bucket != RollupStatus.PENDING)
+        else:
+            self.report.match(provider)
+            return None
+        self.report.mismatch(mismatch)
+        return mismatch
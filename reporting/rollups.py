@@ -0,0 +1,103 @@
+"""
+Incremental maintenance of DailyRollup.
+
+Payment code reports row creation and status changes here; each event adds to
+(or moves between) the per-day status buckets with an UPDATE ... SET count =
+count + n, so readers never scan raw transaction tables. Every bucket is kept
+once per user and once for ALL_USERS. backfill.py rebuilds any range from the
+raw rows if the two ever drift.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ALL_USERS, DailyRollup, RollupStatus
+
+logger = logging.getLogger(__name__)
+
+
+def mpesa_status(result_code):
+    """Bucket for an M-Pesa STK/B2C result_code."""
+    if result_code is None:
+        return RollupStatus.PENDING
+    return RollupStatus.SUCCESS if int(result_code) == 0 else RollupStatus.FAILED
+
+
+def mtn_status(status):
+    """Bucket for an MTN MoMo transaction status."""
+    if not status or status == 'PENDING':
+        return RollupStatus.PENDING
+    return RollupStatus.SUCCESS if status == 'SUCCESSFUL' else RollupStatus.FAILED
+
+
+def _day(created_at):
+    return timezone.localdate(created_at) if created_at else timezone.localdate()
+
+
+def _upsert(day, provider, status, user_id, count, amount):
+    key = dict(day=day, provider=provider, status=status, user_id=user_id)
+    changes = dict(count=F('count') + count, amount=F('amount') + amount, updated_at=timezone.now())
+    if DailyRollup.objects.filter(**key).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            DailyRollup.objects.create(count=count, amount=amount, **key)
+    except IntegrityError:
+        # Another worker created the bucket first
+        DailyRollup.objects.filter(**key).update(**changes)
+
+
+def _apply(deltas):
+    """deltas: {(day, provider, status, user_id): [count, amount]}"""
+    try:
+        with transaction.atomic():
+            # Fixed lock order so concurrent callbacks cannot deadlock on shared buckets
+            for (day, provider, status, user_id), (count, amount) in sorted(deltas.items()):
+                if count or amount:
+                    _upsert(day, provider, status, user_id, count, amount)
+    except Exception as e:
+        # Reporting must never fail a payment; backfill_rollups repairs drift
+        logger.error(f"Error updating daily rollups: {e}")
+
+
+def _add(deltas, provider, created_at, user_id, status, count, amount):
+    day = _day(created_at)
+    for uid in {ALL_USERS, user_id or ALL_USERS}:
+        bucket = deltas[(day, provider, status, uid)]
+        bucket[0] += count
+        bucket[1] += amount
+
+
+def record(provider, created_at, status, amount, user_id=None):
+    """Count a newly stored transaction."""
+    record_many(provider, [(created_at, user_id, status, amount)])
+
+
+def record_many(provider, items):
+    """Count many new transactions: iterable of (created_at, user_id, status, amount)."""
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for created_at, user_id, status, amount in items:
+        _add(deltas, provider, created_at, user_id, status, 1, Decimal(amount or 0))
+    _apply(deltas)
+
+
+def transition(provider, created_at, from_status, to_status, amount, user_id=None, from_amount=None):
+    """Move a transaction between buckets (e.g. pending -> success on callback)."""
+    transitions(provider, [(created_at, user_id, from_status, to_status, amount, from_amount)])
+
+
+def transitions(provider, items):
+    """Batch form of transition: iterable of (created_at, user_id, from, to, amount, from_amount)."""
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for created_at, user_id, from_status, to_status, amount, from_amount in items:
+        amount = Decimal(amount or 0)
+        from_amount = amount if from_amount is None else Decimal(from_amount or 0)
+        if from_status == to_status and from_amount == amount:
+            continue
+        _add(deltas, provider, created_at, user_id, from_status, -1, -from_amount)
+        _add(deltas, provider, created_at, user_id, to_status, 1, amount)
+    _apply(deltas)
@@ -0,0 +1,225 @@
+import csv
+import gzip
+import io
+import json
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from core import idempotency
+from mpesa.models import MpesaB2CTransaction, MpesaTransaction
+from mpesa.services.callback import CallbackService
+from mtnmo.models import CollectionTransaction, DisbursementTransaction
+from mtnmo.status_resolver import PENDING, settle_from_callback
+from . import export, ledger, rollups
+from .reconcile import MTN_COLLECTION, MTN_DISBURSEMENT, Reconciler
+from .backfill import backfill
+from .models import (ALL_USERS, AppendOnlyError, DailyRollup, LedgerEntry, LedgerProvider, LedgerStatus, Provider,
+                     RollupStatus)
+
+
+def _snapshot():
+    return sorted(
+        DailyRollup.objects.exclude(count=0, amount=0)
+        .values_list('day', 'provider', 'status', 'user_id', 'count', 'amount')
+    )
+
+
+class RollupTests(TestCase):
+    def test_incremental_updates_match_backfill(self):
+        stk = MpesaTransaction.objects.create(
+            merchant_request_id='mr-1', checkout_request_id='ws-1', result_desc='', amount=Decimal('10.00'), user_id=3,
+        )
+        rollups.record(Provider.MPESA_STK, stk.created_at, RollupStatus.PENDING, stk.amount, stk.user_id)
+        CallbackService().handle_stk_callback({'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1', 'CheckoutRequestID': 'ws-1', 'ResultCode': 0, 'ResultDesc': 'ok',
+            'CallbackMetadata': {'Item': [{'Name': 'Amount', 'Value': 12}]},
+        }}})
+
+        collection = CollectionTransaction.objects.create(
+            ref='r-1', external_id='ext-1', amount=Decimal('5.50'), currency='LRD', party_id='231770000000',
+            status=PENDING,
+        )
+        rollups.record(Provider.MTN_COLLECTION, collection.created_at, RollupStatus.PENDING, collection.amount)
+        self.assertEqual(settle_from_callback('ext-1', 'FAILED'), 1)
+        self.assertEqual(settle_from_callback('ext-1', 'FAILED'), 0)
+
+        today = timezone.localdate()
+        self.assertEqual(DailyRollup.objects.get(
+            day=today, provider=Provider.MPESA_STK, status=RollupStatus.SUCCESS, user_id=3
+        ).amount, Decimal('12.00'))
+        self.assertEqual(DailyRollup.objects.get(
+            day=today, provider=Provider.MTN_COLLECTION, status=RollupStatus.FAILED, user_id=ALL_USERS
+        ).count, 1)
+
+        incremental = _snapshot()
+        backfill()
+        self.assertEqual(_snapshot(), incremental)
+
+    def test_backfill_limits_to_range(self):
+        old = MpesaTransaction.objects.create(
+            merchant_request_id='mr-2', checkout_request_id='ws-2', result_desc='', amount=1, result_code=0,
+        )
+        MpesaTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        MpesaTransaction.objects.create(
+            merchant_request_id='mr-3', checkout_request_id='ws-3', result_desc='', amount=2, result_code=0,
+        )
+
+        backfill(start_day=timezone.localdate() - timedelta(days=1))
+
+        self.assertEqual(list(DailyRollup.objects.values_list('day', 'amount')),
+                         [(timezone.localdate(), Decimal('2.00'))])
+
+
+class LedgerExportTests(TestCase):
+    def setUp(self):
+        MpesaTransaction.objects.create(merchant_request_id='mr-1', checkout_request_id='ws-1', result_desc='',
+                                        amount=Decimal('10.50'), result_code=0, mpesa_receipt_number='RCP1',
+                                        phone_number='254700000001')
+        old = MpesaTransaction.objects.create(merchant_request_id='mr-2', checkout_request_id='ws-2',
+                                              result_desc='', amount=1)
+        MpesaTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=3))
+        CollectionTransaction.objects.create(external_id='ext-1', amount=5, currency='LRD', party_id='231770000000',
+                                             status='FAILED')
+
+    def test_rows_share_one_schema_and_respect_the_range(self):
+        today = timezone.localdate()
+        rows = [dict(zip(export.COLUMNS, row)) for row in export.rows(today - timedelta(days=1), today)]
+        self.assertEqual(
+            [(r['provider'], r['reference'], r['provider_reference'], r['currency'], r['status']) for r in rows],
+            [('mpesa_stk', 'ws-1', 'RCP1', 'KES', RollupStatus.SUCCESS),
+             ('mtn_collection', 'ext-1', None, 'LRD', RollupStatus.FAILED)],
+        )
+        # Each day is its own query window; the old row shows up once its day is included
+        self.assertEqual(len(list(export.rows(today - timedelta(days=3), today))), 3)
+
+    def test_endpoint_streams_gzipped_csv_to_admins(self):
+        url = '/reporting/ledger/export/'
+        today = timezone.localdate().isoformat()
+        self.assertEqual(self.client.get(url, {'since': today}).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser('ledger-admin', password='x'))
+        response = self.client.get(url, {'since': today, 'gzip': '1', 'provider': 'mpesa_stk'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([(r['reference'], r['amount']) for r in rows], [('ws-1', '10.50')])
+
+        ndjson = self.client.get(url, {'since': today, 'output': 'ndjson'})
+        lines = [json.loads(line) for line in b''.join(ndjson.streaming_content).decode().splitlines()]
+        self.assertEqual([line['provider'] for line in lines], ['mpesa_stk', 'mtn_collection'])
+        self.assertEqual(self.client.get(url, {'since': today, 'provider': 'paypal'}).status_code, 400)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.addCleanup(idempotency.recent.clear)
+
+    def test_callbacks_append_entries_in_minor_units(self):
+        stk = MpesaTransaction.objects.create(merchant_request_id='mr-1', checkout_request_id='ws-1', result_desc='',
+                                              amount=Decimal('10.50'), user_id=3)
+        ledger.record(LedgerProvider.MPESA_STK, stk)
+        CallbackService().handle_stk_callback({'Body': {'stkCallback': {
+            'MerchantRequestID': 'mr-1', 'CheckoutRequestID': 'ws-1', 'ResultCode': 0, 'ResultDesc': 'ok',
+        }}})
+        pending = CollectionTransaction.objects.create(external_id='ext-1', amount=5, currency='LRD', status=PENDING)
+        ledger.record(LedgerProvider.MTN_COLLECTION, pending)
+        settle_from_callback('ext-1', 'FAILED')
+
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by('id').values_list('provider', 'status', 'amount_minor', 'currency',
+                                                                'reference', 'user_id')),
+            [(LedgerProvider.MPESA_STK, LedgerStatus.PENDING, 1050, 'KES', 'ws-1', 3),
+             (LedgerProvider.MPESA_STK, LedgerStatus.SUCCESS, 1050, 'KES', 'ws-1', 3),
+             (LedgerProvider.MTN_COLLECTION, LedgerStatus.PENDING, 500, 'LRD', 'ext-1', None),
+             (LedgerProvider.MTN_COLLECTION, LedgerStatus.FAILED, 500, 'LRD', 'ext-1', None)],
+        )
+        self.assertEqual(LedgerEntry.objects.filter(currency='KES').balance(), 1050)
+
+    def test_reversal_and_append_only(self):
+        b2c = MpesaB2CTransaction.objects.create(conversation_id='conv-1', originator_conversation_id='o-1',
+                                                 response_code='0', response_description='', amount=20,
+                                                 phone_number='254700000001', command_id='BusinessPayment',
+                                                 remarks='', occasion='', result_code=0)
+        ledger.record(LedgerProvider.MPESA_B2C, b2c)
+        b2c.result_code = 1
+        ledger.transition(LedgerProvider.MPESA_B2C, b2c, RollupStatus.SUCCESS)
+
+        self.assertEqual(list(LedgerEntry.objects.order_by('id').values_list('status', 'amount_minor')),
+                         [(LedgerStatus.SUCCESS, -2000), (LedgerStatus.REVERSED, 2000), (LedgerStatus.FAILED, -2000)])
+        self.assertEqual(LedgerEntry.objects.balance(), 0)
+        with self.assertRaises(AppendOnlyError):
+            LedgerEntry.objects.update(status=LedgerStatus.PENDING)
+        with self.assertRaises(AppendOnlyError):
+            LedgerEntry.objects.first().delete()
+
+    def test_backfill_skips_rows_with_history(self):
+        recorded = MpesaTransaction.objects.create(merchant_request_id='mr-2', checkout_request_id='ws-2',
+                                                   result_desc='', amount=1)
+        ledger.record(LedgerProvider.MPESA_STK, recorded)
+        MpesaTransaction.objects.create(merchant_request_id='mr-3', checkout_request_id='ws-3', result_desc='',
+                                        amount=2, result_code=0)
+
+        self.assertEqual(ledger.backfill(), 1)
+        self.assertEqual(ledger.backfill(), 0)
+        self.assertEqual(LedgerEntry.objects.settled().get().reference, 'ws-3')
+
+
+class _StatusClient:
+    def __init__(self, answers):
+        self.answers = answers
+
+    def getTransactionStatus(self, ref):
+        return self.answers[str(ref)]
+
+
+class ReconcileTests(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(hours=1)
+        for i, amount in enumerate((5, 6, 7), start=1):
+            CollectionTransaction.objects.create(ref=f'ref-{i}', external_id=f'ext-{i}', amount=amount,
+                                                 currency='LRD', status=PENDING)
+        CollectionTransaction.objects.update(created_at=old)
+        self.transfer = DisbursementTransaction.objects.create(ref=uuid.uuid4(), amount=9, currency='LRD',
+                                                              external_id='dis-1', party_id='231770000000',
+                                                              status=PENDING)
+        DisbursementTransaction.objects.update(created_at=old)
+        self.clients = {
+            MTN_COLLECTION: _StatusClient({
+                'ref-1': {'status': 'SUCCESSFUL', 'amount': '5', 'financialTransactionId': 'ft-1'},
+                'ref-2': {'error': 'timed out'},
+                'ref-3': {'status': 'SUCCESSFUL', 'amount': '70'},
+            }),
+            MTN_DISBURSEMENT: _StatusClient({
+                str(self.transfer.ref): {'response': 200, 'data': {'status': 'FAILED', 'amount': '9'}},
+            }),
+        }
+
+    def test_repairs_status_drift_and_reports_the_rest(self):
+        reconciler = Reconciler(clients=self.clients, rate=0, workers=2, batch_size=2)
+        report = reconciler.run([MTN_COLLECTION, MTN_DISBURSEMENT])
+        mismatches = {(m.reference, m.kind, m.repaired) for m in report.sample}
+        self.assertEqual(mismatches, {('ref-1', 'status', True), ('ref-2', 'unchecked', False),
+                                      ('ref-3', 'amount', False), (str(self.transfer.ref), 'status', True)})
+
+        self.assertEqual(dict(CollectionTransaction.objects.values_list('ref', 'status')),
+                         {'ref-1': 'SUCCESSFUL', 'ref-2': PENDING, 'ref-3': PENDING})
+        self.assertEqual(CollectionTransaction.objects.get(ref='ref-1').financial_transaction_id, 'ft-1')
+        self.transfer.refresh_from_db()
+        self.assertEqual(self.transfer.status, 'FAILED')
+        self.assertEqual(
+            sorted(LedgerEntry.objects.values_list('provider', 'status')),
+            [(LedgerProvider.MTN_COLLECTION, LedgerStatus.SUCCESS),
+             (LedgerProvider.MTN_DISBURSEMENT, LedgerStatus.FAILED)],
+        )
+        self.assertEqual(report.summary()[MTN_COLLECTION]['repaired'], 1)
+
+    def test_dry_run_only_reports(self):
+        report = Reconciler(clients=self.clients, rate=0, repair=False).run([MTN_COLLECTION])
+        self.assertEqual(report.repaired[MTN_COLLECTION], 0)
+        self.assertEqual(report.summary()[MTN_COLLECTION]['mismatches'], {'amount': 1, 'status': 1, 'unchecked': 1})
+        self.assertFalse(CollectionTransaction.objects.exclude(status=PENDING).exists())
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('ledger/export/', views.ledger_export, name='ledger_export'),
+]
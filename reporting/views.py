@@ -0,0 +1,49 @@
+from datetime import date
+
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from . import export
+
+MAX_EXPORT_DAYS = 366
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def ledger_export(request):
+    """Stream the cross-provider ledger for since..until as CSV or NDJSON.
+
+    ?since=&until= (YYYY-MM-DD, inclusive), ?output=csv|ndjson, ?gzip=1,
+    ?provider= (repeatable). `format` is left to DRF's content negotiation.
+    """
+    try:
+        since = date.fromisoformat(request.GET['since'])
+        until = date.fromisoformat(request.GET.get('until') or request.GET['since'])
+    except KeyError:
+        return Response({'error': 'since is required'}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return Response({'error': f'Invalid date: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= (until - since).days < MAX_EXPORT_DAYS:
+        return Response({'error': f'until must be on or after since, at most {MAX_EXPORT_DAYS} days apart'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    fmt = request.GET.get('output', export.CSV)
+    if fmt not in export.FORMATS:
+        return Response({'error': f"output must be one of {', '.join(export.FORMATS)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    providers = request.GET.getlist('provider')
+    unknown = set(providers) - set(export.available_providers())
+    if unknown:
+        return Response({'error': f"Unknown provider(s): {', '.join(sorted(unknown))}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    compress = request.GET.get('gzip') in ('1', 'true')
+
+    response = StreamingHttpResponse(
+        export.export(export.rows(since, until, providers), fmt, compress),
+        content_type='application/gzip' if compress else export.CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(since, until, fmt, compress)}"'
+    return response
@@ -6,6 +6,10 @@ from django.views import View
 from decouple import config
 import stripe
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+from core import idempotency
+from reporting import ledger
+from reporting.models import LedgerProvider
 from .models import StripeTransaction
 
 class HomePageView(View):
@@ -24,6 +28,7 @@ def create_checkout_session(request):
     if request.method == 'POST':
         domain_url = config('STRIPE_DOMAIN_URL')
         stripe.api_key = config('STRIPE_SECRET_KEY')
+        stripe.api_base = config('STRIPE_API_BASE', default=stripe.api_base)
         product_name = request.POST.get('productName')
         amount = int(request.POST.get('amount')) * 100
         quantity = int(request.POST.get('quantity'))
@@ -72,7 +77,7 @@ def create_stripe_transaction(session):
     payment_intent = session.get('payment_intent')
     status = session.get('status')
 
-    StripeTransaction.objects.create(
+    stripe_transaction = StripeTransaction.objects.create(
         product_name=product_name,
         amount_subtotal=amount_subtotal / 100 if amount_subtotal else None,  # Convert to dollars
         amount_total=amount_total / 100 if amount_total else None,  # Convert to dollars
@@ -85,6 +90,7 @@ def create_stripe_transaction(session):
         payment_intent=payment_intent,
         status=status
     )
+    ledger.record(LedgerProvider.STRIPE, stripe_transaction)
 
 @csrf_exempt
 def stripe_webhook(request):
@@ -101,10 +107,12 @@ def stripe_webhook(request):
         # Invalid payload
         return HttpResponse(status=400)
 
-    # Handle the checkout.session.completed event
+    # Handle the checkout.session.completed event (once per Stripe event id)
     if event['type'] == 'checkout.session.completed':
         session = event['data']['object']
         # print("Session: ", session)
-        create_stripe_transaction(session)
+        with transaction.atomic():
+            if idempotency.claim('stripe', event['id']):
+                create_stripe_transaction(session)
     
     return HttpResponse(status=200)
\ No newline at end of file